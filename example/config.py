@@ -1,7 +1,7 @@
 from lxml import etree
 
 from swallow.config import BaseConfig
-from swallow.mappers import BaseMapper
+from swallow.mappers import BaseMapper, memoized_property, xpaths
 from swallow.populator import BasePopulator
 from swallow.builder import BaseBuilder
 
@@ -24,20 +24,20 @@ class FeedBuilder(BaseBuilder):
         def _iter_mappers(cls, file_path, f):
             xml = etree.parse(f)
             root = xml.getroot()
-            for item in root.xpath('.//n:entry', namespaces=NS):
+            for item in xpaths.get('.//n:entry', NS)(root):
                 yield cls(item)
 
         @property
         def _instance_filters(self):
             return {'title': self.title}
 
-        @property
+        @memoized_property
         def title(self):
-            return self.item.xpath('.//n:title', namespaces=NS)[0].text[:255]
+            return xpaths.get('.//n:title', NS)(self.item)[0].text[:255]
 
-        @property
+        @memoized_property
         def content(self):
-            return self.item.xpath('.//n:content', namespaces=NS)[0].text
+            return xpaths.get('.//n:content', NS)(self.item)[0].text
 
     class Populator(BasePopulator):
 
@@ -10,13 +10,36 @@ from django.conf import settings
 from sneak.admin import SneakAdmin
 
 from query import VirtualFileSystemQuerySet, SwallowConfigurationQuerySet
+from query import DirectoryQueryResult
 from models import VirtualFileSystemElement, SwallowConfiguration, Matching
-from util import get_configurations
+from models import ImportedFile, FileCount
+from util import configurations
+from archive import Archive
 
 
 admin.site.register(Matching)
 
 
+class ImportedFileAdmin(admin.ModelAdmin):
+    """Admin to query the ledger of imported files"""
+
+    list_display = ('path', 'configuration', 'status', 'date', 'digest')
+    list_filter = ('configuration', 'status')
+    search_fields = ('path', 'digest')
+    date_hierarchy = 'date'
+
+admin.site.register(ImportedFile, ImportedFileAdmin)
+
+
+class FileCountAdmin(admin.ModelAdmin):
+    """Admin of the file counts, see ``swallow_count`` command"""
+
+    list_display = ('configuration', 'directory', 'count', 'date')
+    list_filter = ('configuration', 'directory')
+
+admin.site.register(FileCount, FileCountAdmin)
+
+
 #
 # Administration for browsing SWALLOW_DIRECTORY
 #
@@ -30,14 +53,13 @@ class VirtualFileSystemChangeListView(ChangeList):
 
 
 def get_configuration(directory):
-    CONFIGURATIONS = get_configurations()
     components = directory.split('/')
     configuration_name, swallow_directory, path = (
         components[0],
         components[1],
         components[2:]
     )
-    configuration = CONFIGURATIONS[configuration_name]
+    configuration = configurations.get(configuration_name)
     return configuration
 
 
@@ -46,32 +68,88 @@ def get_swallow_dir_and_filepath(path):
     return components[1], components[2:]
 
 
+def get_archive_and_name(configuration, filepath):
+    """Returns the archive and the name of the archived file ``filepath``
+    of the ``archive`` directory, ``None`` for a day"""
+    if len(filepath) < 2:
+        return None, None
+    archive = Archive(configuration.archive_dir(), filepath[0])
+    return archive, os.path.join(*filepath[1:])
+
+
+def get_input_path(configuration, partial_file_path):
+    """Returns the path of ``partial_file_path``, a path relative to done
+    or error directory, in input directory or ``None`` if it's a directory
+    of their layout"""
+    partial_file_path = configuration.input_path(partial_file_path)
+    if partial_file_path is None:
+        return None
+    target_path = os.path.join(configuration.input_dir(), partial_file_path)
+    target_dir = os.path.dirname(target_path)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    return target_path
+
+
 def reset(modeladmin, request, queryset):
     # directory should always be set
     directory = request.GET['directory']
     configuration = get_configuration(directory)
+    moved = {}
     for path in request.POST.getlist('_selected_action'):
         swallow_dir, filepath = get_swallow_dir_and_filepath(path)
+        if swallow_dir == 'archive':
+            # archived files are extracted from their archive
+            archive, name = get_archive_and_name(configuration, filepath)
+            if archive is None:
+                continue
+            target_path = get_input_path(configuration, name)
+            if target_path is None:
+                continue
+            archive.extract(name, target_path)
+            archive.discard([name])
+            DirectoryQueryResult.invalidate(os.path.dirname(target_path))
+            moved['input'] = moved.get('input', 0) + 1
+            continue
         dir_config_method = getattr(configuration, '%s_dir' % swallow_dir)
         swallow_dir_path = dir_config_method()
         source_path = os.path.join(swallow_dir_path, *filepath)
-
-        input_dir = configuration.input_dir()
-        target_path = os.path.join(input_dir, *filepath)
+        if swallow_dir in ('done', 'error'):
+            # done and error directories can have a layout
+            target_path = get_input_path(configuration, os.path.join(*filepath))
+            if target_path is None:
+                continue
+        else:
+            input_dir = configuration.input_dir()
+            target_path = os.path.join(input_dir, *filepath)
+        moved[swallow_dir] = moved.get(swallow_dir, 0) - 1
+        moved['input'] = moved.get('input', 0) + 1
 
         shutil.move(source_path, target_path)
+        DirectoryQueryResult.invalidate(os.path.dirname(source_path))
+        DirectoryQueryResult.invalidate(os.path.dirname(target_path))
+    FileCount.add(configuration.__name__, moved)
 reset.short_description = 'Reset'
 
 
 def delete(modeladmin, request, queryset):
     directory = request.GET['directory']
     configuration = get_configuration(directory)
+    moved = {}
     for path in request.POST.getlist('_selected_action'):
         swallow_dir, filepath = get_swallow_dir_and_filepath(path)
+        if swallow_dir == 'archive':
+            archive, name = get_archive_and_name(configuration, filepath)
+            if archive is not None:
+                archive.discard([name])
+            continue
         dir_config_method = getattr(configuration, '%s_dir' % swallow_dir)
         swallow_dir_path = dir_config_method()
         source_path = os.path.join(swallow_dir_path, *filepath)
         os.remove(source_path)
+        DirectoryQueryResult.invalidate(os.path.dirname(source_path))
+        moved[swallow_dir] = moved.get(swallow_dir, 0) - 1
+    FileCount.add(configuration.__name__, moved)
 delete.short_description = 'Delete'
 
 
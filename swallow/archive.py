@@ -0,0 +1,205 @@
+"""Archives of done files.
+
+``swallow_clean --archive`` packs the done files selected by the retention
+policy in an archive per day of their modification time, in
+``archive_dir()``. An archive is made of two files:
+
+- ``YYYY-MM-DD.gz``, the concatenation of the files compressed separately,
+  it's a valid gzip file of the concatenation of the files,
+- ``YYYY-MM-DD.idx``, the index of the archive with a line per file with
+  its offset and size in the archive, its modification time and its name,
+  the path of the file relative to the done directory.
+
+Writers of an archive, ``swallow_clean`` and the admin which discards
+files, hold an exclusive ``flock`` on ``YYYY-MM-DD.lock``.
+
+A file is read back with a single seek without decompressing the other
+files of the archive. Archives can be appended, the files of a day that
+are archived later are added to its archive.
+"""
+import os
+import zlib
+import fcntl
+import threading
+
+from datetime import datetime
+from contextlib import contextmanager
+
+from swallow.util import iterdir
+
+
+class Member(object):
+    """File of an :class:`Archive`"""
+
+    def __init__(self, name, offset, size, mtime):
+        self.name = name
+        self.offset = offset  # position of the compressed file in the archive
+        self.size = size  # size of the compressed file
+        self.mtime = mtime
+
+    def __repr__(self):
+        return '<Member %s>' % self.name
+
+
+class Archive(object):
+    """Archive of the files of the day ``day``, ``YYYY-MM-DD``, in
+    ``directory``"""
+
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, directory, day):
+        self.directory = directory
+        self.day = day
+        self.path = os.path.join(directory, '%s.gz' % day)
+        self.index_path = os.path.join(directory, '%s.idx' % day)
+        self.lock_path = os.path.join(directory, '%s.lock' % day)
+        self.lock = threading.Lock()  # archived files are added by threads
+
+    @classmethod
+    def days(cls, directory):
+        """Returns the sorted days of the archives of ``directory``"""
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            name[:-len('.idx')]
+            for name in iterdir(directory)
+            if name.endswith('.idx')
+        )
+
+    @classmethod
+    def day_of(cls, mtime):
+        return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d')
+
+    @contextmanager
+    def locked(self):
+        """Lock the archive against the other threads and processes, the
+        index is replaced by :meth:`discard` so the lock is taken on a
+        sidecar file"""
+        with self.lock:
+            f = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                yield
+            finally:
+                # closing the file releases the lock
+                f.close()
+
+    def members(self):
+        """Returns the members of the archive in the order they were added"""
+        members = []
+        try:
+            f = open(self.index_path, 'rb')
+        except IOError:
+            return members
+        try:
+            for line in f:
+                offset, size, mtime, name = line.rstrip('\n').split('\t', 3)
+                members.append(Member(name, int(offset), int(size), float(mtime)))
+        finally:
+            f.close()
+        return members
+
+    def member(self, name):
+        """Returns the last member named ``name``, raises ``KeyError``
+        if there is none"""
+        for member in reversed(self.members()):
+            if member.name == name:
+                return member
+        raise KeyError(name)
+
+    def add(self, name, path):
+        """Add the file ``path`` as ``name``, the file is not removed"""
+        f = open(path, 'rb')
+        try:
+            mtime = os.fstat(f.fileno()).st_mtime
+            compressor = zlib.compressobj(
+                self.COMPRESSION_LEVEL,
+                zlib.DEFLATED,
+                16 + zlib.MAX_WBITS,  # gzip format
+            )
+            data = compressor.compress(f.read()) + compressor.flush()
+        finally:
+            f.close()
+        with self.locked():
+            archive = open(self.path, 'ab')
+            try:
+                archive.seek(0, os.SEEK_END)
+                offset = archive.tell()
+                archive.write(data)
+            finally:
+                archive.close()
+            # the index is written last, a file is archived only when
+            # it's indexed
+            index = open(self.index_path, 'ab')
+            try:
+                index.write('%s\t%s\t%r\t%s\n' % (offset, len(data), mtime, name))
+            finally:
+                index.close()
+        return Member(name, offset, len(data), mtime)
+
+    def read(self, name):
+        """Returns the content of the member ``name``"""
+        member = self.member(name)
+        f = open(self.path, 'rb')
+        try:
+            f.seek(member.offset)
+            data = f.read(member.size)
+        finally:
+            f.close()
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def extract(self, name, path):
+        """Write the member ``name`` to ``path`` with its modification
+        time"""
+        member = self.member(name)
+        f = open(path, 'wb')
+        try:
+            f.write(self.read(name))
+        finally:
+            f.close()
+        os.utime(path, (member.mtime, member.mtime))
+
+    def discard(self, names):
+        """Remove ``names`` from the index, their data is left in the
+        archive"""
+        names = set(names)
+        with self.locked():
+            members = self.members()
+            tmp = self.index_path + '.tmp'
+            index = open(tmp, 'wb')
+            try:
+                for member in members:
+                    if member.name not in names:
+                        index.write('%s\t%s\t%r\t%s\n' % (
+                            member.offset,
+                            member.size,
+                            member.mtime,
+                            member.name,
+                        ))
+            finally:
+                index.close()
+            os.rename(tmp, self.index_path)
+
+
+class Archives(object):
+    """Archives of ``directory`` by day"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def get(self, day):
+        with self.lock:
+            archive = self.archives.get(day)
+            if archive is None:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                archive = self.archives[day] = Archive(self.directory, day)
+            return archive
+
+    def add(self, name, path):
+        """Add the file ``path`` to the archive of the day of its
+        modification time"""
+        day = Archive.day_of(os.stat(path).st_mtime)
+        return self.get(day).add(name, path)
@@ -0,0 +1,76 @@
+"""Configurations run by :mod:`swallow.benchmarks.run`, they import the
+files generated by :mod:`swallow.benchmarks.corpus` in the models of
+:mod:`swallow.tests`."""
+from swallow.config import BaseConfig
+from swallow.mappers import IterXmlMapper, memoized_property
+from swallow.populator import BasePopulator
+from swallow.builder import BaseBuilder
+from swallow.tests import Article
+from swallow.tests import integration
+
+
+class FeedBuilder(BaseBuilder):
+    """Builder of ``example.config.Github`` that streams feeds"""
+
+    Model = Article
+
+    class Mapper(IterXmlMapper):
+
+        tag = 'atom:entry'
+        namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+
+        @property
+        def _instance_filters(self):
+            return {'title': self.title}
+
+        @memoized_property
+        def title(self):
+            return self.xpath_text('atom:title')
+
+        @memoized_property
+        def author(self):
+            return self.xpath_text('atom:author/atom:name')
+
+    class Populator(BasePopulator):
+
+        _fields_one_to_one = ('title', 'author')
+        _fields_if_instance_already_exists = None
+        _fields_if_instance_modified_from_last_import = None
+
+    def __init__(self, content, config, managed=False):
+        super(FeedBuilder, self).__init__(content, config, managed)
+        self.fd = config.open(self.content)
+
+    def instance_is_locally_modified(self, instance):
+        return False
+
+    def skip(self, mapper):
+        return False
+
+
+class Feeds(BaseConfig):
+
+    def load_builder(self, partial_file_path):
+        if partial_file_path.endswith('.atom'):
+            return FeedBuilder(partial_file_path, self)
+
+
+class ArticleBuilder(integration.ArticleBuilder):
+    """Builder of the integration tests for files of several articles"""
+
+    class Mapper(IterXmlMapper, integration.ArticleMapper):
+
+        tag = 'article'
+
+
+class Articles(integration.ArticleConfig):
+
+    def load_builder(self, partial_file_path):
+        if partial_file_path.endswith('.xml'):
+            return ArticleBuilder(partial_file_path, self)
+
+
+CONFIGS = {
+    'atom': Feeds,
+    'article': Articles,
+}
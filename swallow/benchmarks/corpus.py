@@ -0,0 +1,100 @@
+"""Generators of synthetic input files for the import benchmarks.
+
+``atom`` files are feeds like the ones imported by ``example.config.Github``
+and ``article`` files are lists of articles like the ones imported by
+``swallow.tests.integration.ArticleConfig``.
+
+Items of a corpus are numbered, a ``duplicates`` ratio of them reuse the
+title of a previous item so that they update an existing instance.
+"""
+import os
+import random
+
+from xml.sax.saxutils import escape
+
+
+SOURCES = ('AFP', 'Reuters', 'AP', 'Guardian', 'Le Monde')
+SECTIONS = ('ski', 'boxe', 'bilboquet', 'fun')
+
+
+def titles(count, duplicates=0.0, seed=0):
+    """Yield ``count`` titles, a ratio ``duplicates`` of them being
+    titles already yielded"""
+    rand = random.Random(seed)
+    unique = 0
+    for i in range(count):
+        if unique and rand.random() < duplicates:
+            yield u'Item %s' % rand.randrange(unique)
+        else:
+            yield u'Item %s' % unique
+            unique += 1
+
+
+def text(size, rand):
+    """Returns about ``size`` bytes of text"""
+    words = []
+    length = 0
+    while length < size:
+        word = u'lorem%s' % rand.randrange(1000)
+        words.append(word)
+        length += len(word) + 1
+    return u' '.join(words)
+
+
+def atom(titles, size, rand):
+    """Returns an Atom feed with an entry per title"""
+    xml = [u'<?xml version="1.0" encoding="utf-8"?>']
+    xml.append(u'<feed xmlns="http://www.w3.org/2005/Atom">')
+    xml.append(u'<title>Synthetic feed</title>')
+    for title in titles:
+        xml.append(u'<entry>')
+        xml.append(u'<title>%s</title>' % escape(title))
+        xml.append(u'<author><name>author%s</name></author>' % rand.randrange(10))
+        xml.append(u'<content type="html">%s</content>' % text(size, rand))
+        xml.append(u'</entry>')
+    xml.append(u'</feed>')
+    return u'\n'.join(xml)
+
+
+def article(titles, size, rand):
+    """Returns a list of articles with an article per title"""
+    xml = [u'<?xml version="1.0" encoding="utf-8"?>']
+    xml.append(u'<articles>')
+    for title in titles:
+        xml.append(u'<article>')
+        xml.append(u'<title>%s</title>' % escape(title))
+        xml.append(u'<source>%s</source>' % rand.choice(SOURCES))
+        xml.append(u'<section>%s</section>' % rand.choice(SECTIONS))
+        xml.append(u'<weight>%s</weight>' % rand.randrange(100))
+        xml.append(u'<author>author%s</author>' % rand.randrange(10))
+        xml.append(u'<body>%s</body>' % text(size, rand))
+        xml.append(u'</article>')
+    xml.append(u'</articles>')
+    return u'\n'.join(xml)
+
+
+FORMATS = {
+    'atom': (atom, '.atom'),
+    'article': (article, '.xml'),
+}
+
+
+def generate(directory, format, files, items, size=1024, duplicates=0.0, seed=0):
+    """Write ``files`` files of ``items`` items of about ``size`` bytes
+    in ``directory``, returns the paths of the files"""
+    build, extension = FORMATS[format]
+    rand = random.Random(seed)
+    all_titles = list(titles(files * items, duplicates, seed))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, 'file%06d%s' % (i, extension))
+        content = build(all_titles[i * items:(i + 1) * items], size, rand)
+        f = open(path, 'w')
+        try:
+            f.write(content.encode('utf-8'))
+        finally:
+            f.close()
+        paths.append(path)
+    return paths
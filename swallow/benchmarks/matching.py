@@ -0,0 +1,72 @@
+"""Microbenchmark of :class:`swallow.models.CompiledMatching`.
+
+Run it with::
+
+  python -m swallow.benchmarks.matching --maps 5000 --matches 1000
+
+It compares the cost of compiling the matching file for every match, which
+is roughly what :meth:`swallow.models.Matching.match` did before compiled
+matchings were cached, with the cost of matching with a compiled matching.
+"""
+import random
+from time import time
+from optparse import OptionParser
+from collections import namedtuple
+
+
+Mapper = namedtuple('Mapper', ('title', 'suptitle'))
+
+
+def build_matching(maps):
+    """Returns an xml matching file with ``maps`` maps"""
+    xml = ['<maps default="DEFAULT">']
+    for i in range(maps):
+        xml.append('<map><column>COLUMN %s</column>' % i)
+        xml.append('<set><title>title %s</title><suptitle>sup %s</suptitle></set>' % (i, i))
+        xml.append('<set><suptitle loose-compare="yes">Loose %s</suptitle></set>' % i)
+        xml.append('</map>')
+    xml.append('</maps>')
+    return ''.join(xml)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--maps', type='int', default=5000)
+    parser.add_option('--matches', type='int', default=1000)
+    options, args = parser.parse_args()
+
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure()
+
+    from StringIO import StringIO
+    from lxml import etree
+    from swallow.models import CompiledMatching
+
+    content = build_matching(options.maps)
+    mappers = []
+    for i in range(options.matches):
+        n = random.randint(0, options.maps * 2)
+        mappers.append(Mapper('title %s' % n, 'loose %s' % n))
+
+    start = time()
+    uncached = [CompiledMatching(etree.parse(StringIO(content))).match(m) for m in mappers[:10]]
+    uncached_time = (time() - start) / 10
+
+    start = time()
+    compiled = CompiledMatching(etree.parse(StringIO(content)))
+    compile_time = time() - start
+
+    start = time()
+    cached = [compiled.match(m) for m in mappers]
+    cached_time = (time() - start) / len(mappers)
+
+    assert uncached == cached[:10]
+    print '%s maps, %s matches' % (options.maps, options.matches)
+    print 'parse and match: %.3f ms per match' % (uncached_time * 1000)
+    print 'compile once:    %.3f ms' % (compile_time * 1000)
+    print 'compiled match:  %.3f ms per match' % (cached_time * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Benchmark of full import runs.
+
+Run it with::
+
+  python -m swallow.benchmarks.run --format atom --files 100 --items 50
+
+It generates a synthetic corpus with :mod:`swallow.benchmarks.corpus` then
+runs the configuration importing it ``--runs`` times, the first run creates
+instances and the next ones update them. Each run reports files and mappers
+per second, queries per mapper and the peak resident memory of the process
+and of its workers. ``--json FILE`` writes the results, with the timings of
+each phase, so that results of two releases can be compared.
+
+Queries are counted by a cursor wrapper which measures them in the
+``database`` group of the timings, so that queries of the workers of
+``--jobs`` are gathered with their timings. ``DEBUG`` stays off, the queries
+it keeps would inflate the memory.
+
+By default the database is a sqlite database in memory, use ``--engine``
+and ``--name`` to run it against PostgreSQL. Tables are created if needed
+and the benchmark models are emptied first, use a dedicated database.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import resource
+
+from time import time
+from optparse import OptionParser
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Returns the peak resident memory of the process in kilobytes, or of
+    its largest terminated child with ``RUSAGE_CHILDREN``"""
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024  # bytes on OS X
+    return rss
+
+
+class CountingCursor(object):
+    """Cursor wrapper measuring each query in the ``database`` group of the
+    timings"""
+
+    def __init__(self, cursor, alias):
+        self.cursor = cursor
+        self.alias = alias
+
+    def execute(self, sql, params=()):
+        from swallow.timing import timings
+        with timings.measure('database', self.alias, 'query'):
+            return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        from swallow.timing import timings
+        with timings.measure('database', self.alias, 'query'):
+            return self.cursor.executemany(sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def count_queries():
+    """Wrap the cursors of every connection with :class:`CountingCursor`,
+    it must be called before workers are forked"""
+    from django.db.backends import BaseDatabaseWrapper
+    cursor = BaseDatabaseWrapper.cursor
+
+    def counting_cursor(self):
+        return CountingCursor(cursor(self), self.alias)
+
+    BaseDatabaseWrapper.cursor = counting_cursor
+
+
+def configure(options, directory):
+    from django.conf import settings
+    if settings.configured:
+        return
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.%s' % options.engine,
+                'NAME': options.name,
+                'USER': options.user,
+                'PASSWORD': options.password,
+                'HOST': options.host,
+            },
+        },
+        INSTALLED_APPS=('swallow',),
+        SWALLOW_DIRECTORY=os.path.join(directory, 'swallow'),
+        MEDIA_ROOT=os.path.join(directory, 'media'),
+    )
+
+
+def setup():
+    """Create the tables and empty the benchmark models"""
+    import swallow.tests  # the benchmark models
+    from django.core.management import call_command
+    from swallow.models import Matching
+    from swallow.tests import Article, Section
+    from swallow.tests.integration import setup_matchings_and_sections
+
+    call_command('syncdb', interactive=False, verbosity=0)
+    Article.objects.all().delete()
+    Section.objects.all().delete()
+    Matching.objects.all().delete()
+    setup_matchings_and_sections()
+
+
+def run(Config, options, seed):
+    """Generate the corpus and run ``Config`` once, returns the results"""
+    from swallow.benchmarks.corpus import generate
+    from swallow.timing import timings
+
+    config = Config()
+    paths = generate(
+        config.input_dir(),
+        options.format,
+        options.files,
+        options.items,
+        options.size,
+        options.duplicates,
+        seed,
+    )
+    size = sum(os.path.getsize(path) for path in paths)
+
+    timings.reset()
+    start = time()
+    config.run()
+    duration = time() - start
+
+    mappers = sum(
+        stats.count for (group, name, phase), stats in timings.stats.items()
+        if group == 'builder' and phase == 'process_mapper'
+    )
+    # workers send their timings, queries included, to the parent
+    queries = sum(
+        stats.count for (group, name, phase), stats in timings.stats.items()
+        if group == 'database'
+    )
+    return {
+        'files': len(paths),
+        'bytes': size,
+        'mappers': mappers,
+        'seconds': duration,
+        'files_per_second': len(paths) / duration,
+        'mappers_per_second': mappers / duration,
+        'queries': queries,
+        'queries_per_mapper': mappers and float(queries) / mappers or 0,
+        'peak_rss_kb': peak_rss(),
+        'workers_peak_rss_kb': peak_rss(resource.RUSAGE_CHILDREN),
+        'instances': dict(config.counts),
+        'timings': timings.dump(),
+    }
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--format', choices=('atom', 'article'), default='atom')
+    parser.add_option('--files', type='int', default=20)
+    parser.add_option('--items', type='int', default=50,
+                      help='items per file')
+    parser.add_option('--size', type='int', default=1024,
+                      help='bytes of text per item')
+    parser.add_option('--duplicates', type='float', default=0.1,
+                      help='ratio of items updating a previous item')
+    parser.add_option('--runs', type='int', default=2)
+    parser.add_option('--jobs', type='int', default=1)
+    parser.add_option('--engine', default='sqlite3')
+    parser.add_option('--name', default=':memory:')
+    parser.add_option('--user', default='')
+    parser.add_option('--password', default='')
+    parser.add_option('--host', default='')
+    parser.add_option('--json', dest='output', default=None,
+                      help='write the results in this file')
+    options, args = parser.parse_args()
+    if options.jobs > 1 and options.name == ':memory:':
+        # workers would not share the database
+        parser.error('--jobs needs a database that is not in memory')
+
+    directory = tempfile.mkdtemp(prefix='swallow-benchmark-')
+    try:
+        configure(options, directory)
+        count_queries()
+        setup()
+
+        from swallow.benchmarks.configs import CONFIGS
+        Config = CONFIGS[options.format]
+        Config.WORKERS = options.jobs
+
+        results = []
+        for i in range(options.runs):
+            # the same corpus is imported by every run
+            result = run(Config, options, seed=0)
+            results.append(result)
+            print ('run %s: %s files, %s mappers in %.2f s, %.1f files/s, '
+                   '%.1f mappers/s, %.2f queries/mapper, peak rss %s kB, '
+                   'workers peak rss %s kB' % (
+                i + 1,
+                result['files'],
+                result['mappers'],
+                result['seconds'],
+                result['files_per_second'],
+                result['mappers_per_second'],
+                result['queries_per_mapper'],
+                result['peak_rss_kb'],
+                result['workers_peak_rss_kb'],
+            ))
+    finally:
+        shutil.rmtree(directory)
+
+    if options.output is not None:
+        parameters = dict(vars(options))
+        parameters.pop('password')
+        parameters.pop('output')
+        with open(options.output, 'w') as f:
+            json.dump({'parameters': parameters, 'runs': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
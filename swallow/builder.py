@@ -1,14 +1,21 @@
 import sys
 import logging
+import operator
 
 from functools import wraps
+from itertools import islice
+from collections import Counter
 from contextlib import contextmanager
 
-from django.db.models.fields import AutoField
-from django.db import DatabaseError, close_connection
+import django
+
+from django.db.models import Q, Model
+from django.db.models.fields import AutoField, FieldDoesNotExist
+from django.db import DatabaseError, close_connection, router, transaction
 
 from swallow.exception import StopConfig, StopBuilder, StopMapper, PostponeBuilder
-from swallow.util import format_exception
+from swallow.util import format_exception, insert_many
+from swallow.timing import timings
 
 
 log = logging.getLogger('swallow.builder')
@@ -32,6 +39,21 @@ class BaseBuilder(object):
     This is *must* be inherited and properly configured to work. See
     each attribute for more information how to set up this class."""
 
+    CHUNK_SIZE = None  # If set, mappers are processed by chunks of
+                       # CHUNK_SIZE mappers and the existing instances
+                       # of a chunk are fetched with one query
+    BULK_SIZE = None  # If set, new instances that have no m2m or related
+                      # fields to populate are not saved one by one but
+                      # inserted by batches of BULK_SIZE rows, signals
+                      # are not sent and their primary keys may not be set
+    COMMIT_EVERY = None  # If set, mappers are processed in a transaction
+                         # committed every COMMIT_EVERY mappers or at the
+                         # end of the builder if it's 0, see process_and_save
+    TRACK_CHANGES = False  # If True, existing instances are saved only if
+                           # a field changed and only changed fields are
+                           # written, before Django 1.5 signals are not
+                           # sent for these updates
+
     @property
     def Mapper(self):
         """Mapper used to populate one to one fields in
@@ -70,51 +92,242 @@ class BaseBuilder(object):
 
         if ``managed``` is set to ``False`` the function won't try to commit
         transaction.
+
+        If ``COMMIT_EVERY`` is set and the builder is not ``managed``,
+        mappers are processed in a transaction committed every
+        ``COMMIT_EVERY`` mappers, or once at the end if it's ``0``.
+        Inside a transaction, including the one of a parent builder, each
+        mapper is processed in a savepoint which is rolled back if the
+        mapper fails.
         """
         instances = []
         unhandled_errors = False
+        stopped = False
+        processed = 0  # number of mappers processed in the transaction
+        self._bulk_failed = False
+        name = type(self).__name__
 
-        for mapper in self.Mapper._iter_mappers(self):
-            try:
-                instance = self.process_mapper(mapper)
-            except StopBuilder, e:
-                # Implementor has asked to totally stop the import
-                msg = u"Import of builder %s has been stopped" % self
-                log.warning(msg, exc_info=sys.exc_info())
-                # FIXME: empty instances?
-                break
-            except StopConfig:
-                raise  # Propagate stop order to Config
-            except PostponeBuilder:
-                raise  # Propagate postpone order to Config
-            except StopMapper, e:
-                msg = u"Import of mapper %s has been stopped" % mapper
-                log.warning(msg, exc_info=sys.exc_info())
-                continue  # To next mapper
-            except DatabaseError, e:
-                # Close django connection, as it doest not do it by itself
-                # when things go wrong
-                # cf. https://docs.djangoproject.com/en/dev/topics/db/transactions/#django-s-default-transaction-behavior
-                close_connection()
-                unhandled_errors = True
-                msg = u"DatabaseError exception on %s" % mapper
-                log.error(msg, exc_info=sys.exc_info())
-                continue  # To next mapper
-            except Exception, e:
-                unhandled_errors = True
-                msg = u"Unhandled exception on %s" % mapper
-                log.error(msg, exc_info=sys.exc_info())
-                continue  # To next mapper
-            else:
-                if instance:
-                    # Instance is None if mapper has be skipped in skip method
-                    instances.append(instance)
+        self.start_transaction()
+        try:
+            for mappers in self.iter_chunks():
+                if stopped:
+                    break
+                if self.CHUNK_SIZE:
+                    # rows of the previous chunk waiting in the bulk must
+                    # be inserted to be prefetched
+                    self.flush_bulk()
+                    with timings.measure('builder', name, 'prefetch'):
+                        self.prefetch_instances(mappers)
+                for mapper in mappers:
+                    if self._commits and self.COMMIT_EVERY and \
+                            processed == self.COMMIT_EVERY:
+                        self.flush_bulk()
+                        self.flush_m2m()
+                        self.commit()
+                        processed = 0
+                    processed += 1
+                    if self._bulk:
+                        # outside of the savepoint of the mapper so that
+                        # a failure does not rollback other mappers
+                        self.flush_bulk_before(mapper)
+                    pending = len(self._m2m)  # m2m relations of other mappers
+                    sid = self.savepoint()
+                    try:
+                        with timings.measure('builder', name, 'process_mapper'):
+                            instance = self.process_mapper(mapper)
+                    except StopBuilder, e:
+                        # Implementor has asked to totally stop the import
+                        msg = u"Import of builder %s has been stopped" % self
+                        log.warning(msg, exc_info=sys.exc_info())
+                        # FIXME: empty instances?
+                        self.savepoint_commit(sid)
+                        stopped = True
+                        break
+                    except StopConfig:
+                        raise  # Propagate stop order to Config
+                    except PostponeBuilder:
+                        raise  # Propagate postpone order to Config
+                    except StopMapper, e:
+                        msg = u"Import of mapper %s has been stopped" % mapper
+                        log.warning(msg, exc_info=sys.exc_info())
+                        self.savepoint_commit(sid)
+                        continue  # To next mapper
+                    except DatabaseError, e:
+                        self.rollback(sid)
+                        del self._m2m[pending:]
+                        unhandled_errors = True
+                        msg = u"DatabaseError exception on %s" % mapper
+                        log.error(msg, exc_info=sys.exc_info())
+                        continue  # To next mapper
+                    except Exception, e:
+                        if sid is not None:
+                            self.rollback(sid)
+                        del self._m2m[pending:]
+                        unhandled_errors = True
+                        msg = u"Unhandled exception on %s" % mapper
+                        log.error(msg, exc_info=sys.exc_info())
+                        continue  # To next mapper
+                    else:
+                        self.savepoint_commit(sid)
+                        if instance:
+                            # Instance is None if mapper has be skipped in skip method
+                            instances.append(instance)
+                # m2m relations are accumulated during a chunk
+                self.flush_m2m()
+        finally:
+            # insert new instances and relations left in the bulk even
+            # if the builder is stopped or postponed
+            self.flush_bulk()
+            self.flush_m2m()
+            self.end_transaction()
+        unhandled_errors = unhandled_errors or self._bulk_failed
         return instances, unhandled_errors
 
+    def start_transaction(self):
+        """Enter a transaction if ``COMMIT_EVERY`` is set and the builder
+        is not managed, a managed builder joins the transaction of its
+        parent if there is one"""
+        self._commits = False
+        self._in_transaction = False
+        if self.COMMIT_EVERY is None and not self.managed:
+            return
+        self._using = router.db_for_write(self.Model)
+        if not self.managed:
+            transaction.enter_transaction_management(using=self._using)
+            transaction.managed(True, using=self._using)
+            self._commits = True
+            self._in_transaction = True
+        else:
+            self._in_transaction = transaction.is_managed(using=self._using)
+
+    def end_transaction(self):
+        """Commit and leave the transaction entered by
+        :meth:`start_transaction`"""
+        if not self._commits:
+            return
+        try:
+            self.commit()
+        finally:
+            transaction.leave_transaction_management(using=self._using)
+
+    def commit(self):
+        try:
+            with timings.measure('builder', type(self).__name__, 'commit'):
+                transaction.commit(using=self._using)
+        except:
+            transaction.rollback(using=self._using)
+            raise
+
+    def savepoint(self):
+        """Returns the id of a new savepoint if the builder runs in
+        a transaction else ``None``"""
+        if self._in_transaction:
+            return transaction.savepoint(using=self._using)
+        return None
+
+    def savepoint_commit(self, sid):
+        if sid is not None:
+            transaction.savepoint_commit(sid, using=self._using)
+
+    def rollback(self, sid):
+        """Rollback to savepoint ``sid``, or close the connection outside
+        of a transaction since Django does not do it by itself when
+        things go wrong"""
+        if sid is not None:
+            transaction.savepoint_rollback(sid, using=self._using)
+        else:
+            # cf. https://docs.djangoproject.com/en/dev/topics/db/transactions/#django-s-default-transaction-behavior
+            close_connection()
+
+    def iter_chunks(self):
+        """Yield lists of mappers, of ``CHUNK_SIZE`` mappers
+        if it's set or else of one mapper"""
+        size = self.CHUNK_SIZE or 1
+        mappers = iter(self.Mapper._iter_mappers(self))
+        while True:
+            with timings.measure('builder', type(self).__name__, 'parse'):
+                chunk = list(islice(mappers, size))
+            if not chunk:
+                break
+            yield chunk
+
+    def instance_key(self, filters):
+        """Returns a hashable representation of ``filters`` built with
+        the values of model fields, or ``None`` if ``filters`` is not made
+        of exact lookups on local fields"""
+        key = []
+        for name, value in sorted(filters.items()):
+            try:
+                field = self.Model._meta.get_field(name, many_to_many=False)
+            except FieldDoesNotExist:
+                return None  # most likely a lookup like ``title__iexact``
+            if field.rel is not None:
+                if isinstance(value, Model):
+                    value = value.pk
+                name = field.attname
+                field = field.rel.get_related_field()
+            key.append((name, field.to_python(value)))
+        return tuple(key)
+
+    def prefetch_instances(self, mappers):
+        """Fetch the existing instances of ``mappers`` with one query,
+        they are used by :meth:`get_or_create_instance` instead of
+        querying the database for each mapper.
+
+        Mappers are fetched one by one as usual if their filters can't be
+        compared to instances, if several mappers of the chunk have the
+        same filters or if the database doesn't compare values like python
+        does (e.g. case insensitive collations).
+        """
+        self._prefetched = {}
+        keys = {}  # instance key -> first mapper with this key
+        for mapper in mappers:
+            try:
+                key = self.instance_key(mapper._instance_filters)
+                hash(key)
+            except Exception:
+                # the error will be raised when the mapper is processed
+                continue
+            if key is None:
+                continue
+            if key not in keys:
+                # next mappers with the same key are fetched one by one
+                # since the instance may be created by the first mapper
+                keys[key] = mapper
+        if not keys:
+            return
+
+        query = reduce(operator.or_, [Q(**dict(key)) for key in keys])
+        names = set([tuple([name for name, _ in key]) for key in keys])
+        instances = {}  # instance key -> instance or None if several
+        unknown = False  # an instance does not match any key
+        for instance in self.Model.objects.filter(query):
+            matched = False
+            for fields in names:
+                key = tuple([(name, getattr(instance, name)) for name in fields])
+                if key in keys:
+                    matched = True
+                    instances[key] = None if key in instances else instance
+            unknown = unknown or not matched
+
+        for key, mapper in keys.items():
+            if key in instances:
+                instance = instances[key]
+                if instance is not None:
+                    self._prefetched[id(mapper)] = instance
+            elif not unknown:
+                # there is no instance for this mapper
+                self._prefetched[id(mapper)] = None
+
     def process_mapper(self, mapper):
         log.info('processing of %s mapper starts' % mapper)
+        name = type(self).__name__
         if not self.skip(mapper):
-            instance = self.get_or_create_instance(mapper)
+            with timings.measure('builder', name, 'get_or_create'):
+                instance = self.get_or_create_instance(mapper)
+            snapshot = None
+            if self.TRACK_CHANGES and instance.pk is not None:
+                snapshot = self.snapshot(instance)
             modified = self.instance_is_locally_modified(instance)
             populator = self.Populator(
                 mapper,
@@ -124,32 +337,57 @@ class BaseBuilder(object):
             )
 
             # --- Populate simple fields
-            for field in instance._meta.fields:
-                if isinstance(field, AutoField):
-                    # can't set auto field
-                    pass
-                else:
-                    if populator._to_set(field.name):
-                        # Do not catch exceptions here
-                        self.set_field(
-                            populator,
-                            instance,
-                            mapper,
-                            field.name
-                        )
+            with timings.measure('builder', name, 'populate'):
+                for field in instance._meta.fields:
+                    if isinstance(field, AutoField):
+                        # can't set auto field
+                        pass
+                    else:
+                        if populator._to_set(field.name):
+                            # Do not catch exceptions here
+                            self.set_field(
+                                populator,
+                                instance,
+                                mapper,
+                                field.name
+                            )
+
+            # --- Insert later with other new instances
+            if self.is_bulk_insertable(populator, instance):
+                self._bulk.append(instance)
+                key = self.instance_key(mapper._instance_filters)
+                if key is not None:
+                    self._bulk_keys.add(key)
+                if len(self._bulk) >= self.BULK_SIZE:
+                    self.flush_bulk()
+                self.counts['created'] += 1
+                return instance
 
             # --- Save to be able to populate relations fields
-            instance.save()
+            with timings.measure('builder', name, 'save'):
+                if snapshot is not None:
+                    if self.save_changes(instance, snapshot):
+                        self.counts['updated'] += 1
+                    else:
+                        self.counts['unchanged'] += 1
+                elif instance.pk is None:
+                    instance.save()
+                    self.counts['created'] += 1
+                else:
+                    instance.save()
+                    self.counts['updated'] += 1
 
             # --- Populate m2m fields
             for field in instance._meta.many_to_many:
                 if populator._to_set(field.name):
+                    sid = self.savepoint()
                     try:
-                        self.set_m2m_field(
-                            populator,
-                            instance,
-                            field.name
-                        )
+                        with timings.measure('builder', name, 'm2m'):
+                            self.set_m2m_field(
+                                populator,
+                                instance,
+                                field.name
+                            )
                     except (StopMapper, StopBuilder, StopConfig):
                         # Implementor has asked the import to be stopped, so
                         # propagate it
@@ -157,28 +395,34 @@ class BaseBuilder(object):
                     except DatabaseError, e:
                         # Close django connection, as it doest not do it by itself
                         # when things go wrong
-                        close_connection()
+                        self.rollback(sid)
                         msg = u"DatabaseError exception on m2m %s" % field.name
                         log.error(msg, exc_info=sys.exc_info())
                         continue  # To next field
                     except Exception, e:
                         # Unhandled error
                         # Do not stop import, just continue to next field
+                        if sid is not None:
+                            self.rollback(sid)
                         msg = u"Unhandled exception on m2m %s" % field.name
                         log.error(msg, exc_info=sys.exc_info())
                         continue  # To next field
+                    else:
+                        self.savepoint_commit(sid)
 
             # --- Populate related fields
             for related in instance._meta.get_all_related_objects():
                 accessor_name = related.get_accessor_name()
                 if populator._to_set(accessor_name):
+                    sid = self.savepoint()
                     try:
-                        self.set_field(
-                            populator,
-                            instance,
-                            mapper,
-                            accessor_name
-                        )
+                        with timings.measure('builder', name, 'related'):
+                            self.set_field(
+                                populator,
+                                instance,
+                                mapper,
+                                accessor_name
+                            )
                     except (StopMapper, StopBuilder, StopConfig):
                         # Implementor has asked the import to be stopped, so
                         # propagate it
@@ -186,48 +430,282 @@ class BaseBuilder(object):
                     except DatabaseError, e:
                         # Close django connection, as it doest not do it by itself
                         # when things go wrong
-                        close_connection()
+                        self.rollback(sid)
                         msg = u"DatabaseError exception on related %s" % accessor_name
                         log.error(msg, exc_info=sys.exc_info())
                         continue  # To next field
                     except Exception, e:
                         # Unhandled error
                         # Do not stop import, just continue to next field
+                        if sid is not None:
+                            self.rollback(sid)
                         msg = u"Unhandled exception on related %s" % accessor_name
                         log.error(msg, exc_info=sys.exc_info())
                         continue  # To next field
+                    else:
+                        self.savepoint_commit(sid)
         else:
             log.info('skip %s mapper' % mapper)
             instance = None
         return instance
 
+    def snapshot(self, instance):
+        """Returns the values of the fields of ``instance``"""
+        values = {}
+        for field in instance._meta.fields:
+            values[field.attname] = getattr(instance, field.attname)
+        return values
+
+    def save_changes(self, instance, snapshot):
+        """Save the fields of ``instance`` that changed since ``snapshot``
+        was taken, returns ``False`` if nothing changed"""
+        changed = []
+        for field in instance._meta.fields:
+            value = getattr(instance, field.attname)
+            old = snapshot[field.attname]
+            if value == old:
+                continue
+            try:
+                # mappers often return strings for other types
+                if field.to_python(value) == old:
+                    continue
+            except Exception:
+                pass
+            changed.append(field)
+        if not changed:
+            return False
+        for field in instance._meta.fields:
+            if getattr(field, 'auto_now', False) and field not in changed:
+                changed.append(field)
+        if django.VERSION >= (1, 5):
+            instance.save(update_fields=[f.name for f in changed])
+        else:
+            # update() only accepts field names, related instances are
+            # updated from their primary key
+            values = {}
+            for field in changed:
+                values[field.name] = field.pre_save(instance, False)
+            manager = instance._default_manager
+            manager.filter(pk=instance.pk).update(**values)
+        return True
+
+    def is_bulk_insertable(self, populator, instance):
+        """Returns ``True`` if ``BULK_SIZE`` is set and ``instance``
+        is new and has no m2m or related fields to populate"""
+        if not self.BULK_SIZE:
+            return False
+        if instance.pk is not None or instance._meta.parents:
+            return False
+        for field in instance._meta.many_to_many:
+            if populator._to_set(field.name):
+                if getattr(populator, field.name, None) is not None:
+                    return False
+        for related in instance._meta.get_all_related_objects():
+            accessor_name = related.get_accessor_name()
+            if populator._to_set(accessor_name):
+                if accessor_name in populator._fields_one_to_one:
+                    return False
+                if getattr(populator, accessor_name, None) is not None:
+                    return False
+        return True
+
+    def bulk_insert(self, instances, model=None):
+        """Insert new ``instances`` of ``model``, by default ``Model``,
+        with multi-rows INSERT statements"""
+        if model is None:
+            model = self.Model
+        manager = model._default_manager
+        if hasattr(manager, 'bulk_create'):  # Django >= 1.4
+            manager.bulk_create(instances)
+        else:
+            insert_many(model, instances, self.BULK_SIZE or 100)
+
+    def flush_bulk_before(self, mapper):
+        """Flush the bulk if the instance of ``mapper`` may wait in it"""
+        try:
+            key = self.instance_key(mapper._instance_filters)
+        except Exception:
+            key = None  # the error is raised when the mapper is processed
+        if key is None or key in self._bulk_keys:
+            self.flush_bulk()
+
+    def flush_bulk(self):
+        """Insert the new instances waiting in the bulk, if the insert
+        fails they are saved one by one so that only faulty instances
+        are lost"""
+        instances = self._bulk
+        self._bulk = []
+        self._bulk_keys = set()
+        if not instances:
+            return
+        with timings.measure('builder', type(self).__name__, 'flush_bulk'):
+            self._flush_bulk(instances)
+
+    def _flush_bulk(self, instances):
+        sid = self.savepoint()
+        try:
+            self.bulk_insert(instances)
+        except DatabaseError, e:
+            self.rollback(sid)
+            msg = u"DatabaseError exception on bulk insert of %s" % self
+            log.error(msg, exc_info=sys.exc_info())
+            for instance in instances:
+                sid = self.savepoint()
+                try:
+                    instance.save()
+                except DatabaseError, e:
+                    self.rollback(sid)
+                    self._bulk_failed = True
+                    msg = u"DatabaseError exception on %s" % instance
+                    log.error(msg, exc_info=sys.exc_info())
+                else:
+                    self.savepoint_commit(sid)
+        else:
+            self.savepoint_commit(sid)
+
     def set_field(self, populator, instance, mapper, field_name):
         if field_name in populator._fields_one_to_one:
-            # it's a mapper property
-            value = getattr(mapper, field_name)
+            # it's a mapper property or a field of the record of a
+            # declarative mapper
+            record = getattr(mapper, '_record', None)
+            if record is not None and field_name in record._names:
+                value = getattr(record, field_name)
+            else:
+                value = getattr(mapper, field_name)
             setattr(instance, field_name, value)
         else:
             # it may be a populator method
             method = getattr(populator, field_name, None)
             if method is not None:
-                method()  # CHECKME: This doesn't return a value so
-                          # that both populator methods type (m2m & property)
-                          # work the same way, that said it makes
-                          # creating methods for property settings complex
-                          # in simple cases
+                with self.measure_populator(populator, field_name):
+                    method()  # CHECKME: This doesn't return a value so
+                              # that both populator methods type (m2m & property)
+                              # work the same way, that said it makes
+                              # creating methods for property settings complex
+                              # in simple cases
             # else this field doesn't need to be populated
 
     def set_m2m_field(self, populator, instance, field_name):
         # m2m are always populated by populator methods
         method = getattr(populator, field_name, None)
         if method is not None:
-            f = getattr(instance, field_name)
-            f.clear()  # XXX: add a hook to overide
-                       # this behaviour
-            method()
+            if populator._returns_targets(field_name):
+                # the relations are diffed with the current ones
+                # see :meth:`flush_m2m`
+                with self.measure_populator(populator, field_name):
+                    targets = method()
+                pks = set()
+                for target in targets:
+                    pk = getattr(target, 'pk', target)
+                    if pk is None:
+                        msg = u'%s is not saved, it can not be related' % target
+                        raise ValueError(msg)
+                    pks.add(pk)
+                self._m2m.append((instance, field_name, pks))
+                if not self.CHUNK_SIZE:
+                    self.flush_m2m()
+            else:
+                f = getattr(instance, field_name)
+                f.clear()  # XXX: add a hook to overide
+                           # this behaviour
+                with self.measure_populator(populator, field_name):
+                    method()
         # else ``method`` is not set
         # no need to set this field
 
+    def measure_populator(self, populator, method_name):
+        """Returns a context manager that measures the populator method
+        ``method_name``, see :mod:`swallow.timing`"""
+        name = u'%s.%s' % (type(self).__name__, type(populator).__name__)
+        return timings.measure('populator', name, method_name)
+
+    def flush_m2m(self):
+        """Update the m2m relations waiting in ``_m2m``, if the update
+        fails relations are updated one instance at a time so that only
+        faulty relations are lost"""
+        relations = self._m2m
+        self._m2m = []
+        if not relations:
+            return
+        with timings.measure('builder', type(self).__name__, 'flush_m2m'):
+            self._flush_m2m(relations)
+
+    def _flush_m2m(self, relations):
+        sid = self.savepoint()
+        try:
+            self.update_m2m(relations)
+        except DatabaseError, e:
+            self.rollback(sid)
+            msg = u"DatabaseError exception on m2m update of %s" % self
+            log.error(msg, exc_info=sys.exc_info())
+            for relation in relations:
+                sid = self.savepoint()
+                try:
+                    self.update_m2m([relation])
+                except DatabaseError, e:
+                    self.rollback(sid)
+                    msg = u"DatabaseError exception on m2m %s of %s" % (
+                        relation[1],
+                        relation[0],
+                    )
+                    log.error(msg, exc_info=sys.exc_info())
+                else:
+                    self.savepoint_commit(sid)
+        else:
+            self.savepoint_commit(sid)
+
+    def update_m2m(self, relations):
+        """Set the m2m ``relations``, a list of ``(instance, field_name,
+        target primary keys)``.
+
+        For each field, current relations of every instance are fetched
+        in one query, then missing relations are inserted in one bulk
+        and stale ones are deleted at once. ``m2m_changed`` signals are
+        not sent."""
+        fields = {}
+        for instance, field_name, targets in relations:
+            field = instance._meta.get_field(field_name)
+            fields.setdefault(field, {})[instance] = targets
+        for field, targets in fields.items():
+            through = field.rel.through
+            if field.rel.symmetrical and field.rel.to == field.model:
+                # symmetrical relations can not be simply inserted,
+                # explicit through models are rejected by the populator
+                for instance, pks in targets.items():
+                    manager = getattr(instance, field.name)
+                    current = set(manager.values_list('pk', flat=True))
+                    manager.remove(*(current - pks))
+                    manager.add(*(pks - current))
+                continue
+            targets = dict((i.pk, pks) for i, pks in targets.items())
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            manager = through._default_manager
+            rows = manager.filter(**{
+                '%s__in' % source: targets.keys()
+            }).values_list('pk', source, target)
+            existing = set()
+            stale = []
+            for pk, source_pk, target_pk in rows:
+                if target_pk in targets[source_pk]:
+                    existing.add((source_pk, target_pk))
+                else:
+                    stale.append(pk)
+            if stale:
+                manager.filter(pk__in=stale).delete()
+            source = through._meta.get_field(source).attname
+            target = through._meta.get_field(target).attname
+            new = []
+            for source_pk, pks in targets.items():
+                for target_pk in pks:
+                    if (source_pk, target_pk) not in existing:
+                        new.append(through(**{
+                            source: source_pk,
+                            target: target_pk,
+                        }))
+            if new:
+                self.bulk_insert(new, through)
+
     def __init__(self, content, config, managed=False, parent_instance=None):
         # :param content: an open variable for content storing
         #                 it can a be file descriptor, a node in xml
@@ -249,9 +727,33 @@ class BaseBuilder(object):
         #                         parent_instance was already saved by the
         #                         parent builder
         self.parent_instance = parent_instance
+        # instances fetched by :meth:`prefetch_instances` by mapper id
+        self._prefetched = {}
+        # new instances waiting to be inserted and their instance keys
+        # see :meth:`flush_bulk`
+        self._bulk = []
+        self._bulk_keys = set()
+        self._bulk_failed = False
+        # m2m relations waiting to be updated, see :meth:`flush_m2m`
+        self._m2m = []
+        # number of instances ``created``, ``updated`` and ``unchanged``
+        # by the builder and its nested builders
+        self.counts = Counter()
+        # transaction state, see :meth:`start_transaction`
+        self._commits = False
+        self._in_transaction = False
+        self._using = None
 
     def get_or_create_instance(self, mapper):
         # get or create without saving
+        if id(mapper) in self._prefetched:
+            instance = self._prefetched.pop(id(mapper))
+            if instance is None:
+                instance = self.Model(**mapper._instance_filters)
+                log.info('created instance')
+            else:
+                log.info('fetched instance')
+            return instance
         try:
             instance = self.Model.objects.get(
                 **mapper._instance_filters
@@ -304,6 +806,7 @@ class from_builder(object):
                     args.append(self._instance)
                 builder = this.BuilderClass(*args)
                 p, unhandled_errors = builder.process_and_save()
+                self._builder.counts.update(builder.counts)
                 instances.extend(p)  # FIXME: This is not consistent with
                                      # BaseConfig way of gathering created
                                      # instances
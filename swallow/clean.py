@@ -0,0 +1,323 @@
+"""Cleaning of the directories of a configuration.
+
+:class:`Cleaner` deletes, or moves to ``duplicate_dir``, the files of a
+directory of a configuration that are out of its retention policy. The
+policy of a directory is set in the ``RETENTION`` dictionary of the
+configuration class, options of ``swallow_clean`` override it:
+
+  .. code-block:: python
+
+    class Feeds(BaseConfig):
+
+        RETENTION = {
+            'done': {'age': 30 * 86400, 'count': 100000},
+            'error': {'bytes': 10 * 1024 ** 3},
+        }
+
+``age`` is the number of seconds after which a file is removed, ``count``
+and ``bytes`` are the number of files and the total size of the newest
+files that are kept.
+
+With ``archive`` the done files are packed in archives by day instead of
+being deleted, see :mod:`swallow.archive`.
+
+The directory is scanned with ``scandir`` and files are removed in batches
+by a pool of threads. Directories are visited in order, the last directory
+cleaned by age is saved regularly so that an interrupted cleaning resumes
+where it stopped.
+"""
+import os
+import json
+import errno
+import base64
+import binascii
+import shutil
+import logging
+
+from time import time
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.utils.encoding import smart_str
+
+from swallow.archive import Archives
+from swallow.util import scandir, smart_decode
+
+
+log = logging.getLogger('swallow.clean')
+
+
+class Cleaner(object):
+    """Removes the files of ``directory``, ``'done'`` or ``'error'`` for
+    instance, of the configuration class ``config`` according to its
+    retention policy"""
+
+    BATCH_SIZE = 1000  # files removed at once by the pool of threads
+    PROGRESS_INTERVAL = 10  # seconds between two reports of the progress
+
+    def __init__(self, config, directory, age=None, count=None, size=None,
+                 move=False, archive=False, dryrun=False, threads=4,
+                 restart=False):
+        if archive and directory != 'done':
+            raise ValueError('only done files can be archived')
+        self.config = config
+        self.directory = directory
+        # bytes, so that file names are bytes whatever their encoding
+        self.path = smart_str(getattr(config, '%s_dir' % directory)())
+        retention = config.RETENTION.get(directory, {})
+        if age is None:
+            age = retention.get('age')
+        if count is None:
+            count = retention.get('count')
+        if size is None:
+            size = retention.get('bytes')
+        self.age = age
+        self.count = count
+        self.size = size
+        self.move = move
+        self.archives = None
+        if archive:
+            self.archives = Archives(config.archive_dir())
+        self.dryrun = dryrun
+        self.threads = threads
+        self.restart = restart  # ignore the state of an interrupted run
+        self.listeners = []  # callables called with the path of each file
+                             # before it's removed
+        self.progress = []  # callables called with the cleaner to report
+                            # its progress
+        self.scanned = 0
+        self.removed = 0
+        self.errors = 0
+        self._dirs = set()  # directories of duplicate_dir that exist
+        self._reported = time()
+
+    def has_policy(self):
+        return not (self.age is None and self.count is None and self.size is None)
+
+    def state_path(self):
+        """Path of the file where the progress of the cleaning by age is
+        saved, it's a sibling of the directory so that it's not cleaned"""
+        return os.path.join(
+            os.path.dirname(self.path),
+            '.clean-%s' % self.directory,
+        )
+
+    def load_state(self):
+        """Returns the components of the last directory cleaned by an
+        interrupted run with the same age, or ``None``"""
+        if self.restart:
+            return None
+        try:
+            f = open(self.state_path())
+            try:
+                state = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if state.get('age') != self.age:
+            return None
+        try:
+            return tuple(
+                base64.b64decode(component.encode('ascii'))
+                for component in state['checkpoint']
+            )
+        except (KeyError, TypeError, UnicodeError, binascii.Error):
+            return None
+
+    def save_state(self, components):
+        if self.dryrun:
+            return
+        path = self.state_path()
+        f = open(path + '.tmp', 'w')
+        try:
+            json.dump({
+                'age': self.age,
+                # names are bytes, not always UTF-8
+                'checkpoint': [base64.b64encode(c) for c in components],
+            }, f)
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+
+    def clear_state(self):
+        if self.dryrun:
+            return
+        try:
+            os.remove(self.state_path())
+        except OSError:
+            pass
+
+    def walk(self, checkpoint=None):
+        """Yield the components of the path of each directory relative to
+        the cleaned directory and the entries of its files, directories
+        are visited in lexicographic order of their components.
+
+        Directories up to ``checkpoint`` are not yielded."""
+        stack = [()]
+        while stack:
+            components = stack.pop()
+            try:
+                entries = scandir(os.path.join(self.path, *components))
+            except OSError:
+                continue
+            files = []
+            directories = []
+            for entry in entries:
+                if entry.is_dir():
+                    child = components + (entry.name,)
+                    if (checkpoint is not None and child < checkpoint
+                            and checkpoint[:len(child)] != child):
+                        # cleaned by the interrupted run
+                        continue
+                    directories.append(child)
+                else:
+                    files.append(entry)
+            stack.extend(sorted(directories, reverse=True))
+            if checkpoint is None or components > checkpoint:
+                yield components, files
+
+    def expired_day(self, components, cutoff):
+        """Returns ``True`` if ``components`` is a day of the date layout
+        that ended before ``cutoff``, its files don't need a ``stat``"""
+        if not components or self.directory not in ('done', 'error'):
+            return False
+        day = self.config.layout_date(os.path.join(*components))
+        return day is not None and day + timedelta(days=1) <= cutoff
+
+    def clean_age(self):
+        cutoff = time() - self.age
+        day = datetime.fromtimestamp(cutoff)
+        for components, entries in self.walk(self.load_state()):
+            expired = self.expired_day(components, day)
+            batch = []
+            for entry in entries:
+                self.scanned += 1
+                if expired or entry.stat().st_mtime < cutoff:
+                    batch.append(entry.path)
+                    if len(batch) == self.BATCH_SIZE:
+                        self.remove(batch)
+                        batch = []
+            self.remove(batch)
+            if self.report():
+                self.save_state(components)
+        self.clear_state()
+
+    def clean_quota(self):
+        """Keep the newest files while they are within ``count`` and
+        ``size`` and remove the others"""
+        files = []
+        for components, entries in self.walk():
+            for entry in entries:
+                self.scanned += 1
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+            self.report()
+        files.sort(reverse=True)
+        kept = 0
+        size = 0
+        full = False  # every older file is removed
+        batch = []
+        for mtime, st_size, path in files:
+            kept += 1
+            size += st_size
+            if self.count is not None and kept > self.count:
+                full = True
+            if self.size is not None and size > self.size:
+                full = True
+            if full:
+                batch.append(path)
+                if len(batch) == self.BATCH_SIZE:
+                    self.remove(batch)
+                    batch = []
+                    self.report()
+        self.remove(batch)
+
+    def duplicate_path(self, path):
+        """Returns the path where the file ``path`` is moved, the tree of
+        the cleaned directory is kept and an existing file is never
+        overwritten"""
+        target = os.path.join(
+            self.config.duplicate_dir(),
+            self.directory,
+            os.path.relpath(path, self.path),
+        )
+        if os.path.lexists(target):
+            i = 1
+            while os.path.lexists('%s.%s' % (target, i)):
+                i += 1
+            target = '%s.%s' % (target, i)
+        return target
+
+    def _makedirs(self, directory):
+        if directory in self._dirs:
+            return
+        try:
+            os.makedirs(directory)
+        except OSError, exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        self._dirs.add(directory)
+
+    def _remove(self, path):
+        """Remove or move the file ``path``, called by the pool of threads,
+        returns ``True`` if the file is removed"""
+        try:
+            if self.archives is not None:
+                self.archives.add(os.path.relpath(path, self.path), path)
+                os.remove(path)
+            elif self.move:
+                target = self.duplicate_path(path)
+                self._makedirs(os.path.dirname(target))
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        except (OSError, IOError), exception:
+            if exception.errno == errno.ENOENT:
+                # removed by someone else
+                return False
+            log.error(u"can't remove %s: %s" % (smart_decode(path), exception))
+            return None
+        return True
+
+    def remove(self, paths):
+        if not paths:
+            return
+        for path in paths:
+            for listener in self.listeners:
+                listener(path)
+        if self.dryrun:
+            self.removed += len(paths)
+            return
+        for removed in self.pool.map(self._remove, paths):
+            if removed:
+                self.removed += 1
+            elif removed is None:
+                self.errors += 1
+
+    def report(self, force=False):
+        """Report the progress if ``PROGRESS_INTERVAL`` elapsed since the
+        last report, returns ``True`` if it's reported"""
+        now = time()
+        if not force and now - self._reported < self.PROGRESS_INTERVAL:
+            return False
+        self._reported = now
+        for progress in self.progress:
+            progress(self)
+        return True
+
+    def run(self):
+        """Clean the directory, returns the number of removed files"""
+        if not self.has_policy():
+            return 0
+        self.pool = ThreadPool(self.threads)
+        try:
+            if self.age is not None:
+                self.clean_age()
+            if self.count is not None or self.size is not None:
+                self.clean_quota()
+        finally:
+            self.pool.close()
+            self.pool.join()
+        self.report(force=True)
+        return self.removed
@@ -0,0 +1,66 @@
+"""Transparent decompression of input files.
+
+:func:`open_input` detects gzip, bzip2 and xz files from their first bytes
+and returns a file object streaming their decompressed content, other files
+are returned as is. xz needs the ``lzma`` module of Python 3 or its backport
+``backports.lzma``.
+"""
+import bz2
+import gzip
+
+try:
+    import lzma
+except ImportError:
+    try:
+        # backport of lzma for Python < 3.3
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+MAGIC = (
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bzip2'),
+    ('\xfd7zXZ\x00', 'xz'),
+)
+
+EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+
+def compression(f):
+    """Returns the compression of the file object ``f``, ``'gzip'``,
+    ``'bzip2'``, ``'xz'`` or ``None``, the position of ``f`` is kept"""
+    position = f.tell()
+    header = f.read(6)
+    f.seek(position)
+    for magic, name in MAGIC:
+        if header.startswith(magic):
+            return name
+    return None
+
+
+def open_input(path):
+    """Open the file ``path`` and returns a file object of its decompressed
+    content if it's compressed"""
+    f = open(path, 'rb')
+    kind = compression(f)
+    if kind is None:
+        return f
+    f.close()
+    if kind == 'gzip':
+        return gzip.GzipFile(path, 'rb')
+    elif kind == 'bzip2':
+        return bz2.BZ2File(path)
+    if lzma is None:
+        raise IOError('%s is compressed with xz, install backports.lzma' % path)
+    return lzma.LZMAFile(path)
+
+
+def uncompressed_name(path):
+    """Returns ``path`` without the extension of its compression, for
+    instance to select the builder of ``article.xml.gz`` like the builder
+    of ``article.xml``"""
+    for extension in EXTENSIONS:
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
@@ -1,14 +1,26 @@
 import sys
 import os
 import logging
+import zipfile
 
 from time import time
+from hashlib import md5
+from datetime import datetime
+from collections import deque, Counter
+from multiprocessing import Pool, Event
 
 from django.conf import settings
+from django.db import close_connection
 from django.utils.text import force_unicode
+from django.utils.encoding import smart_str
 
 from swallow.exception import StopConfig, PostponeBuilder
 from swallow.util import format_exception, move_file, smart_decode, is_utf8
+from swallow.util import scandir, file_digest
+from swallow.compression import open_input
+from swallow.mapped import open_mapped
+from swallow.models import ImportedFile, MatchingRegistry, FileCount
+from swallow.timing import timings
 
 
 log = logging.getLogger('swallow.config')
@@ -29,6 +41,24 @@ class BaseConfig(object):
     GRACE_PERIOD = 60 * 60 * 24  # Max time a secondary file will stay in input_dir
                                  # if not processed with a config.open()
                                  # (in seconds)
+    WORKERS = 1  # Number of processes used to process endpoint files,
+                 # with more than one worker each endpoint file is processed
+                 # in a forked process with its own database connection
+    LEDGER = False  # If set to True, the digest of endpoint files is
+                    # recorded after processing and files already
+                    # imported successfully are moved to done_dir
+                    # without being processed again
+    LAYOUT = None  # Layout of done_dir and error_dir, by default they
+                   # mirror input_dir, ``'date'`` puts files in ``YYYY/MM/DD``
+                   # subdirectories of the day they are moved and ``'hash'``
+                   # in HASH_BUCKETS subdirectories, see layout_path
+    HASH_BUCKETS = 256
+    MMAP = False  # Open files with a memory map, see swallow.mapped
+    EXPAND_ZIP = False  # Process each member of the zip files of input_dir
+                        # as an endpoint named ``archive.zip/member``, see
+                        # process_zip
+    RETENTION = {}  # Retention policies of swallow_clean by directory
+                    # name, see swallow.clean
 
     @classmethod
     def input_dir(cls):
@@ -88,6 +118,63 @@ class BaseConfig(object):
             class_name,
             'duplicate')
         return path
+
+    @classmethod
+    def archive_dir(cls):
+        """Directory of the archives of done files, see swallow.archive"""
+        class_name = cls.__name__.lower()
+        path = os.path.join(
+            settings.SWALLOW_DIRECTORY,
+            class_name,
+            'archive')
+        return path
+
+    @classmethod
+    def layout_depth(cls):
+        """Number of directories added by the layout of done and error
+        directories"""
+        return {None: 0, 'date': 3, 'hash': 1}[cls.LAYOUT]
+
+    @classmethod
+    def layout_path(cls, partial_file_path, date=None):
+        """Returns the path, relative to done or error directory, where
+        the file ``partial_file_path`` of input directory is moved
+        according to ``LAYOUT``"""
+        if cls.LAYOUT == 'date':
+            if date is None:
+                date = datetime.now()
+            prefix = date.strftime('%Y/%m/%d')
+        elif cls.LAYOUT == 'hash':
+            digest = md5(smart_str(partial_file_path)).hexdigest()
+            bucket = int(digest, 16) % cls.HASH_BUCKETS
+            width = len('%x' % (cls.HASH_BUCKETS - 1))
+            prefix = '%0*x' % (width, bucket)
+        else:
+            return partial_file_path
+        return os.path.join(prefix, partial_file_path)
+
+    @classmethod
+    def input_path(cls, layout_path):
+        """Returns the path relative to input directory of the file
+        ``layout_path`` of done or error directory, or ``None`` if it's
+        a directory of the layout"""
+        components = layout_path.split(os.sep)
+        depth = cls.layout_depth()
+        if len(components) <= depth:
+            return None
+        return os.path.join(*components[depth:])
+
+    @classmethod
+    def layout_date(cls, layout_path):
+        """Returns the day of the directory ``layout_path`` of the
+        ``'date'`` layout or ``None``"""
+        if cls.LAYOUT != 'date':
+            return None
+        components = layout_path.split(os.sep)[:3]
+        try:
+            return datetime.strptime('/'.join(components), '%Y/%m/%d')
+        except ValueError:
+            return None
     
     def load_builder(self, partial_file_path):
         """Should load a :class`:swallow.builder.BaseBuilder` class and return
@@ -108,10 +195,37 @@ class BaseConfig(object):
         self.files = []  # this is the current list of files processed
                          # by swallow
                          # FIXME: explain how it works
+        self.opened = set()  # every file moved from input directory
+                             # by :meth:`open` during the run
+        self.restored = set()  # every file moved back to input directory
+                               # during the run
 
         self.on_error = False  # this should reset at for each file
 
+        self.workers = self.WORKERS  # can be overriden per run, for instance
+                                     # with ``swallow_run --jobs``
+        self._pool = None  # pool of worker processes, only set during
+                           # a run with more than one worker
+        self.matchings = MatchingRegistry()  # matchings used during the run
+        self.counts = Counter()  # instances ``created``, ``updated`` and
+                                 # ``unchanged`` by builders during the run
+        self.moved = Counter()  # files moved in, or out if negative, of
+                                # swallow directories since the file counts
+                                # were saved, see :meth:`save_file_counts`
+        self.input_files = 0  # files left in input directory by the run
+        self.counted = set()  # files of input directory included in its
+                              # file count, see :meth:`process_endpoints`
+        self._layout_dirs = set()  # directories of the layout that exist
+        self._zips = {}  # zip archives being processed by partial path
+
     def open(self, relative_path):
+        """Move the file ``relative_path`` of input directory to work
+        directory and returns it open, compressed files are decompressed,
+        files are memory mapped if MMAP is set and the members of the zip
+        archive being processed are read from the archive, see EXPAND_ZIP"""
+        for zip_path, archive in self._zips.items():
+            if relative_path.startswith(zip_path + '/'):
+                return archive.open(relative_path[len(zip_path) + 1:])
         path = os.path.join(
             self.input_dir(),
             relative_path
@@ -122,7 +236,12 @@ class BaseConfig(object):
             work
         )
         self.files.append(relative_path)
-        f = open(work)
+        self.opened.add(relative_path)
+        self.moved['input'] -= 1
+        if self.MMAP:
+            f = open_mapped(work)
+        else:
+            f = open_input(work)
         return f
 
     def run(self):
@@ -131,58 +250,425 @@ class BaseConfig(object):
             type(self).__name__,
             self.input_dir(),
         ))
-        self.process_recursively()
+        self.opened = set()
+        self.restored = set()
+        self.matchings = MatchingRegistry()
+        self.counts = Counter()
+        self.input_files = 0
+        self.counted = set()
+        self._layout_dirs = set()
+        if self.workers > 1:
+            # Connections must not be shared with forked workers, they
+            # will open their own connection when they need it
+            close_connection()
+            stop = Event()
+            self._pool = Pool(self.workers, _init_worker, (self, stop))
+            try:
+                self.process_recursively()
+            finally:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+        else:
+            self.process_recursively()
+        if not self.dryrun:
+            # the whole input directory was inspected
+            self.save_file_counts(input=False)
+            with timings.measure('config', type(self).__name__, 'file_counts'):
+                FileCount.set(type(self).__name__, 'input', self.input_files)
+        log.info(u'%s matchings: %r' % (type(self).__name__, self.matchings))
+        log.info(u'%s instances: %s' % (
+            type(self).__name__,
+            u', '.join(u'%s %s' % i for i in sorted(self.counts.items())),
+        ))
 
     def paths(self, path):
-        """Builds paths for relative path ``path``"""
+        """Builds paths for relative path ``path``, with a ``LAYOUT`` the
+        input tree is not mirrored in error and done directories and their
+        roots are returned"""
         input = os.path.realpath(os.path.join(self.input_dir(), path))
         work = os.path.realpath(os.path.join(self.work_dir(), path))
+        if self.LAYOUT is not None:
+            path = ''  # see :meth:`layout_file_path`
         error = os.path.realpath(os.path.join(self.error_dir(), path))
         done = os.path.realpath(os.path.join(self.done_dir(), path))
         return input, work, error, done
 
+    def make_dirs(self, path):
+        """Create swallow directories for relative path ``path`` and
+        returns their paths, see :meth:`paths`"""
+        input, work, error, done = self.paths(path)
+
+        if not os.path.exists(work):
+            os.makedirs(work)
+        if not os.path.exists(error):
+            os.makedirs(error)
+        if not os.path.exists(done):
+            os.makedirs(done)
+        # input_dir should exists
+        return input, work, error, done
+
+    def layout_file_path(self, dir, partial_file_path):
+        """Returns the path where the file ``partial_file_path`` is moved
+        in done or error directory ``dir``, its directory is created if
+        needed"""
+        path = os.path.join(dir, self.layout_path(partial_file_path))
+        if self.LAYOUT is not None:
+            directory = os.path.dirname(path)
+            if directory not in self._layout_dirs:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._layout_dirs.add(directory)
+        return path
+
     def mv_files_from_work_dir(self, to_dir):
         """Move current endpoints files from work dir to to_dir."""
         # Move the endpoint files
+        layout = to_dir in (self.done_dir(), self.error_dir())
         for p in self.files:
             work = os.path.join(self.work_dir(), p)
-            target = os.path.join(to_dir, p)
+            if layout:
+                target = self.layout_file_path(to_dir, p)
+            else:
+                target = os.path.join(to_dir, p)
             move_file(work, target)
+        directory = self.directory_name(to_dir)
+        if directory is not None:
+            self.moved[directory] += len(self.files)
+        if to_dir == self.input_dir():
+            # files are back in input directory
+            self.opened.difference_update(self.files)
+            self.restored.update(self.files)
         self.files = []
 
+    def directory_name(self, dir):
+        """Returns the name of the swallow directory ``dir``, ``input``,
+        ``done`` or ``error``, or ``None``"""
+        for name in ('input', 'done', 'error'):
+            if dir == getattr(self, '%s_dir' % name)():
+                return name
+        return None
+
+    def save_file_counts(self, input=True):
+        """Add the files moved since the last call to the file counts
+        of the configuration, see :class:`swallow.models.FileCount`.
+
+        ``input`` is ``False`` during a full run, the count of input
+        directory is set at its end."""
+        if not input:
+            self.moved.pop('input', None)
+        with timings.measure('config', type(self).__name__, 'file_counts'):
+            FileCount.add(type(self).__name__, self.moved)
+        self.moved = Counter()
+
     def listdir(self, dir):
         """
         Return the content of a directory. By default use "os.listdir".
         """
         return os.listdir(dir)
 
+    def process_file(self, partial_file_path):
+        """Load and run the builder of the endpoint file ``partial_file_path``
+        then move the files it used to the proper swallow directory.
+
+        Returns a tuple ``(stop, new_instances)`` where ``stop`` is ``True``
+        if the builder asked the configuration to stop.
+        """
+        input_file_path = os.path.join(self.input_dir(), partial_file_path)
+        stop = False
+        new_instances = None
+
+        # --- Look for the file in the ledger
+        digest = None
+        if self.LEDGER and not self.dryrun:
+            try:
+                with timings.measure('config', type(self).__name__, 'digest'):
+                    digest = file_digest(input_file_path)
+            except (IOError, OSError):
+                # the file was moved away since the directory was listed
+                log.info(u'file %s disappeared' % force_unicode(input_file_path))
+                return stop, new_instances
+            if self.is_already_imported(digest):
+                log.info(u'already imported %s' % force_unicode(partial_file_path))
+                done_file_path = self.layout_file_path(
+                    self.done_dir(),
+                    partial_file_path,
+                )
+                move_file(input_file_path, done_file_path)
+                self.moved['input'] -= 1
+                self.moved['done'] += 1
+                return stop, new_instances
+
+        if self.EXPAND_ZIP and partial_file_path.endswith('.zip'):
+            return self.process_zip(partial_file_path, digest)
+
+        # --- Load and process builder for file
+        with timings.measure('config', type(self).__name__, 'load_builder'):
+            builder = self.load_builder(partial_file_path)
+        if builder is None:
+            log.info(u'skip file %s' % force_unicode(input_file_path))
+        else:
+            log.info(u'match %s' % force_unicode(partial_file_path))
+            if not self.dryrun:
+                try:
+                    to_dir, stop, new_instances = self.run_builder(
+                        builder,
+                        input_file_path,
+                    )
+                finally:
+                    with timings.measure('config', type(self).__name__, 'move'):
+                        self.mv_files_from_work_dir(to_dir=to_dir)
+                self.record_outcome(digest, partial_file_path, to_dir)
+            else:
+                # We are in dry-run, put back the files in input dir
+                self.mv_files_from_work_dir(to_dir=self.input_dir())
+        return stop, new_instances
+
+    def run_builder(self, builder, input_file_path):
+        """Run ``builder`` and returns a tuple ``(to_dir, stop,
+        new_instances)`` where ``to_dir`` is the directory where the
+        files it used must be moved"""
+        stop = False
+        new_instances = None
+        try:
+            with timings.measure(
+                'builder',
+                type(builder).__name__,
+                'process_and_save',
+            ):
+                new_instances, unhandled_errors = builder.process_and_save()
+        except StopConfig, e:
+            # this is a user controlled exception
+            msg = u'Import stopped for %s' % self
+            log.warning(msg, exc_info=sys.exc_info())
+            to_dir = self.error_dir()
+            stop = True
+        except PostponeBuilder, e:
+            # Implementor as asked to postpone current process
+            msg = u'Builder postponed for %s' % self
+            log.warning(msg, exc_info=sys.exc_info())
+            # Do not move files, keep them for next run
+            to_dir = self.input_dir()
+        except Exception, e:
+            msg = u'builder processing of %s failed' % input_file_path
+            log.error(msg, exc_info=sys.exc_info())
+            to_dir = self.error_dir()
+        else:
+            to_dir = unhandled_errors and self.error_dir() \
+                                              or self.done_dir()
+            self.counts.update(getattr(builder, 'counts', {}))
+        return to_dir, stop, new_instances
+
+    def record_outcome(self, digest, partial_file_path, to_dir):
+        """Record in the ledger the outcome of the processing of the
+        endpoint file ``partial_file_path`` moved to ``to_dir``"""
+        if digest is not None and to_dir != self.input_dir():
+            status = to_dir == self.done_dir() and ImportedFile.DONE \
+                                                or ImportedFile.ERROR
+            self.record_import(digest, partial_file_path, status)
+
+    def process_zip(self, partial_file_path, digest=None):
+        """Process each member of the zip archive ``partial_file_path``
+        as the endpoint ``partial_file_path/member``, without extracting
+        it, see EXPAND_ZIP.
+
+        The archive is left in input directory if no member has a
+        builder, else it's moved as a whole, to error directory if it
+        can't be read or a member failed and back to input directory if
+        a builder is postponed.
+        """
+        input_file_path = os.path.join(self.input_dir(), partial_file_path)
+        stop = False
+        instances = []
+        try:
+            archive = zipfile.ZipFile(input_file_path)
+        except (zipfile.BadZipfile, IOError), e:
+            msg = u'can not read zip archive %s' % force_unicode(input_file_path)
+            log.error(msg, exc_info=sys.exc_info())
+            if not self.dryrun:
+                self.open(partial_file_path).close()
+                with timings.measure('config', type(self).__name__, 'move'):
+                    self.mv_files_from_work_dir(to_dir=self.error_dir())
+                self.record_outcome(digest, partial_file_path, self.error_dir())
+            return stop, None
+
+        # --- Load the builders of the members
+        builders = []
+        self._zips[partial_file_path] = archive
+        try:
+            for name in archive.namelist():
+                if name.endswith('/'):
+                    continue  # a directory
+                member_path = '%s/%s' % (partial_file_path, name)
+                with timings.measure('config', type(self).__name__, 'load_builder'):
+                    builder = self.load_builder(member_path)
+                if builder is None:
+                    log.info(u'skip file %s' % force_unicode(member_path))
+                    continue
+                log.info(u'match %s' % force_unicode(member_path))
+                builders.append((member_path, builder))
+        finally:
+            del self._zips[partial_file_path]
+            archive.close()
+        if not builders or self.dryrun:
+            # like other files without builder the archive is left
+            # in input directory
+            return stop, None
+
+        # --- Process the members from the archive moved to work directory
+        self.open(partial_file_path).close()
+        to_dirs = set()
+        try:
+            archive = zipfile.ZipFile(
+                os.path.join(self.work_dir(), partial_file_path)
+            )
+            self._zips[partial_file_path] = archive
+            try:
+                for member_path, builder in builders:
+                    to_dir, stop, new_instances = self.run_builder(
+                        builder,
+                        member_path,
+                    )
+                    to_dirs.add(to_dir)
+                    if new_instances:
+                        instances.extend(new_instances)
+                    if stop:
+                        break
+            finally:
+                del self._zips[partial_file_path]
+                archive.close()
+        except (zipfile.BadZipfile, IOError), e:
+            msg = u'can not read zip archive %s' % force_unicode(input_file_path)
+            log.error(msg, exc_info=sys.exc_info())
+            to_dirs.add(self.error_dir())
+        finally:
+            if self.input_dir() in to_dirs:
+                # a builder is postponed
+                to_dir = self.input_dir()
+            elif self.error_dir() in to_dirs or not to_dirs:
+                to_dir = self.error_dir()
+            else:
+                to_dir = self.done_dir()
+            with timings.measure('config', type(self).__name__, 'move'):
+                self.mv_files_from_work_dir(to_dir=to_dir)
+        self.record_outcome(digest, partial_file_path, to_dir)
+        return stop, instances or None
+
+    def scandir(self, dir):
+        """
+        Return the entries of a directory as :class:`os.DirEntry` like
+        objects. By default use "os.scandir", or :meth:`listdir` if it
+        is overriden.
+        """
+        if self.listdir.__func__ is not BaseConfig.listdir.__func__:
+            return scandir(dir, self.listdir(dir))
+        return scandir(dir)
+
+    def process_endpoints(self, partial_file_paths):
+        """Process the files ``partial_file_paths`` of the input directory
+        without walking it, see :class:`swallow.watch.Watcher`.
+
+        Returns the files moved back to input directory, for instance
+        by a postponed builder."""
+        instances = None
+        if hasattr(self, 'postprocess'):
+            instances = []
+
+        self.opened = set()
+        self.restored = set()
+        self.matchings = MatchingRegistry()
+        self.counts = Counter()
+        for partial_file_path in partial_file_paths:
+            if partial_file_path in self.opened:
+                # the file has been already moved
+                # by a nested builder
+                continue
+            input_file_path = os.path.join(self.input_dir(), partial_file_path)
+            if not os.path.exists(input_file_path):
+                continue
+            if partial_file_path in self.counted:
+                # already counted by the last full run, for instance
+                # skipped by the quarantine
+                self.counted.discard(partial_file_path)
+            else:
+                self.moved['input'] += 1  # the file arrived since then
+            self.make_dirs(os.path.dirname(partial_file_path))
+            with timings.measure('config', type(self).__name__, 'process_file'):
+                stop, new_instances = self.process_file(partial_file_path)
+            if os.path.lexists(input_file_path):
+                # left or moved back in input directory
+                self.counted.add(partial_file_path)
+            if hasattr(self, 'postprocess') and new_instances:
+                instances.append(new_instances)
+            if stop:
+                break
+
+        if hasattr(self, 'postprocess'):
+            self.postprocess(instances)
+        if not self.dryrun:
+            self.save_file_counts()
+        return self.restored
+
+    def is_already_imported(self, digest):
+        """Returns ``True`` if a file with the content ``digest`` was
+        already imported successfully by this configuration"""
+        return ImportedFile.objects.filter(
+            configuration=type(self).__name__,
+            digest=digest,
+            status=ImportedFile.DONE,
+        ).exists()
+
+    def record_import(self, digest, partial_file_path, status):
+        """Record in the ledger the outcome of the processing of the
+        endpoint file ``partial_file_path``"""
+        imported, created = ImportedFile.objects.get_or_create(
+            configuration=type(self).__name__,
+            digest=digest,
+            defaults={'path': partial_file_path, 'status': status},
+        )
+        if not created:
+            imported.path = partial_file_path
+            imported.status = status
+            imported.save()
+
     def process_recursively(self, path=""):
         """Recusively inspect :attribute:`BaseConfig.input_dir`
         and process files using BFS
 
         Recursivly inspect :attribute:`BaseConfig.input_dir`, loads
         builder class through :method:`BaseConfig.load_builder` and
-        run processing"""
+        run processing. Directories are walked iteratively so the depth
+        of the input tree is not bound by Python recursion limit."""
+        directories = deque([path])
+        while directories:
+            path = directories.popleft()
+            directories.extend(self.process_directory(path))
+
+    def process_directory(self, path):
+        """Process the files of the input directory ``path`` and clean it,
+        returns the subdirectories to process next.
+
+        The directory is listed once, the type and modification time
+        of each entry are shared between processing and cleaning."""
 
         instances = None
         if hasattr(self, 'postprocess'):
             instances = []
 
-        log.info(u'process_recursively %s' % path)
+        log.info(u'process_directory %s' % path)
 
-        input, work, error, done = self.paths(path)
+        endpoints = []  # files to be processed by the worker pool
+        directories = []  # subdirectories to be processed next
+        files = []  # entries of the files still in input directory
 
-        if not os.path.exists(work):
-            os.makedirs(work)
-        if not os.path.exists(error):
-            os.makedirs(error)
-        if not os.path.exists(done):
-            os.makedirs(done)
-        # input_dir should exists
+        input, work, error, done = self.make_dirs(path)
 
         log.info(u'work_path %s' % work)
 
-        for f in self.listdir(input):
+        with timings.measure('config', type(self).__name__, 'scandir'):
+            entries = self.scandir(input)
+        for entry in entries:
+            f = entry.name
             # Relative file path from current path
             partial_file_path = os.path.join(path, f)
             # Absolute file path
@@ -190,67 +676,63 @@ class BaseConfig(object):
 
             # For now, do not process non utf-8 file names  #FIXME
             if not is_utf8(f):
-                error_file_path = os.path.join(self.error_dir(), f)
+                error_file_path = self.layout_file_path(self.error_dir(), f)
                 move_file(input_file_path, error_file_path)
-
-            if os.path.isdir(input_file_path):
-                self.process_recursively(partial_file_path)
-            else:
-                if not os.path.exists(input_file_path):
-                    # the file might have been already moved
-                    # by a nested builder
+                self.moved['input'] -= 1
+                self.moved['error'] += 1
+                continue
+
+            if entry.is_dir():
+                directories.append(partial_file_path)
+                continue
+
+            files.append(entry)
+
+            if partial_file_path in self.opened:
+                # the file has been already moved
+                # by a nested builder
+                continue
+
+            # --- Check file age
+            # Idea is to prevent from processing a file too much recent, to
+            # avoid processing file while they are downloaded in input dir
+            # and to minimize risk of missing dependency files
+            # If you don't care about this, just do not set it in settings
+            min_age = self.QUARANTINE  # seconds
+            if min_age > 0:
+                try:
+                    st_mtime = entry.stat().st_mtime
+                except OSError:
+                    # moved away since the directory was listed
+                    continue
+                age = time() - st_mtime
+                if age < min_age:
+                    log.info(u"Skipping too recent file %s" % force_unicode(input_file_path))
                     continue
 
-                # --- Check file age
-                # Idea is to prevent from processing a file too much recent, to
-                # avoid processing file while they are downloaded in input dir
-                # and to minimize risk of missing dependency files
-                # If you don't care about this, just do not set it in settings
-                min_age = self.QUARANTINE  # seconds
-                if min_age > 0:
-                    st_mtime = os.stat(input_file_path).st_mtime
-                    age = time() - st_mtime
-                    if age < min_age:
-                        log.info(u"Skipping too recent file %s" % force_unicode(input_file_path))
-                        continue
-
-                # --- Load and process builder for file
-                builder = self.load_builder(partial_file_path)
-                if builder is None:
-                    log.info(u'skip file %s' % force_unicode(input_file_path))
+            if self._pool is None:
+                if not os.path.exists(input_file_path):
+                    # the file was moved away since the directory was
+                    # listed, by a builder or another process
                     continue
-                else:
-                    log.info(u'match %s' % force_unicode(partial_file_path))
-                    if not self.dryrun:
-                        try:
-                            new_instances, unhandled_errors = builder.process_and_save()
-                        except StopConfig, e:
-                            # this is a user controlled exception
-                            msg = u'Import stopped for %s' % self
-                            log.warning(msg, exc_info=sys.exc_info())
-                            to_dir = self.error_dir()
-                            break
-                        except PostponeBuilder, e:
-                            # Implementor as asked to postpone current process
-                            msg = u'Builder postponed for %s' % self
-                            log.warning(msg, exc_info=sys.exc_info())
-                            # Do not move files, keep them for next run
-                            to_dir = self.input_dir()
-                            continue  # to next file
-                        except Exception, e:
-                            msg = u'builder processing of %s failed' % input_file_path
-                            log.error(msg, exc_info=sys.exc_info())
-                            to_dir = self.error_dir()
-                        else:
-                            if hasattr(self, 'postprocess') and new_instances:
-                                instances.append(new_instances)
-                            to_dir = unhandled_errors and self.error_dir() \
-                                                              or self.done_dir()
-                        finally:
-                            self.mv_files_from_work_dir(to_dir=to_dir)
-                    else:
-                        # We are in dry-run, put back the files in input dir
-                        self.mv_files_from_work_dir(to_dir=self.input_dir())
+                with timings.measure('config', type(self).__name__, 'process_file'):
+                    stop, new_instances = self.process_file(partial_file_path)
+                if hasattr(self, 'postprocess') and new_instances:
+                    instances.append(new_instances)
+                if stop:
+                    break
+            else:
+                # Processing is delegated to the worker pool once the
+                # whole directory is inspected
+                endpoints.append(partial_file_path)
+
+        if endpoints:
+            results = self._pool.imap(_process_file_in_worker, endpoints)
+            for stop, new_instances, counts, measures in results:
+                self.counts.update(counts)
+                timings.merge(measures)
+                if hasattr(self, 'postprocess') and new_instances:
+                    instances.append(new_instances)
 
         # --- Clean old files from current input directory
         if not self.dryrun:
@@ -268,17 +750,79 @@ class BaseConfig(object):
             # (See for example ticket #14051 in Django Trac)
             # When the Implementor has used Config.open to manage these files,
             # they already have been moved away
-            for f in self.listdir(input):
-                input_file_path = os.path.join(input, f)
-                done_file_path = os.path.join(done, f)
-                if os.path.isdir(input_file_path):
-                    continue
-                grace_period = self.GRACE_PERIOD
-                st_mtime = os.stat(input_file_path).st_mtime
-                age = time() - st_mtime
-                if age > grace_period:
-                    log.info(u"Removing old file from input dir: %s" % force_unicode(input_file_path))
-                    move_file(input_file_path, done_file_path)
+            grace_period = self.GRACE_PERIOD
+            with timings.measure('config', type(self).__name__, 'clean'):
+                for entry in files:
+                    f = entry.name
+                    if os.path.join(path, f) in self.opened:
+                        continue
+                    input_file_path = os.path.join(input, f)
+                    try:
+                        st_mtime = entry.stat().st_mtime
+                    except OSError:
+                        # moved away by a builder or another process
+                        continue
+                    age = time() - st_mtime
+                    if age > grace_period:
+                        if not os.path.exists(input_file_path):
+                            # moved away by a worker or the implementor
+                            continue
+                        log.info(u"Removing old file from input dir: %s" % force_unicode(input_file_path))
+                        done_file_path = self.layout_file_path(
+                            self.done_dir(),
+                            os.path.join(path, f),
+                        )
+                        move_file(input_file_path, done_file_path)
+                        self.moved['input'] -= 1
+                        self.moved['done'] += 1
+
+            # files left in input directory
+            for entry in files:
+                if os.path.lexists(entry.path):
+                    self.input_files += 1
+                    self.counted.add(os.path.join(path, entry.name))
+            self.save_file_counts(input=False)
 
         if hasattr(self, 'postprocess'):
-            self.postprocess(instances)
+            with timings.measure('config', type(self).__name__, 'postprocess'):
+                self.postprocess(instances)
+        return directories
+
+
+# Worker processes state, set by :func:`_init_worker` in each forked process
+_worker_config = None
+_worker_stop = None
+
+
+def _init_worker(config, stop):
+    """Initialize a pool worker with its own copy of the running
+    configuration and the event shared by workers to stop the run"""
+    global _worker_config, _worker_stop
+    _worker_config = config
+    _worker_stop = stop
+
+
+def _process_file_in_worker(partial_file_path):
+    """Process one endpoint file in a pool worker, see
+    :meth:`BaseConfig.process_file`, returns the instances counts and
+    the timings of the file along the result of ``process_file``"""
+    if _worker_stop.is_set():
+        # a builder raised StopConfig, leave the file for next run
+        return False, None, {}, []
+    input_file_path = os.path.join(_worker_config.input_dir(), partial_file_path)
+    if not os.path.exists(input_file_path):
+        # the file might have been already moved
+        # by a nested builder in another worker
+        return False, None, {}, []
+    _worker_config.counts = Counter()
+    timings.reset()
+    name = type(_worker_config).__name__
+    with timings.measure('config', name, 'process_file'):
+        stop, new_instances = _worker_config.process_file(partial_file_path)
+    _worker_config.save_file_counts()
+    if stop:
+        _worker_stop.set()
+    if not hasattr(_worker_config, 'postprocess'):
+        # no need to send instances back to the main process
+        new_instances = None
+    return stop, new_instances, dict(_worker_config.counts), timings.dump()
@@ -1,18 +1,17 @@
-import os
-import shutil
-from time import time
 from optparse import make_option
 
-from django.utils.importlib import import_module
 from django.core.management.base import BaseCommand
 
-from swallow.util import get_config
+from swallow.clean import Cleaner
+from swallow.models import FileCount
+from swallow.util import configurations
 
 
 class Command(BaseCommand):
     args = 'import_config_module import_config_module ...'
     help = ('Executes specified clean operation for provided configuration '
-            'and directories')
+            'and directories, by default the directories and the retention '
+            'policies are the RETENTION of the configuration')
     option_list = BaseCommand.option_list + (
         make_option('--dryrun',
             action='store_true',
@@ -27,11 +26,34 @@ class Command(BaseCommand):
             action='store',
             dest='age',
             help='Minimum age (in seconds) a file should have to be deleted'),
+        make_option('--count',
+            action='store',
+            dest='count',
+            help='Number of the newest files to keep in each directory'),
+        make_option('--bytes',
+            action='store',
+            dest='bytes',
+            help='Total size of the newest files to keep in each directory'),
         make_option('--move',
             action='store_true',
             dest='move',
             default=False,
             help='Move the selected files to the duplicate folder instead of deleting them'),
+        make_option('--archive',
+            action='store_true',
+            dest='archive',
+            default=False,
+            help='Pack the selected done files in archives by day instead of deleting them'),
+        make_option('--threads',
+            action='store',
+            dest='threads',
+            default='4',
+            help='Number of threads removing files'),
+        make_option('--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Clean from the start instead of resuming an interrupted run'),
         )
 
     def handle(self, *config_module_names, **options):
@@ -39,18 +61,13 @@ class Command(BaseCommand):
         if not config_module_names:
             print 'no configurations provided'
             return
-        if options['dirs'] is None:
-            print '--dirs is missing'
-            return
-        if options['age'] is None:
-            print '--age is missing'
-            return
 
-        dryrun = options['dryrun']
-        verbosity = options['verbosity']
-        max_age = int(options['age'])
-        dirs = options['dirs'].split(',')
-        move = options['move']
+        dryrun = options.get('dryrun', False)
+        verbosity = int(options['verbosity'])
+        limits = {}
+        for name in ('age', 'count', 'bytes'):
+            if options.get(name) is not None:
+                limits[name] = int(options[name])
 
         if dryrun:
             msg = 'This is a dry run. '
@@ -60,32 +77,65 @@ class Command(BaseCommand):
 
         for config_module_name in config_module_names:
             # import config class
-            ConfigClass = get_config(config_module_name)
+            ConfigClass = configurations.resolve(config_module_name)
+
+            if options.get('dirs') is None:
+                dirs = sorted(ConfigClass.RETENTION.keys())
+                if not dirs:
+                    print '--dirs is missing for %s' % config_module_name
+                    continue
+            else:
+                dirs = options['dirs'].split(',')
 
             for dir_ in dirs:
-                # fetch swallow_dir
-                swallow_dir = '%s_dir' % dir_
-                swallow_dir = getattr(ConfigClass, swallow_dir)()
+                if options.get('archive') and dir_ != 'done':
+                    print 'only done files can be archived, %s is skipped' % dir_
+                    continue
+                cleaner = Cleaner(
+                    ConfigClass,
+                    dir_,
+                    age=limits.get('age'),
+                    count=limits.get('count'),
+                    size=limits.get('bytes'),
+                    move=options.get('move', False),
+                    archive=options.get('archive', False),
+                    dryrun=dryrun,
+                    threads=int(options.get('threads', 4)),
+                    restart=options.get('restart', False),
+                )
+                if not cleaner.has_policy():
+                    print '--age, --count or --bytes is missing for %s' % dir_
+                    continue
+                if verbosity > 1:
+                    cleaner.listeners.append(self.listener(cleaner))
+                if verbosity > 0:
+                    cleaner.progress.append(self.progress)
+
+                removed = cleaner.run()
+                if not dryrun:
+                    FileCount.add(ConfigClass.__name__, {dir_: -removed})
 
-                # clean dir
-                for dirpath, _, filenames in os.walk(swallow_dir):
-                    for filename in filenames:
-                        file_path = os.path.join(dirpath, filename)
-                        st_mtime = os.stat(file_path).st_mtime
-                        age = time() - st_mtime
+    def listener(self, cleaner):
+        def listener(path):
+            if cleaner.archives is not None:
+                self.stdout.write("%s is to be archived in %s\n" % (
+                    path,
+                    cleaner.config.archive_dir(),
+                ))
+            elif cleaner.move:
+                self.stdout.write("%s is to be moved to %s\n" % (
+                    path,
+                    cleaner.config.duplicate_dir(),
+                ))
+            else:
+                self.stdout.write("%s is to be deleted\n" % path)
+        return listener
 
-                        if age > max_age:
-                            duplicate_path = getattr(ConfigClass, 'duplicate_dir')()
-                            if verbosity > 0:  # Use --verbosity=0 to make it quiet
-                                if move:
-                                    self.stdout.write("%s is to be moved to %s\n" % (file_path, duplicate_path))
-                                else:
-                                    self.stdout.write("%s is to be deleted\n" % file_path)
-                            if not dryrun:
-                                if move:
-                                    if not os.path.exists(duplicate_path):
-                                        os.mkdir(duplicate_path)
-                                    new_file_path = os.path.join(duplicate_path, filename)
-                                    shutil.move(file_path, new_file_path)
-                                else:
-                                    os.remove(file_path)
+    def progress(self, cleaner):
+        self.stdout.write('%s %s: %s files scanned, %s removed, %s errors\n' % (
+            cleaner.config.__name__,
+            cleaner.directory,
+            cleaner.scanned,
+            cleaner.removed,
+            cleaner.errors,
+        ))
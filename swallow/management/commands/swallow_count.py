@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from swallow.models import FileCount
+from swallow.util import configurations, count_files
+
+
+class Command(BaseCommand):
+    args = '[import_config_module import_config_module ...]'
+    help = ('Counts the files of input, done and error directories of the '
+            'specified configurations, or of every configuration of '
+            'SWALLOW_CONFIGURATION_MODULES, to correct the file counts '
+            'displayed in the admin')
+
+    def handle(self, *config_module_names, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        if config_module_names:
+            classes = [configurations.resolve(name) for name in config_module_names]
+        else:
+            classes = configurations.all().values()
+
+        for ConfigClass in classes:
+            for directory in ('input', 'done', 'error'):
+                path = getattr(ConfigClass, '%s_dir' % directory)()
+                count = count_files(path)
+                FileCount.set(ConfigClass.__name__, directory, count)
+                if verbosity > 0:
+                    self.stdout.write('%s %s: %s files\n' % (
+                        ConfigClass.__name__,
+                        directory,
+                        count,
+                    ))
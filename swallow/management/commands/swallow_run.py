@@ -1,13 +1,18 @@
+import json
+
 from optparse import make_option
 
 from django.utils.importlib import import_module
 from django.core.management.base import BaseCommand
 
-from swallow.util import get_config
+from swallow.util import configurations
+from swallow.watch import Watcher
+from swallow.timing import timings
 
 class Command(BaseCommand):
     args = '<import_config_module import_config_module ...>'
-    help = 'Executes specified imports'
+    help = ('Executes specified imports, configurations are given by module '
+            'path or by name if they are in SWALLOW_CONFIGURATION_MODULES')
 
     option_list = BaseCommand.option_list + (
         make_option('--dry-run',
@@ -15,10 +20,44 @@ class Command(BaseCommand):
             dest='dryrun',
             default=False,
             help="Pretend to do the import but don't do it"),
+        make_option('--jobs',
+            action='store',
+            dest='jobs',
+            type='int',
+            default=None,
+            help='Number of worker processes used to process files '
+                 '(default to the configuration WORKERS)'),
+        make_option('--watch',
+            action='store_true',
+            dest='watch',
+            default=False,
+            help='Keep running and process files as soon as they are '
+                 'written in input directories'),
+        make_option('--interval',
+            action='store',
+            dest='interval',
+            type='int',
+            default=60,
+            help='With --watch, seconds between two runs of configurations '
+                 'when filesystem events are not available'),
+        make_option('--rescan',
+            action='store',
+            dest='rescan',
+            type='int',
+            default=60 * 60,
+            help='With --watch, seconds between two full runs of '
+                 'configurations'),
+        make_option('--timings',
+            action='store',
+            dest='timings',
+            default=None,
+            help='Write the timings of the import phases as JSON '
+                 'in this file'),
         )
 
     def handle(self, *args, **options):
         dryrun = options['dryrun']
+        jobs = options['jobs']
 
         if dryrun:
             msg = 'This is a dry run. '
@@ -26,7 +65,25 @@ class Command(BaseCommand):
             msg += 'to see what happens'
             self.stdout.write(msg)
 
+        configs = []
         for import_config_module in args:
-            ConfigClass = get_config(import_config_module)
+            ConfigClass = configurations.resolve(import_config_module)
             config = ConfigClass(dryrun)
-            config.run()
+            if jobs is not None:
+                config.workers = jobs
+            configs.append(config)
+
+        timings.reset()
+        try:
+            if options['watch']:
+                watcher = Watcher(configs, options['interval'], options['rescan'])
+                watcher.run()
+            else:
+                for config in configs:
+                    config.run()
+        finally:
+            if timings.stats and int(options.get('verbosity', 1)) > 0:
+                self.stdout.write(timings.summary().encode('utf-8') + '\n')
+            if options['timings'] is not None:
+                with open(options['timings'], 'w') as f:
+                    json.dump(timings.dump(), f, indent=2)
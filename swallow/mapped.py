@@ -0,0 +1,139 @@
+"""Memory mapped input files.
+
+:func:`open_mapped` returns a :class:`MappedFile`, a read only file object
+over a memory map of the file. Parsers read it from the page cache without
+copying it in Python buffers, and files read again, for instance by a
+retried or postponed builder, are not read from the disk again while they
+are in the page cache.
+
+Files that can't be mapped, like pipes, empty files or compressed files,
+are opened with :func:`swallow.compression.open_input`.
+
+The byte ranges of the records of a mapped XML file are found with
+:meth:`MappedFile.ranges`, a record is parsed alone with
+:meth:`MappedFile.parse_range`, see :class:`swallow.mappers.SlicedXmlMapper`.
+"""
+import os
+import re
+import mmap
+import stat
+
+from lxml import etree
+
+from swallow.compression import compression, open_input
+
+
+class MappedFile(object):
+    """Read only file object over the memory map of the open file ``f``"""
+
+    def __init__(self, f):
+        self.file = f
+        self.name = f.name
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._root = None
+
+    def __len__(self):
+        return len(self.map)
+
+    def __getitem__(self, s):
+        return self.map[s]
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.map) - self.map.tell()
+        return self.map.read(size)
+
+    def readline(self, size=-1):
+        line = self.map.readline()
+        if size is not None and size >= 0 and len(line) > size:
+            self.map.seek(size - len(line), os.SEEK_CUR)
+            line = line[:size]
+        return line
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.map.seek(offset, whence)
+
+    def tell(self):
+        return self.map.tell()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def root(self):
+        """Returns the XML declaration of the file, with its encoding,
+        followed by the start tag of the root element and its end tag"""
+        if self._root is None:
+            match = re.compile(r'<([^?!/\s>][^\s>/]*)[^>]*>').search(self.map)
+            if match is None:
+                raise ValueError('%s has no root element' % self.name)
+            start = match.group(0)
+            if start.endswith('/>'):
+                start = start[:-2] + '>'
+            declaration = re.compile(r'(\xef\xbb\xbf)?\s*(<\?xml\s[^>]*\?>)').match(self.map)
+            if declaration is not None:
+                start = declaration.group(2) + start
+            self._root = start, '</%s>' % match.group(1)
+        return self._root
+
+    def ranges(self, tag, start=0, stop=None):
+        """Yield the byte ranges ``(start, end)`` of the elements ``tag``,
+        written as in the file with its prefix if it has one, that start
+        between ``start`` and ``stop``. Elements ``tag`` must not be
+        nested and must be defined with prefixes of the root element."""
+        if stop is None:
+            stop = len(self.map)
+        opening = re.compile(r'<%s[\s/>]' % re.escape(tag))
+        closing = '</%s>' % tag
+        # the character after the tag of an element starting just before
+        # stop must be searched
+        limit = min(stop + len(tag) + 2, len(self.map))
+        position = start
+        while True:
+            match = opening.search(self.map, position, limit)
+            if match is None or match.start() >= stop:
+                return
+            begin = match.start()
+            end = self.map.find('>', begin) + 1
+            if self.map[end - 2] != '/':
+                end = self.map.find(closing, match.end())
+                if end == -1:
+                    return
+                end += len(closing)
+            yield begin, end
+            position = end
+
+    def parse_range(self, start, end):
+        """Returns the element of the byte range ``start:end``, it's parsed
+        in a copy of the root element so that namespaces of the root are
+        defined, after the XML declaration of the file so that it's
+        decoded with the encoding of the file"""
+        opening, closing = self.root()
+        return etree.fromstring(opening + self.map[start:end] + closing)[0]
+
+
+def open_mapped(path):
+    """Open the file ``path`` with a memory map, or as a stream if it's not
+    a regular file, is empty or is compressed"""
+    f = open(path, 'rb')
+    st = os.fstat(f.fileno())
+    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        return f
+    if compression(f) is not None:
+        f.close()
+        return open_input(path)
+    try:
+        return MappedFile(f)
+    except (EnvironmentError, ValueError):
+        # the filesystem doesn't support memory maps
+        f.seek(0)
+        return f
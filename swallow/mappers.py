@@ -1,6 +1,59 @@
+import re
+
 from lxml import etree
+from datetime import datetime
+from collections import deque
 import json
 
+from swallow.mapped import MappedFile
+
+
+class memoized_property(object):
+    """Decorator of the properties of a mapper that are computed once
+    per mapper.
+
+    The value is stored in the ``__dict__`` of the mapper, under the name
+    of the property, where it's found by the next accesses without calling
+    the descriptor. Deleting the attribute forgets the value.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.__name__] = self.func(instance)
+        return value
+
+
+class XPathRegistry(object):
+    """Registry of compiled :class:`etree.XPath` by expression and
+    namespaces, so that an expression is compiled once per process"""
+
+    def __init__(self):
+        self.xpaths = {}
+
+    def get(self, expression, namespaces=None):
+        """Returns the compiled ``expression`` with the prefixes of
+        ``namespaces``"""
+        if namespaces:
+            key = (expression, tuple(sorted(namespaces.items())))
+        else:
+            key = (expression, ())
+        xpath = self.xpaths.get(key)
+        if xpath is None:
+            xpath = self.xpaths[key] = etree.XPath(
+                expression,
+                namespaces=namespaces,
+            )
+        return xpath
+
+
+xpaths = XPathRegistry()  # compiled expressions of the current process
+
 
 class BaseMapper(object):
 
@@ -24,7 +77,12 @@ class BaseMapper(object):
 # FIXME: Remove this class from swallow
 class XmlMapper(BaseMapper):
     """Xml file mapper to access it's properties passed to
-    :meth:`BaseConfig.populate`"""
+    :meth:`BaseConfig.populate`
+
+    :meth:`xpath` and :meth:`xpath_text` evaluate expressions compiled
+    once with the prefixes of ``namespaces``."""
+
+    namespaces = None
 
     def __init__(self, item, content, builder=None):
         # content should be a path
@@ -38,5 +96,324 @@ class XmlMapper(BaseMapper):
         root = xml.getroot()
         yield cls(root, builder.content)
 
+    @classmethod
+    def _xpath(cls, expression):
+        """Returns ``expression`` compiled with the class namespaces"""
+        return xpaths.get(expression, cls.namespaces)
+
+    def xpath(self, expression, **variables):
+        """Evaluate ``expression`` on the item of the mapper"""
+        return self._xpath(expression)(self._item, **variables)
+
+    def xpath_text(self, expression, default=None, **variables):
+        """Returns the text of the first result of ``expression``, or
+        ``default`` if there is none"""
+        result = self.xpath(expression, **variables)
+        if isinstance(result, list):
+            if not result:
+                return default
+            result = result[0]
+        if etree.iselement(result):
+            return result.text
+        return result
+
     def __str__(self):
         return '<%s %s>' % (type(self).__name__, self._content)
+
+
+class IterXmlMapper(XmlMapper):
+    """Xml mapper that streams the file of the builder and yields one
+    mapper per ``tag`` element, the memory used does not depend on the
+    size of the file.
+
+    ``tag`` is the tag of the records, it can be written with
+    Clark's notation ``{http://www.w3.org/2005/Atom}entry`` or with
+    a prefix defined in ``namespaces`` like ``atom:entry``.
+
+    Records are cleared once processed by the builder, with their
+    preceding siblings, so mappers should not keep a reference to
+    ``_item`` or its children.
+    """
+
+    tag = None
+
+    @classmethod
+    def _record_tag(cls):
+        """Returns ``tag`` in Clark's notation"""
+        if cls.tag is None:
+            raise NotImplementedError()
+        if ':' in cls.tag and not cls.tag.startswith('{'):
+            prefix, name = cls.tag.split(':', 1)
+            return '{%s}%s' % (cls.namespaces[prefix], name)
+        return cls.tag
+
+    @classmethod
+    def _iter_mappers(cls, builder):
+        # The builder should have a fd property
+        context = etree.iterparse(
+            builder.fd,
+            events=('end',),
+            tag=cls._record_tag(),
+        )
+        # the builder pulls mappers by chunks of CHUNK_SIZE before
+        # processing them
+        window = getattr(builder, 'CHUNK_SIZE', None) or 1
+        items = deque()
+        for event, item in context:
+            yield cls(item, builder.content, builder)
+            items.append(item)
+            if len(items) >= window:
+                # free a processed record and the records before it
+                item = items.popleft()
+                item.clear()
+                while item.getprevious() is not None:
+                    del item.getparent()[0]
+        del context
+
+
+class SlicedXmlMapper(IterXmlMapper):
+    """Xml mapper that parses each ``tag`` record alone from the byte
+    range it spans in a memory mapped file, see :mod:`swallow.mapped`.
+
+    ``raw_tag`` is the tag of the records as written in the file, by
+    default ``tag`` if it's not written with Clark's notation. If the
+    builder has a ``byte_range`` attribute ``(start, stop)`` only the
+    records starting in that range are yielded. It's a hook for builders
+    that split a large file between workers, swallow itself never sets it
+    and processes the whole file.
+
+    Files that are not memory mapped are streamed like
+    :class:`IterXmlMapper` does.
+    """
+
+    raw_tag = None
+
+    @classmethod
+    def _raw_tag(cls):
+        if cls.raw_tag is not None:
+            return cls.raw_tag
+        if cls.tag is None:
+            raise NotImplementedError()
+        if cls.tag.startswith('{'):
+            raise ValueError(
+                '%s.tag %s is written in Clark\'s notation, set raw_tag to '
+                'the tag of the records as written in the file' % (
+                    cls.__name__,
+                    cls.tag,
+                )
+            )
+        return cls.tag
+
+    @classmethod
+    def _iter_mappers(cls, builder):
+        fd = builder.fd
+        if not isinstance(fd, MappedFile):
+            for mapper in super(SlicedXmlMapper, cls)._iter_mappers(builder):
+                yield mapper
+            return
+        start, stop = getattr(builder, 'byte_range', None) or (0, None)
+        for begin, end in fd.ranges(cls._raw_tag(), start, stop):
+            yield cls(fd.parse_range(begin, end), builder.content, builder)
+
+
+class Field(object):
+    """Declaration of a field of a :class:`DeclarativeMapper`.
+
+    ``path`` is the path of the value relative to the item, ``converter``
+    is ``'text'``, ``'int'``, ``'datetime'``, ``'list'`` or a callable
+    called with the text. ``'list'`` returns the texts of every match, the
+    other converters convert the first match or return ``default``.
+    ``format`` is the format of ``'datetime'`` fields.
+
+    Paths made of tags, with the prefixes of the ``namespaces`` of the
+    mapper, and an optional final ``@attribute`` are extracted in a single
+    walk of the item, other paths are evaluated as XPath expressions.
+    """
+
+    _counter = 0  # fields are extracted in the order of their declaration
+
+    def __init__(self, path, converter='text', default=None,
+                 format='%Y-%m-%dT%H:%M:%S'):
+        self.path = path
+        self.converter = converter
+        self.default = default
+        self.format = format
+        self.many = converter == 'list'
+        Field._counter += 1
+        self.counter = Field._counter
+
+    def convert(self, value):
+        """Convert the text ``value`` of the first match"""
+        if self.converter == 'text':
+            return value
+        elif self.converter == 'int':
+            return int(value.strip())
+        elif self.converter == 'datetime':
+            return datetime.strptime(value.strip(), self.format)
+        return self.converter(value)
+
+    def steps(self, namespaces):
+        """Returns the tags, in Clark's notation, and the attribute of
+        ``path`` or ``None`` if it's not a simple path"""
+        steps = self.path.split('/')
+        attribute = None
+        if steps[-1].startswith('@'):
+            attribute = self._clark(steps.pop()[1:], namespaces)
+            if attribute is None:
+                return None
+        tags = [self._clark(step, namespaces) for step in steps]
+        if not tags or None in tags:
+            return None
+        return tags, attribute
+
+    def _clark(self, name, namespaces):
+        if not _NAME.match(name):
+            return None
+        if ':' in name:
+            prefix, name = name.split(':')
+            if prefix not in (namespaces or {}):
+                return None
+            return '{%s}%s' % (namespaces[prefix], name)
+        return name
+
+
+_NAME = re.compile(r'^[A-Za-z_][\w.-]*(:[A-Za-z_][\w.-]*)?$')
+
+
+class _PlanNode(object):
+    """Node of the extraction plan of a :class:`DeclarativeMapper`, the
+    fields found at a tag and the nodes of its children by tag"""
+
+    __slots__ = ('fields', 'children')
+
+    def __init__(self):
+        self.fields = []  # ``(name, attribute)``
+        self.children = {}
+
+
+def _field_property(name):
+    def getter(self):
+        return getattr(self._record, name)
+    getter.__name__ = name
+    return property(getter)
+
+
+class DeclarativeMapperMetaclass(type):
+    """Collects the :class:`Field` of a mapper class, replaces them with
+    properties reading the record of the mapper and compiles the
+    extraction plan of the class"""
+
+    def __new__(cls, name, bases, attrs):
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, '_fields', {}))
+        for key, value in attrs.items():
+            if isinstance(value, Field):
+                fields[key] = value
+                attrs[key] = _field_property(key)
+            elif key in fields:
+                # a field of a base class overriden by a property
+                del fields[key]
+        attrs['_fields'] = fields
+        new_class = super(DeclarativeMapperMetaclass, cls).__new__(
+            cls,
+            name,
+            bases,
+            attrs,
+        )
+        new_class._compile()
+        return new_class
+
+
+class DeclarativeMapper(XmlMapper):
+    """Xml mapper which fields are declared with :class:`Field`:
+
+      .. code-block:: python
+
+        class Mapper(DeclarativeMapper, IterXmlMapper):
+
+            tag = 'product'
+
+            name = Field('name')
+            price = Field('price/@cents', 'int')
+            tags = Field('tags/tag', 'list')
+
+    The fields are extracted at once, on first access, in :attr:`_record`
+    an instance of the class ``Record`` of the mapper which ``__slots__``
+    are the fields. Builders populate the fields of
+    ``_fields_one_to_one`` from the record.
+    """
+
+    __metaclass__ = DeclarativeMapperMetaclass
+
+    @classmethod
+    def _compile(cls):
+        """Compile the extraction plan of the fields of the class"""
+        names = sorted(cls._fields, key=lambda name: cls._fields[name].counter)
+        cls.Record = type('%sRecord' % cls.__name__, (object,), {
+            '__slots__': tuple(names),
+            '_names': frozenset(names),
+        })
+        cls._plan = _PlanNode()
+        cls._xpath_fields = []
+        cls._field_list = []
+        for name in names:
+            field = cls._fields[name]
+            cls._field_list.append((name, field))
+            steps = field.steps(cls.namespaces)
+            if steps is None:
+                cls._xpath_fields.append((name, field))
+                continue
+            tags, attribute = steps
+            node = cls._plan
+            for tag in tags:
+                node = node.children.setdefault(tag, _PlanNode())
+            node.fields.append((name, attribute))
+
+    @classmethod
+    def _extract(cls, item):
+        """Returns the record of the fields of ``item``"""
+        matches = {}
+        # breadth first so that matches are in document order
+        queue = deque([(item, cls._plan)])
+        while queue:
+            element, node = queue.popleft()
+            for child in element:
+                child_node = node.children.get(child.tag)
+                if child_node is None:
+                    continue
+                for name, attribute in child_node.fields:
+                    if attribute is None:
+                        value = child.text
+                    else:
+                        value = child.get(attribute)
+                    if value is not None:
+                        matches.setdefault(name, []).append(value)
+                if child_node.children:
+                    queue.append((child, child_node))
+        for name, field in cls._xpath_fields:
+            result = xpaths.get(field.path, cls.namespaces)(item)
+            if not isinstance(result, list):
+                result = [result]
+            values = []
+            for value in result:
+                if etree.iselement(value):
+                    value = value.text
+                if value is not None:
+                    values.append(value)
+            matches[name] = values
+        record = cls.Record()
+        for name, field in cls._field_list:
+            values = matches.get(name)
+            if field.many:
+                value = values or []
+            elif values:
+                value = field.convert(values[0])
+            else:
+                value = field.default
+            setattr(record, name, value)
+        return record
+
+    @memoized_property
+    def _record(self):
+        return self._extract(self._item)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import stat
 import time
 import functools
 
@@ -86,7 +87,7 @@ class Matching(models.Model):
 
             @functools.wraps(func)
             def wrapper(self):
-                matching = Matching.objects.get(name=this.matching_name)
+                matching = self._matchings.get(this.matching_name)
                 match = matching.match(self._mapper, this.first_match)
                 if this.post_process_match is not None:
                     match = this.post_process_match(match)
@@ -94,80 +95,285 @@ class Matching(models.Model):
                 return values
             return wrapper
 
+    def compiled(self):
+        """Returns the :class:`CompiledMatching` of the matching file, it's
+        cached per process until the matching or its file changes."""
+        if self.pk is None:
+            return CompiledMatching.from_file(self.file)
+        now = time.time()
+        cached = _compiled_matchings.get(self.pk)
+        if cached is not None:
+            name, modified_time, checked, compiled = cached
+            if name == self.file.name:
+                if now - checked < CompiledMatching.CHECK_INTERVAL:
+                    return compiled
+                if self.file.storage.modified_time(name) == modified_time:
+                    _compiled_matchings[self.pk] = (name, modified_time, now, compiled)
+                    return compiled
+        modified_time = self.file.storage.modified_time(self.file.name)
+        compiled = CompiledMatching.from_file(self.file)
+        _compiled_matchings[self.pk] = (self.file.name, modified_time, now, compiled)
+        return compiled
+
     def match(self, mapper, first_match=False):
         """Returns values or the first value if ``first_match`` is
         set that matches the mapper according the matching xml file.
         """
         # FIXME: first_match should not be used anymore
-        self.file.open()
-        xml = etree.parse(self.file)
-        self.file.close()
+        return self.compiled().match(mapper, first_match)
+
+
+# Matching pk -> (file name, file modification time, time of last check,
+#                 compiled matching)
+_compiled_matchings = {}
+
+
+def _invalidate_compiled_matching(sender, instance, **kwargs):
+    _compiled_matchings.pop(instance.pk, None)
+    matchings.discard(instance)
+
+models.signals.post_save.connect(_invalidate_compiled_matching, sender=Matching)
+models.signals.post_delete.connect(_invalidate_compiled_matching, sender=Matching)
+
+
+class MatchingRegistry(object):
+    """Cache of :class:`Matching` instances by name, so that each matching
+    is fetched once from the database.
+
+    A registry is created for each run of a configuration as
+    ``config.matchings``, otherwise the process wide registry
+    ``swallow.models.matchings`` is used.
+    """
+
+    def __init__(self):
+        self.matchings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """Returns the matching named ``name``"""
+        try:
+            matching = self.matchings[name]
+        except KeyError:
+            self.misses += 1
+            matching = Matching.objects.get(name=name)
+            self.matchings[name] = matching
+        else:
+            self.hits += 1
+        return matching
+
+    def discard(self, matching):
+        """Remove ``matching`` from the registry"""
+        for name, cached in self.matchings.items():
+            if cached.pk == matching.pk:
+                del self.matchings[name]
 
-        output = []  # holds values to be returned
-                     # only used if ``first_match`` is ``False``
+    def __repr__(self):
+        return '<MatchingRegistry %s hits %s misses>' % (self.hits, self.misses)
+
+
+# process wide registry
+matchings = MatchingRegistry()
+
+
+class CompiledMatching(object):
+    """In memory representation of a matching xml file built once, see
+    :class:`Matching`.
+
+    Rules values are indexed by rule name and value, so that a match
+    costs one property access and one or two dictionary lookups per
+    rule name used in the file whatever the number of maps.
+    """
+
+    CHECK_INTERVAL = 1  # Seconds during which a cached compiled matching
+                        # is used without checking its file
+
+    def __init__(self, xml):
+        self.default = dict(xml.getroot().items()).get('default', None)
+        self.columns = []  # column of each map in file order
+        self.required = []  # number of rule names of each set by set id
+        self.set_maps = []  # map index of each set by set id
+        self.always = set()  # index of maps that have an empty set
+        self.names = []  # rule names used in the file
+        self.loose_names = set()  # rule names that have loose rules
+        self.exact = {}  # ``(name, value)`` -> set ids
+        self.loose = {}  # ``(name, normalized value)`` -> set ids
 
         for map in xml.iterfind('//map'):
             # a possible return value
-            column = map.find('column').text
-
-            matched_set = False
-            for set in map.iterfind('set'):
-                # build the set of rules
-                # set of rules is a dictionary::
-                #
-                #   {
-                #       'title': False,
-                #       'suptitle': False
-                #   }
-                #
-                # The value of a key is True if at least
-                # one rule matched
-                match = dict()
-                for rule in set.iterchildren():
+            map_index = len(self.columns)
+            self.columns.append(map.find('column').text)
+            for rules in map.iterfind('set'):
+                set_id = len(self.required)
+                required = set()
+                for rule in rules.iterchildren():
                     # Do not consider XML comments <!-- like this -->
                     if isinstance(rule, etree._Comment):
                         continue
                     name = rule.tag
+                    required.add(name)
+                    if name not in self.names:
+                        self.names.append(name)
                     loose = rule.get('loose-compare')
                     loose = loose == 'yes'  # Cast to boolean
-                    v1 = rule.text
-                    v2 = getattr(mapper, name)
+                    value = rule.text
                     if loose:
-                        v1 = normalize(v1)
-                        v2 = normalize(v2)
-                    if v1 == v2:
-                        match[name] = True
+                        self.loose_names.add(name)
+                        if value is not None:
+                            value = normalize(value)
+                        index = self.loose
                     else:
-                        v = match.get(name, None)
-                        if v is None:
-                            match[name] = False
-                matched = True
-                for v in match.values():
-                    if not v:
-                        matched = False
-                        break
-
-                if matched:
-                    # the set matched no need to test other set
-                    # for another match one is enough
-                    # if we get here the set matched so the map matched
-                    if first_match:
-                        return column
-
-                    matched_set = True
-                    break  # no need to try another set
-            if matched_set:
-                output.append(column)
+                        index = self.exact
+                    set_ids = index.setdefault((name, value), [])
+                    if set_id not in set_ids:
+                        set_ids.append(set_id)
+                if not required:
+                    self.always.add(map_index)
+                self.required.append(len(required))
+                self.set_maps.append(map_index)
+
+    @classmethod
+    def from_file(cls, file):
+        file.open()
+        try:
+            xml = etree.parse(file)
+        finally:
+            file.close()
+        return cls(xml)
+
+    def match(self, mapper, first_match=False):
+        """See :meth:`Matching.match`"""
+        # count of rule names that matched by set id
+        # a set matches if every rule name matched
+        matched = {}
+        for name in self.names:
+            value = getattr(mapper, name)
+            set_ids = set()
+            try:
+                set_ids.update(self.exact.get((name, value), ()))
+                if name in self.loose_names:
+                    key = (name, normalize(value))
+                    set_ids.update(self.loose.get(key, ()))
+            except TypeError:
+                pass  # value is not hashable so it matches nothing
+            for set_id in set_ids:
+                matched[set_id] = matched.get(set_id, 0) + 1
+
+        maps = set(self.always)  # index of the maps that matched
+        for set_id, count in matched.iteritems():
+            if count == self.required[set_id]:
+                maps.add(self.set_maps[set_id])
+
+        if first_match and maps:
+            return self.columns[min(maps)]
+        output = [self.columns[index] for index in sorted(maps)]
         if not output:
-            default = dict(xml.getroot().items()).get('default', None)
-            if default is not None:
+            if self.default is not None:
                 if first_match:
-                    return default
+                    return self.default
                 else:
-                    output.append(default)
+                    output.append(self.default)
         return output
 
 
+class ImportedFile(models.Model):
+    """Ledger of the endpoint files processed by a configuration, files
+    are identified by the digest of their content so that a file dropped
+    again in input directory is not processed twice.
+
+    See :attr:`swallow.config.BaseConfig.LEDGER`.
+    """
+
+    DONE = 'done'
+    ERROR = 'error'
+    STATUS_CHOICES = (
+        (DONE, 'Done'),
+        (ERROR, 'Error'),
+    )
+
+    # :param configuration: name of the configuration class
+    configuration = models.CharField(max_length=250, db_index=True)
+
+    # :param digest: hexadecimal digest of the file content
+    digest = models.CharField(max_length=64, db_index=True)
+
+    # :param path: last path of the file relative to input directory
+    path = models.CharField(max_length=1024)
+
+    # :param status: outcome of the last processing of the file
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+
+    # :param date: date of the last processing of the file
+    date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('configuration', 'digest')
+
+    def __unicode__(self):
+        return u'%s %s' % (self.configuration, self.path)
+
+
+class FileCount(models.Model):
+    """Number of files in a swallow directory of a configuration.
+
+    Counts are updated by configurations when they move files and are
+    set by the ``swallow_count`` command which counts the files of the
+    directories, it should be run periodically to correct the drift
+    caused by files moved by other programs. Counts that were never set
+    by ``swallow_count`` or by a run are not updated.
+    """
+
+    # :param configuration: name of the configuration class
+    configuration = models.CharField(max_length=250)
+
+    # :param directory: ``input``, ``done`` or ``error``
+    directory = models.CharField(max_length=16)
+
+    count = models.IntegerField(default=0)
+
+    # :param date: date of the last update of the count
+    date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('configuration', 'directory')
+
+    def __unicode__(self):
+        return u'%s %s %s' % (self.configuration, self.directory, self.count)
+
+    @classmethod
+    def add(cls, configuration, counts):
+        """Add ``counts``, a dictionary of the number of files by directory,
+        to the counts of ``configuration``"""
+        for directory, count in counts.items():
+            if count:
+                cls.objects.filter(
+                    configuration=configuration,
+                    directory=directory,
+                ).update(count=models.F('count') + count)
+
+    @classmethod
+    def set(cls, configuration, directory, count):
+        updated = cls.objects.filter(
+            configuration=configuration,
+            directory=directory,
+        ).update(count=count)
+        if not updated:
+            cls.objects.create(
+                configuration=configuration,
+                directory=directory,
+                count=count,
+            )
+
+    @classmethod
+    def get_counts(cls):
+        """Returns the counts by configuration name and directory"""
+        counts = {}
+        for count in cls.objects.all():
+            counts.setdefault(count.configuration, {})
+            counts[count.configuration][count.directory] = count.count
+        return counts
+
+
 class VirtualFileSystemElement(models.Model):
     """Handles virtual directory which might be a representation of
     a file/directory found on the filesystem"""
@@ -177,18 +383,26 @@ class VirtualFileSystemElement(models.Model):
                 ("reset_filesystemelement", "Reset a file to be run again by configuration"),
             )
 
-    def __init__(self, name, path=None):
+    def __init__(self, name, path=None, member=None):
         # if path is None it's a pure virtual element
         # self.pk will be name
+        # if member is set it's a file of the archive path, see
+        # swallow.archive
         super(VirtualFileSystemElement, self).__init__(name)
         self.path = path
-        if path is not None:
+        if member is not None:
+            self._creation_date = time.ctime(member.mtime)
+            self._modification_date = time.ctime(member.mtime)
+            self._is_dir = False
+        elif path is not None:
             (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime) = os.stat(path)
             self._creation_date = time.ctime(ctime)
             self._modification_date = time.ctime(mtime)
+            self._is_dir = stat.S_ISDIR(mode)
         else:
             self._creation_date = ''
             self._modification_date = ''
+            self._is_dir = False
 
     def creation_date(self):
         return self._creation_date
@@ -197,9 +411,7 @@ class VirtualFileSystemElement(models.Model):
         return self._modification_date
 
     def is_dir(self):
-        if self.path is None:
-            return False
-        return os.path.isdir(self.path)
+        return self._is_dir
 
     def name(self):
         if (self.is_dir()
@@ -215,12 +427,15 @@ class VirtualFileSystemElement(models.Model):
 
 class SwallowConfiguration(models.Model):
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, counts=None):
         # pk is a configuration class
         super(SwallowConfiguration, self).__init__(configuration)
-        self.input_count = len(os.listdir(configuration.input_dir()))
-        self.error_count = len(os.listdir(configuration.error_dir()))
-        self.done_count = len(os.listdir(configuration.done_dir()))
+        # :param counts: counts of files by directory, see :class:`FileCount`
+        if counts is None:
+            counts = FileCount.get_counts().get(configuration.__name__, {})
+        self.input_count = counts.get('input')
+        self.error_count = counts.get('error')
+        self.done_count = counts.get('done')
 
     def name(self):
         name = self.pk.__name__
@@ -245,5 +460,7 @@ class SwallowConfiguration(models.Model):
         return self.error_count
 
     def status(self):
+        if self.error_count is None:
+            return None  # never counted
         return self.error_count == 0
     status.boolean = True
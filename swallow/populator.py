@@ -1,5 +1,6 @@
-from models import Matching
+from models import matchings
 
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models.fields.related import ManyToManyField
 
 
@@ -67,6 +68,35 @@ class BasePopulator(object):
         """
         raise NotImplementedError()
 
+    _m2m_targets = ()
+    """m2m fields listed here are populated by methods that return the
+    related instances, or their primary keys, instead of adding them.
+
+    The builder updates the relations that changed only, instead of
+    clearing them before calling the method.
+
+    Set to ``None`` if every m2m method returns related instances."""
+
+    def _returns_targets(self, field_name):
+        """Compute whether the m2m method of the field returns related
+        instances, m2m fields with an explicit ``through`` model can't
+        be listed since their rows can't be created from the targets"""
+        if self._m2m_targets is None:
+            returns = True
+        else:
+            returns = field_name in self._m2m_targets
+        if returns:
+            field = self._instance._meta.get_field(field_name)
+            if not field.rel.through._meta.auto_created:
+                msg = (u'%s.%s has an explicit through model, its populator '
+                       u'method must add the relations itself and the field '
+                       u'must not be in _m2m_targets' % (
+                           type(self).__name__,
+                           field_name,
+                       ))
+                raise ImproperlyConfigured(msg)
+        return returns
+
     def _to_set(self, field_name):
         """Compute whether the field should be set"""
         if self._updating:
@@ -84,12 +114,21 @@ class BasePopulator(object):
             return True
         return False
 
+    @property
+    def _matchings(self):
+        """Registry used to fetch :class:`swallow.models.Matching` instances,
+        the one of the running configuration if there is one."""
+        registry = getattr(self._config, 'matchings', None)
+        if registry is None:
+            registry = matchings
+        return registry
+
     def _matching_values(self, name):
         """Return matching values for the given Matching, the computation
         is cached and only done once in the instance lifetime.
         """
         if not name in self._matching_values_cache:
-            matching = Matching.objects.get(name=name)
+            matching = self._matchings.get(name)
             match = matching.match(self._mapper)
             self._matching_values_cache[name] = match
         return self._matching_values_cache[name]
@@ -1,10 +1,16 @@
 import os
-import bisect
+import heapq
+import hashlib
+
+from django.core.cache import cache
+from django.utils.encoding import smart_str
 
 from sneak.query import ListQuerySet
 
 from swallow.models import VirtualFileSystemElement, SwallowConfiguration
-from swallow.util import get_configurations
+from swallow.models import FileCount
+from swallow.archive import Archive
+from swallow.util import configurations, iterdir
 
 
 class QueryResult(ListQuerySet):
@@ -22,6 +28,102 @@ class QueryResult(ListQuerySet):
         return len(self.value)
 
 
+class DirectoryQueryResult(QueryResult):
+    """Lazy listing of the directory ``path`` sorted by name.
+
+    The directory is streamed for every page and the names of the page
+    are selected with a bounded heap, only the elements of the page are
+    built and stat'd. The count of entries is cached ``COUNT_TIMEOUT``
+    seconds."""
+
+    COUNT_TIMEOUT = 10
+
+    def __init__(self, path, prefix):
+        super(DirectoryQueryResult, self).__init__()
+        self.path = path
+        self.prefix = prefix  # name of the directory in the admin
+
+    @classmethod
+    def cache_key(cls, path):
+        return 'swallow.count.%s' % hashlib.md5(smart_str(path)).hexdigest()
+
+    @classmethod
+    def invalidate(cls, path):
+        """Forget the count of the directory ``path``"""
+        cache.delete(cls.cache_key(path))
+
+    def _clone(self):
+        return type(self)(self.path, self.prefix)
+
+    def count(self):
+        key = self.cache_key(self.path)
+        count = cache.get(key)
+        if count is None:
+            count = 0
+            for name in iterdir(self.path):
+                count += 1
+            cache.set(key, count, self.COUNT_TIMEOUT)
+        return count
+
+    def __len__(self):
+        return self.count()
+
+    def element(self, name):
+        return VirtualFileSystemElement(
+            os.path.join(self.prefix, name),
+            os.path.join(self.path, name),
+        )
+
+    def iterator(self):
+        for name in sorted(iterdir(self.path)):
+            yield self.element(name)
+
+    def __iter__(self):
+        # the directory is listed once, not once per element
+        return self.iterator()
+
+    def __getitem__(self, s):
+        if not isinstance(s, slice):
+            if s < 0:
+                s += self.count()
+                if s < 0:
+                    raise IndexError('index out of range')
+            elements = self[s:s + 1]
+            if not elements:
+                raise IndexError('index out of range')
+            return elements[0]
+        if s.stop is None or s.stop < 0 or (s.start or 0) < 0:
+            names = sorted(iterdir(self.path))[s]
+        else:
+            names = heapq.nsmallest(s.stop, iterdir(self.path))[s]
+        return [self.element(name) for name in names]
+
+
+def archive_query_result(configuration, prefix, path_components):
+    """Returns the days of the archives of ``configuration`` or the
+    files of the archive of a day, they are listed from its index"""
+    directory = configuration.archive_dir()
+    if not path_components:
+        return QueryResult([
+            VirtualFileSystemElement(os.path.join(prefix, day))
+            for day in Archive.days(directory)
+        ])
+    day = path_components[0]
+    archive = Archive(directory, day)
+    members = {}
+    for member in archive.members():
+        # a file archived again replaces the previous one
+        members[member.name] = member
+    return QueryResult([
+        VirtualFileSystemElement(
+            os.path.join(prefix, day, name),
+            archive.path,
+            member=members[name],
+        )
+        for name in sorted(members)
+    ])
+
+
 class VirtualFileSystemQuerySet(ListQuerySet):
     """Custom QuerySet object to list VFS elements"""
 
@@ -34,12 +136,10 @@ class VirtualFileSystemQuerySet(ListQuerySet):
 
         fs = []
 
-        CONFIGURATIONS = get_configurations()
-
         if directory is None:
             # we want to list all configurations
             self.directory = None
-            for name in CONFIGURATIONS.keys():
+            for name in configurations.all().keys():
                 fs.append(VirtualFileSystemElement(name))
         else:
             # we have something like ``ConfigurationName``
@@ -57,7 +157,7 @@ class VirtualFileSystemQuerySet(ListQuerySet):
                 # directory is something like ``{{ configuration_name }}``
                 # we need to list configuration directories
                 for swallow_directory in ['input', 'work', 'done', 'error']:
-                    configuration = CONFIGURATIONS[configuration_name]
+                    configuration = configurations.get(configuration_name)
                     path_dir_method = getattr(
                         configuration,
                         '%s_dir' % swallow_directory
@@ -65,6 +165,12 @@ class VirtualFileSystemQuerySet(ListQuerySet):
                     path = path_dir_method()
                     f = os.path.join(configuration_name, swallow_directory)
                     fs.append(VirtualFileSystemElement(f, path))
+                configuration = configurations.get(configuration_name)
+                if os.path.isdir(configuration.archive_dir()):
+                    fs.append(VirtualFileSystemElement(
+                        os.path.join(configuration_name, 'archive'),
+                        configuration.archive_dir(),
+                    ))
             else:
                 # directory is something like
                 # ``{{ configuration_name}}/{{ swallow_directory }}``
@@ -72,34 +178,22 @@ class VirtualFileSystemQuerySet(ListQuerySet):
                 # ``done`` or ``error``
                 swallow_directory = path_components[0]
                 path_components = list(path_components[1:])
-                configuration = CONFIGURATIONS[configuration_name]
+                configuration = configurations.get(configuration_name)
+                if swallow_directory == 'archive':
+                    return archive_query_result(
+                        configuration,
+                        os.path.join(configuration_name, 'archive'),
+                        path_components,
+                    )
                 path = getattr(configuration, '%s_dir' % swallow_directory)()
                 path = os.path.join(path, *path_components)
-                # FIXME: this is yet another hack
-                # See if it's It might be possible to use Django Admin filtering
-                # used to store modification date of fse elements
-                # this maps one to one with ``fs``
-                # modification_date of ``fs[i]`` is ``modification_date[i]``
-                modification_dates = []
-                for f in os.listdir(path):
-                    full_path = os.path.join(path, f)
-                    # locate the insertion point of full_path.modification_date
-                    # and insert in the same place in ``fs``
-                    modification_date = -os.stat(full_path).st_mtime
-                    index = bisect.bisect_left(
-                        modification_dates,
-                        modification_date,
-                    )
-                    modification_dates.insert(index, modification_date)
-                    name_tail = list(path_components)
-                    name_tail.append(f)
-                    name = os.path.join(
-                        configuration_name,
-                        swallow_directory,
-                        *name_tail
-                    )
-                    fse = VirtualFileSystemElement(name, full_path)
-                    fs.insert(index, fse)
+                prefix = os.path.join(
+                    configuration_name,
+                    swallow_directory,
+                    *path_components
+                )
+                # directories can be huge, they are listed page by page
+                return DirectoryQueryResult(path, prefix)
         return QueryResult(fs)
 
 
@@ -108,8 +202,11 @@ class SwallowConfigurationQuerySet(ListQuerySet):
     in SWALLOW_CONFIGURATION_MODULES setting."""
 
     def filter(self, *args, **kwargs):
-        CONFIGURATIONS = get_configurations()
-        configurations = []
-        for configuration in CONFIGURATIONS.values():
-            configurations.append(SwallowConfiguration(configuration))
-        return QueryResult(configurations)
+        counts = FileCount.get_counts()
+        result = []
+        for configuration in configurations.all().values():
+            result.append(SwallowConfiguration(
+                configuration,
+                counts.get(configuration.__name__, {}),
+            ))
+        return QueryResult(result)
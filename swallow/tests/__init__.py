@@ -46,3 +46,9 @@ from config import *
 from transactions import *
 from builder import *
 from populator import *
+from watch import *
+from mappers import *
+from timing import *
+from query import *
+from clean import *
+from archive import *
@@ -0,0 +1,139 @@
+import os
+import gzip
+import time
+import fcntl
+import shutil
+import tempfile
+import threading
+
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+from django.test import TestCase
+
+from base import BaseSwallowTests
+from clean import CleanConfig
+
+from swallow.archive import Archive, Archives
+from swallow.clean import Cleaner
+from swallow.query import archive_query_result
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _file(self, name, content):
+        path = os.path.join(self.path, name)
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        return path
+
+    def test_add_and_read(self):
+        archive = Archive(self.path, '2012-01-31')
+        archive.add('a/spam', self._file('spam', 'spam' * 100))
+        archive.add('egg', self._file('egg', 'egg'))
+
+        self.assertEqual(
+            ['a/spam', 'egg'],
+            [member.name for member in archive.members()],
+        )
+        self.assertEqual('egg', archive.read('egg'))
+        self.assertEqual('spam' * 100, archive.read('a/spam'))
+        self.assertRaises(KeyError, archive.read, 'ham')
+        self.assertEqual(['2012-01-31'], Archive.days(self.path))
+
+        # the archive is a gzip file of the concatenated files
+        f = gzip.open(archive.path)
+        self.assertEqual('spam' * 100 + 'egg', f.read())
+        f.close()
+
+    def test_extract_and_discard(self):
+        path = self._file('spam', 'spam')
+        os.utime(path, (1000000000, 1000000000))
+        archives = Archives(os.path.join(self.path, 'archive'))
+        archives.add('spam', path)
+        archive = archives.get(Archive.day_of(1000000000))
+
+        target = os.path.join(self.path, 'restored')
+        archive.extract('spam', target)
+        self.assertEqual('spam', open(target).read())
+        self.assertEqual(1000000000, os.stat(target).st_mtime)
+
+        archive.discard(['spam'])
+        self.assertEqual([], archive.members())
+
+    def test_lock(self):
+        """A discard waits for the lock held by another process"""
+        archive = Archive(self.path, '2012-01-31')
+        archive.add('spam', self._file('spam', 'spam'))
+        f = open(archive.lock_path, 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            thread = threading.Thread(target=archive.discard, args=(['spam'],))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            # the other process appends a file
+            index = open(archive.index_path, 'ab')
+            index.write('0\t0\t0.0\tegg\n')
+            index.close()
+        finally:
+            f.close()
+        thread.join()
+        self.assertEqual(['egg'], [member.name for member in archive.members()])
+
+
+class ArchiveCleanerTests(BaseSwallowTests):
+
+    def test_archive_done_files(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            now = time.time()
+            for name, age in (('a/old', 7200), ('new', 60)):
+                path = os.path.join(CleanConfig.done_dir(), name)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                f = open(path, 'w')
+                f.write(name)
+                f.close()
+                os.utime(path, (now - age, now - age))
+
+            Cleaner(CleanConfig, 'done', archive=True).run()
+
+            done = CleanConfig.done_dir()
+            self.assertFalse(os.path.exists(os.path.join(done, 'a', 'old')))
+            self.assertTrue(os.path.exists(os.path.join(done, 'new')))
+            day = Archive.day_of(now - 7200)
+            archive = Archive(CleanConfig.archive_dir(), day)
+            self.assertEqual('a/old', archive.read('a/old'))
+
+            days = archive_query_result(CleanConfig, 'CleanConfig/archive', [])
+            self.assertEqual(
+                ['CleanConfig/archive/%s' % day],
+                [element.pk for element in days.value],
+            )
+            files = archive_query_result(
+                CleanConfig,
+                'CleanConfig/archive',
+                [day],
+            )
+            self.assertEqual(
+                ['CleanConfig/archive/%s/a/old' % day],
+                [element.pk for element in files.value],
+            )
+            self.assertFalse(files.value[0].is_dir())
+
+    def test_archive_only_done(self):
+        self.assertRaises(
+            ValueError,
+            Cleaner,
+            CleanConfig,
+            'error',
+            archive=True,
+        )
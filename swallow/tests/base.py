@@ -1,8 +1,14 @@
 import os
 import shutil
 
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.test import TransactionTestCase
 
+from swallow.timing import timings
+
 
 CURRENT_PATH = os.path.dirname(__file__)
 
@@ -20,3 +26,103 @@ class BaseSwallowTests(TransactionTestCase):
 
     def tearDown(self):
         shutil.rmtree(self.import_dir)
+
+
+class PhaseQueries(list):
+    """List of queries of a connection that tags each query with the
+    innermost phase measured by :data:`swallow.timing.timings`"""
+
+    def __init__(self, recorder):
+        super(PhaseQueries, self).__init__()
+        self.recorder = recorder
+
+    def append(self, query):
+        super(PhaseQueries, self).append(query)
+        if timings.stack:
+            phase = u'%s %s %s' % timings.stack[-1]
+        else:
+            phase = u'other'
+        self.recorder.queries.append((phase, query['sql']))
+
+
+class QueryRecorder(object):
+    """Context manager that records the SQL statements executed in its
+    block by phase, and the number of mappers processed.
+
+    ``executemany`` statements are counted once."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.queries = []  # ``(phase, sql)``
+        self.mappers = 0
+
+    def __enter__(self):
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        self.connection.queries = PhaseQueries(self)
+        timings.hooks.append(self.hook)
+        return self
+
+    def __exit__(self, *exc_info):
+        timings.hooks.remove(self.hook)
+        self.connection.queries = []
+        settings.DEBUG = self.debug
+
+    def hook(self, group, name, phase, seconds):
+        if phase == 'process_mapper':
+            self.mappers += 1
+
+    def count(self, prefix=u''):
+        """Returns the number of statements of the phases starting with
+        ``prefix``"""
+        return len([
+            phase for phase, sql in self.queries if phase.startswith(prefix)
+        ])
+
+    def per_mapper(self):
+        """Returns the number of statements per mapper, statements of the
+        configurations are done per file or per run and are left out"""
+        statements = self.count() - self.count(u'config ')
+        return float(statements) / max(self.mappers, 1)
+
+    def breakdown(self):
+        """Returns the number of statements by phase"""
+        phases = Counter()
+        for phase, sql in self.queries:
+            phases[phase] += 1
+        return u'\n'.join(
+            u'%6d  %s' % (count, phase)
+            for phase, count in phases.most_common()
+        )
+
+
+class QueryBudgetMixin(object):
+    """Assertions on the number of SQL statements per mapper and by phase"""
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        """Call ``func`` and fail if more than ``budget`` statements
+        per mapper are executed, returns the :class:`QueryRecorder`"""
+        with QueryRecorder() as recorder:
+            func(*args, **kwargs)
+        per_mapper = recorder.per_mapper()
+        if per_mapper > budget:
+            self.fail(
+                u'%.2f statements per mapper for %s mappers, the budget '
+                u'is %s, statements by phase:\n%s' % (
+                    per_mapper,
+                    recorder.mappers,
+                    budget,
+                    recorder.breakdown(),
+                )
+            )
+        return recorder
+
+    def assertPhaseBudget(self, budget, recorder, prefix):
+        """Fail if more than ``budget`` statements were recorded by
+        ``recorder`` in the phases starting with ``prefix``"""
+        count = recorder.count(prefix)
+        if count > budget:
+            self.fail(
+                u'%s statements in %s, the budget is %s, statements by '
+                u'phase:\n%s' % (count, prefix, budget, recorder.breakdown())
+            )
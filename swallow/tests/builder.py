@@ -1,3 +1,6 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, reset_queries
 from django.test import TestCase
 from django.test import TransactionTestCase
 
@@ -10,6 +13,7 @@ from swallow.mappers import BaseMapper
 
 from swallow.tests import RelatedM2M
 from swallow.tests import ModelForBuilderTests
+from swallow.tests import Article, Section, ArticleToSection
 
 
 class BuilderNotImplementedErrorsTests(TestCase):
@@ -450,3 +454,452 @@ class BuilderProcessAndSaveTests(TransactionTestCase):
 
     def test_call_set_m2m_field_on_related_m2m_field(self):
         pass
+
+
+class BuilderPrefetchTests(TransactionTestCase):
+
+    class Builder(BaseBuilder):
+
+        Model = ModelForBuilderTests
+        CHUNK_SIZE = 3
+
+        class Mapper(BaseMapper):
+
+            @classmethod
+            def _iter_mappers(cls, builder):
+                for i in [1, 2, 3, 4, 4, 5, 6, 7]:
+                    yield cls(i)
+
+            @property
+            def _instance_filters(self):
+                if self._content == 6:
+                    raise Exception('custom exception')
+                return {'simple_field': self._content}
+
+            @property
+            def second_field(self):
+                return self._content * 10
+
+        class Populator(BasePopulator):
+
+            _fields_one_to_one = ('second_field',)
+            _fields_if_instance_already_exists = None
+            _fields_if_instance_modified_from_last_import = None
+
+        def skip(self, mapper):
+            return False
+
+        def instance_is_locally_modified(self, instance):
+            return False
+
+    def test_prefetch(self):
+        """Existing instances are fetched by chunks and
+        mappers with the same filters do not create duplicates"""
+        ModelForBuilderTests(simple_field=1).save()
+        ModelForBuilderTests(simple_field=3).save()
+
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            builder = self.Builder(None, None)
+            instances, unhandled_errors = builder.process_and_save()
+            # ignore queries done by save to know if the row exists
+            selects = [q for q in connection.queries
+                       if q['sql'].startswith('SELECT')
+                       and not q['sql'].startswith('SELECT (1)')]
+        finally:
+            settings.DEBUG = False
+
+        self.assertTrue(unhandled_errors)  # mapper 6 failed
+        self.assertEqual(7, len(instances))
+        values = ModelForBuilderTests.objects.values_list(
+            'simple_field',
+            'second_field',
+        )
+        self.assertEqual(
+            [(1, 10), (2, 20), (3, 30), (4, 40), (5, 50), (7, 70)],
+            sorted(values)
+        )
+        # one query per chunk and one for the second mapper 4
+        self.assertEqual(4, len(selects))
+
+    def test_instance_key(self):
+        """Filters values are converted to python values and lookups
+        other than exact are not prefetched"""
+        builder = self.Builder(None, None)
+        self.assertEqual(
+            (('simple_field', 1), ),
+            builder.instance_key({'simple_field': '1'}),
+        )
+        self.assertIsNone(builder.instance_key({'simple_field__gt': 1}))
+
+
+class BuilderBulkTests(TransactionTestCase):
+
+    class Builder(BaseBuilder):
+
+        Model = ModelForBuilderTests
+        BULK_SIZE = 3
+
+        class Mapper(BaseMapper):
+
+            @classmethod
+            def _iter_mappers(cls, builder):
+                for i in [1, 2, 3, 4, 4, 5, None, 6, 7]:
+                    yield cls(i)
+
+            @property
+            def _instance_filters(self):
+                return {'simple_field': self._content}
+
+            @property
+            def second_field(self):
+                return self._content
+
+        class Populator(BasePopulator):
+
+            _fields_one_to_one = ('second_field',)
+            _fields_if_instance_already_exists = None
+            _fields_if_instance_modified_from_last_import = None
+
+        def skip(self, mapper):
+            return False
+
+        def instance_is_locally_modified(self, instance):
+            return False
+
+    def _process(self, builder):
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            result = builder.process_and_save()
+            # executemany queries are logged as ``N times: INSERT ...``
+            inserts = [q for q in connection.queries if 'INSERT' in q['sql']]
+        finally:
+            settings.DEBUG = False
+        return result, inserts
+
+    def test_bulk(self):
+        """New instances are inserted by batches and a faulty instance
+        does not prevent the others to be inserted"""
+        builder = self.Builder(None, None)
+        (instances, unhandled_errors), inserts = self._process(builder)
+
+        self.assertTrue(unhandled_errors)  # simple_field can't be null
+        self.assertEqual(9, len(instances))
+        values = ModelForBuilderTests.objects.values_list(
+            'simple_field',
+            flat=True
+        )
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], sorted(values))
+        # [1, 2, 3], [4], [4, 5, None] that fails and is saved row by row
+        # then [6, 7]
+        self.assertEqual(7, len(inserts))
+
+    def test_bulk_with_chunks(self):
+        """Instances of a previous chunk waiting in the bulk are found
+        by the prefetch of the next chunk"""
+
+        class Builder(self.Builder):
+
+            CHUNK_SIZE = 3
+            BULK_SIZE = 10
+
+            class Mapper(self.Builder.Mapper):
+
+                @classmethod
+                def _iter_mappers(cls, builder):
+                    for i in [1, 2, 3, 3, 4]:
+                        yield cls(i)
+
+        builder = Builder(None, None)
+        (instances, unhandled_errors), inserts = self._process(builder)
+
+        self.assertFalse(unhandled_errors)
+        values = ModelForBuilderTests.objects.values_list(
+            'simple_field',
+            flat=True
+        )
+        self.assertEqual([1, 2, 3, 4], sorted(values))
+
+    def test_relations_are_saved(self):
+        """Instances with m2m to populate are saved one by one"""
+
+        class Populator(self.Builder.Populator):
+
+            def m2m(self):
+                related = RelatedM2M()
+                related.save()
+                self._instance.m2m.add(related)
+
+        class Builder(self.Builder):
+
+            class Mapper(self.Builder.Mapper):
+
+                @classmethod
+                def _iter_mappers(cls, builder):
+                    for i in [1, 2]:
+                        yield cls(i)
+
+        Builder.Populator = Populator
+        builder = Builder(None, None)
+        (instances, unhandled_errors), inserts = self._process(builder)
+
+        self.assertFalse(unhandled_errors)
+        for instance in instances:
+            self.assertIsNotNone(instance.pk)
+            self.assertEqual(1, instance.m2m.count())
+
+
+class BuilderTrackChangesTests(TransactionTestCase):
+
+    class Builder(BaseBuilder):
+
+        Model = ModelForBuilderTests
+        TRACK_CHANGES = True
+
+        class Mapper(BaseMapper):
+
+            @classmethod
+            def _iter_mappers(cls, builder):
+                for item in builder.content:
+                    yield cls(item)
+
+            @property
+            def _instance_filters(self):
+                return {'simple_field': self._content[0]}
+
+            @property
+            def second_field(self):
+                # mappers often return strings
+                return str(self._content[1])
+
+        class Populator(BasePopulator):
+
+            _fields_one_to_one = ('second_field',)
+            _fields_if_instance_already_exists = None
+            _fields_if_instance_modified_from_last_import = None
+
+        def skip(self, mapper):
+            return False
+
+        def instance_is_locally_modified(self, instance):
+            return False
+
+    def _process(self, content):
+        builder = self.Builder(content, None)
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            builder.process_and_save()
+            updates = [q for q in connection.queries if 'UPDATE' in q['sql']]
+        finally:
+            settings.DEBUG = False
+        return builder.counts, updates
+
+    def test_unchanged_instances_are_not_saved(self):
+        counts, updates = self._process([(1, 1), (2, 2), (3, 3)])
+        self.assertEqual({'created': 3}, counts)
+
+        counts, updates = self._process([(1, 1), (2, 2), (3, 3)])
+        self.assertEqual({'unchanged': 3}, counts)
+        self.assertEqual([], updates)
+
+    def test_only_changed_fields_are_saved(self):
+        self._process([(1, 1), (2, 2)])
+
+        counts, updates = self._process([(1, 1), (2, 20)])
+        self.assertEqual({'unchanged': 1, 'updated': 1}, counts)
+        self.assertEqual(1, len(updates))
+        self.assertNotIn('simple_field', updates[0]['sql'])
+        values = ModelForBuilderTests.objects.values_list(
+            'simple_field',
+            'second_field',
+        )
+        self.assertEqual([(1, 1), (2, 20)], sorted(values))
+
+    def test_changed_foreign_key(self):
+        article = Article.objects.create(title='spam')
+        Section.objects.create(name='SPORT')
+        fun = Section.objects.create(name='FUN')
+
+        class Builder(self.Builder):
+
+            Model = ArticleToSection
+
+            class Mapper(self.Builder.Mapper):
+
+                @property
+                def _instance_filters(self):
+                    return {'weight': self._content[0]}
+
+                @property
+                def article(self):
+                    return article
+
+                @property
+                def section(self):
+                    return Section.objects.get(name=self._content[1])
+
+            class Populator(self.Builder.Populator):
+
+                _fields_one_to_one = ('article', 'section')
+
+        builder = Builder([(1, 'SPORT')], None)
+        builder.process_and_save()
+        self.assertEqual({'created': 1}, builder.counts)
+
+        builder = Builder([(1, 'FUN')], None)
+        builder.process_and_save()
+        self.assertEqual({'updated': 1}, builder.counts)
+        self.assertEqual(fun, ArticleToSection.objects.get(weight=1).section)
+
+    def test_counts_without_tracking(self):
+
+        class Builder(self.Builder):
+            TRACK_CHANGES = False
+
+        builder = Builder([(1, 1)], None)
+        builder.process_and_save()
+        self.assertEqual({'created': 1}, builder.counts)
+        builder = Builder([(1, 1)], None)
+        builder.process_and_save()
+        self.assertEqual({'updated': 1}, builder.counts)
+
+
+class BuilderM2MTargetsTests(TransactionTestCase):
+
+    class Builder(BaseBuilder):
+
+        Model = ModelForBuilderTests
+        CHUNK_SIZE = 10
+
+        class Mapper(BaseMapper):
+
+            @classmethod
+            def _iter_mappers(cls, builder):
+                for item in builder.content:
+                    yield cls(item)
+
+            @property
+            def _instance_filters(self):
+                return {'simple_field': self._content[0]}
+
+        class Populator(BasePopulator):
+
+            _fields_one_to_one = ()
+            _fields_if_instance_already_exists = None
+            _fields_if_instance_modified_from_last_import = None
+            _m2m_targets = ('m2m',)
+
+            def m2m(self):
+                return self._mapper._content[1]
+
+        def skip(self, mapper):
+            return False
+
+        def instance_is_locally_modified(self, instance):
+            return False
+
+    def setUp(self):
+        self.related = []
+        for i in range(4):
+            related = RelatedM2M()
+            related.save()
+            self.related.append(related)
+
+    def _process(self, content, Builder=None):
+        if Builder is None:
+            Builder = self.Builder
+        builder = Builder(content, None)
+        table = ModelForBuilderTests.m2m.through._meta.db_table
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            builder.process_and_save()
+            queries = [
+                q['sql'].split()[0] if q['sql'][0].isalpha()
+                else q['sql'].split()[2]  # ``N times: INSERT ...``
+                for q in connection.queries if table in q['sql']
+            ]
+        finally:
+            settings.DEBUG = False
+        return queries
+
+    def _relations(self, simple_field):
+        instance = ModelForBuilderTests.objects.get(simple_field=simple_field)
+        return set(instance.m2m.values_list('pk', flat=True))
+
+    def test_relations_are_diffed(self):
+        r0, r1, r2, r3 = self.related
+        queries = self._process([(1, [r0, r1]), (2, [r1, r2])])
+        # relations of the chunk are fetched then inserted at once
+        self.assertEqual(['SELECT', 'INSERT'], queries)
+        self.assertEqual(set([r0.pk, r1.pk]), self._relations(1))
+        self.assertEqual(set([r1.pk, r2.pk]), self._relations(2))
+
+        queries = self._process([(1, [r0, r1]), (2, [r1, r2])])
+        self.assertEqual(['SELECT'], queries)
+
+        queries = self._process([(1, [r0.pk, r3.pk]), (2, [r1, r2])])
+        self.assertEqual('SELECT', queries[0])
+        self.assertEqual(1, queries.count('DELETE'))
+        self.assertEqual(1, queries.count('INSERT'))
+        self.assertEqual(set([r0.pk, r3.pk]), self._relations(1))
+        self.assertEqual(set([r1.pk, r2.pk]), self._relations(2))
+
+    def test_without_chunks(self):
+        r0, r1, r2, r3 = self.related
+
+        class Builder(self.Builder):
+            CHUNK_SIZE = None
+
+        queries = self._process([(1, [r0]), (2, [r1])], Builder)
+        self.assertEqual(['SELECT', 'INSERT'] * 2, queries)
+        self._process([(1, [r2]), (2, [])], Builder)
+        self.assertEqual(set([r2.pk]), self._relations(1))
+        self.assertEqual(set(), self._relations(2))
+
+    def test_unsaved_target(self):
+        """A mapper with unsaved targets does not prevent the relations
+        of other mappers to be set"""
+        r0, r1, r2, r3 = self.related
+        self._process([(1, [r0, RelatedM2M()]), (2, [r1])])
+        self.assertEqual(set(), self._relations(1))
+        self.assertEqual(set([r1.pk]), self._relations(2))
+
+    def test_explicit_through_model(self):
+        """m2m fields with an explicit through model can't be listed in
+        ``_m2m_targets``, the field is not populated but the mappers and
+        the other relations are processed"""
+        section = Section(name='SPORT')
+        section.save()
+
+        class Builder(self.Builder):
+
+            Model = Article
+
+            class Mapper(self.Builder.Mapper):
+
+                @property
+                def _instance_filters(self):
+                    return {'title': self._content}
+
+            class Populator(self.Builder.Populator):
+
+                _m2m_targets = ('sections',)
+
+                def sections(self):
+                    return [section]
+
+        builder = Builder(['spam', 'egg'], None)
+        instances, unhandled_errors = builder.process_and_save()
+        self.assertFalse(unhandled_errors)
+        self.assertEqual(2, Article.objects.count())
+        self.assertEqual(0, ArticleToSection.objects.count())
+        populator = Builder.Populator(None, Article(), False, builder)
+        self.assertRaises(
+            ImproperlyConfigured,
+            populator._returns_targets,
+            'sections',
+        )
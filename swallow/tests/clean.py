@@ -0,0 +1,156 @@
+import os
+import time
+
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from django.core.management import call_command
+
+from base import BaseSwallowTests
+
+from swallow.clean import Cleaner
+from swallow.config import BaseConfig
+
+
+class CleanConfig(BaseConfig):
+
+    RETENTION = {'done': {'age': 3600}}
+
+
+class NoRetentionConfig(BaseConfig):
+    pass
+
+
+class CleanerTests(BaseSwallowTests):
+
+    def _drop(self, files):
+        """Create ``files``, a dictionary of the age in seconds of the
+        files by path relative to the done directory"""
+        now = time.time()
+        for name, age in files.items():
+            path = os.path.join(CleanConfig.done_dir(), name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            f = open(path, 'w')
+            f.write('x' * 10)
+            f.close()
+            os.utime(path, (now - age, now - age))
+
+    def _files(self, path):
+        files = []
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                files.append(os.path.relpath(
+                    os.path.join(dirpath, filename),
+                    path,
+                ))
+        return sorted(files)
+
+    def test_age(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({'a/old': 7200, 'a/new': 60, 'b/old': 7200})
+            cleaner = Cleaner(CleanConfig, 'done', threads=2)
+            self.assertEqual(2, cleaner.run())
+            self.assertEqual(3, cleaner.scanned)
+            self.assertEqual(['a/new'], self._files(CleanConfig.done_dir()))
+            self.assertFalse(os.path.exists(cleaner.state_path()))
+
+    def test_dryrun(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({'a/old': 7200, 'a/new': 60})
+            removed = []
+            cleaner = Cleaner(CleanConfig, 'done', dryrun=True)
+            cleaner.listeners.append(removed.append)
+            self.assertEqual(1, cleaner.run())
+            self.assertEqual(
+                [os.path.join(CleanConfig.done_dir(), 'a', 'old')],
+                removed,
+            )
+            self.assertEqual(
+                ['a/new', 'a/old'],
+                self._files(CleanConfig.done_dir()),
+            )
+
+    def test_move_keeps_tree(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            duplicate = os.path.join(CleanConfig.duplicate_dir(), 'done')
+            os.makedirs(os.path.join(duplicate, 'a'))
+            open(os.path.join(duplicate, 'a', 'f'), 'w').close()
+            self._drop({'a/f': 7200, 'b/f': 7200})
+            Cleaner(CleanConfig, 'done', move=True).run()
+            self.assertEqual([], self._files(CleanConfig.done_dir()))
+            self.assertEqual(
+                ['a/f', 'a/f.1', 'b/f'],
+                self._files(duplicate),
+            )
+
+    def test_quota(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({'a': 40, 'b': 30, 'c/d': 20, 'e': 10})
+            Cleaner(CleanConfig, 'done', age=3600, count=3).run()
+            self.assertEqual(
+                ['b', 'c/d', 'e'],
+                self._files(CleanConfig.done_dir()),
+            )
+            # files are 10 bytes long
+            Cleaner(CleanConfig, 'done', size=25).run()
+            self.assertEqual(['c/d', 'e'], self._files(CleanConfig.done_dir()))
+
+    def test_resume(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({
+                'a/f': 7200,
+                'b/f': 7200,
+                'b/c/f': 7200,
+                'd/f': 7200,
+            })
+            cleaner = Cleaner(CleanConfig, 'done')
+            cleaner.save_state(('b',))
+            cleaner.run()
+            # a and b were cleaned by the interrupted run
+            self.assertEqual(
+                ['a/f', 'b/f'],
+                self._files(CleanConfig.done_dir()),
+            )
+            self.assertFalse(os.path.exists(cleaner.state_path()))
+
+            cleaner = Cleaner(CleanConfig, 'done')
+            cleaner.save_state(('b',))
+            Cleaner(CleanConfig, 'done', restart=True).run()
+            self.assertEqual([], self._files(CleanConfig.done_dir()))
+
+    def test_resume_undecodable(self):
+        """Checkpoints keep names which aren't UTF-8"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({
+                'a\xe9/f': 7200,
+                'b\xe9/f': 7200,
+                'c/f': 7200,
+            })
+            cleaner = Cleaner(CleanConfig, 'done')
+            cleaner.save_state(('b\xe9',))
+            self.assertEqual(('b\xe9',), cleaner.load_state())
+            cleaner.run()
+            self.assertEqual(
+                ['a\xe9/f', 'b\xe9/f'],
+                self._files(CleanConfig.done_dir()),
+            )
+
+    def test_no_policy(self):
+        self.assertFalse(Cleaner(CleanConfig, 'error').has_policy())
+        self.assertEqual(0, Cleaner(CleanConfig, 'error').run())
+
+    def test_command_without_policy(self):
+        """A configuration without policy doesn't stop the cleaning of
+        the next ones"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            self._drop({'old': 7200, 'new': 0})
+            call_command(
+                'swallow_clean',
+                'swallow.tests.clean.NoRetentionConfig',
+                'swallow.tests.clean.CleanConfig',
+                verbosity=0,
+            )
+            self.assertEqual(['new'], self._files(CleanConfig.done_dir()))
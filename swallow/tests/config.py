@@ -1,10 +1,19 @@
 import os
+import bz2
+import sys
+import gzip
+import zipfile
+import time
 import shutil
+import inspect
+
+from datetime import datetime
 
 try:
     from django.test.utils import override_settings
 except ImportError:
     from override_settings import override_settings
+from django.core.management import call_command
 
 from . import Article
 from integration import ArticleConfig
@@ -14,6 +23,9 @@ from swallow.config import BaseConfig
 from swallow.mappers import XmlMapper
 from swallow.populator import BasePopulator
 from swallow.builder import BaseBuilder
+from swallow.models import ImportedFile
+from swallow.util import file_digest, ConfigurationRegistry
+from swallow.compression import uncompressed_name
 
 
 CURRENT_PATH = os.path.dirname(__file__)
@@ -143,3 +155,479 @@ class PostProcessTest(BaseSwallowTests):
             self.assertEqual(3, len(config.__flag__))
             for x in config.__flag__:
                 self.assertTrue(x)
+
+
+class WorkersTest(BaseSwallowTests):
+    """Check that endpoint files are processed by a pool of workers
+    when the configuration has more than one worker"""
+
+    class WorkersConfig(BaseConfig):
+
+        WORKERS = 2
+
+        def load_builder(self, partial_file_path):
+            config = self
+
+            class WorkersBuilder(object):
+
+                counts = {'created': 2}
+
+                def process_and_save(self):
+                    config.open(partial_file_path)
+                    # a dummy value built in the worker process
+                    return [(os.getpid(), partial_file_path)], False
+
+            return WorkersBuilder()
+
+        def postprocess(self, instances):
+            self.__flag__ = instances
+
+    def test_workers(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = self.WorkersConfig()
+            config.run()
+
+            self.assertEqual(3, len(config.__flag__))
+            for instances in config.__flag__:
+                pid, partial_file_path = instances[0]
+                self.assertNotEqual(os.getpid(), pid)
+            self.assertEqual([], os.listdir(config.input_dir()))
+            self.assertEqual([], os.listdir(config.work_dir()))
+            done = os.listdir(config.done_dir())
+            self.assertEqual(3, len(done))
+            # counts are sent back by workers
+            self.assertEqual({'created': 6}, config.counts)
+
+    def test_jobs_option(self):
+        """``swallow_run --jobs`` overrides the configuration setting"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            os.makedirs(JobsConfig.input_dir())
+            for name in ('a', 'b', 'c'):
+                open(os.path.join(JobsConfig.input_dir(), name), 'w').close()
+            call_command(
+                'swallow_run',
+                'swallow.tests.config.JobsConfig',
+                jobs=1,
+                verbosity=0,
+            )
+
+            self.assertEqual(2, JobsConfig.WORKERS)
+            self.assertEqual(1, JobsConfig.run_workers)
+            # files were processed in the process of the command
+            self.assertEqual(set([os.getpid()]), JobsConfig.pids)
+
+
+class JobsConfig(WorkersTest.WorkersConfig):
+    """Records the workers and the processes of the builders of its last
+    run"""
+
+    def postprocess(self, instances):
+        JobsConfig.run_workers = self.workers
+        JobsConfig.pids = set(pid for [(pid, _)] in instances)
+
+
+class WalkerTest(BaseSwallowTests):
+    """Check that input directory is walked without recursion and that
+    old secondary files are cleaned"""
+
+    class WalkerConfig(BaseConfig):
+
+        def load_builder(self, partial_file_path):
+            if not partial_file_path.endswith('.xml'):
+                return None
+            config = self
+
+            class WalkerBuilder(object):
+
+                def process_and_save(self):
+                    config.open(partial_file_path)
+                    return [partial_file_path], False
+
+            return WalkerBuilder()
+
+        def postprocess(self, instances):
+            self.__flag__.extend(instances)
+
+    def test_deep_input_directory(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = self.WalkerConfig()
+            config.__flag__ = []
+            path = config.input_dir()
+            os.makedirs(path)
+            open(os.path.join(path, 'top.xml'), 'w').close()
+            # os.makedirs is recursive, build the tree by hand
+            depth = 100
+            for i in range(depth):
+                path = os.path.join(path, 'd')
+                os.mkdir(path)
+            open(os.path.join(path, 'bottom.xml'), 'w').close()
+
+            limit = sys.getrecursionlimit()
+            # leave not enough room to process the tree recursively
+            sys.setrecursionlimit(len(inspect.stack()) + depth / 2)
+            try:
+                config.run()
+            finally:
+                sys.setrecursionlimit(limit)
+
+            bottom = os.path.join(*(['d'] * depth + ['bottom.xml']))
+            self.assertEqual(
+                [['top.xml'], [bottom]],
+                config.__flag__
+            )
+            self.assertTrue(
+                os.path.exists(os.path.join(config.done_dir(), bottom))
+            )
+
+    def test_clean_old_files(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = self.WalkerConfig()
+            config.__flag__ = []
+            path = config.input_dir()
+            os.makedirs(path)
+            for name in ('old', 'recent', 'old.xml'):
+                open(os.path.join(path, name), 'w').close()
+            old = time.time() - config.GRACE_PERIOD - 60
+            os.utime(os.path.join(path, 'old'), (old, old))
+            os.utime(os.path.join(path, 'old.xml'), (old, old))
+
+            config.run()
+
+            self.assertEqual(['recent'], os.listdir(config.input_dir()))
+            self.assertEqual(
+                ['old', 'old.xml'],
+                sorted(os.listdir(config.done_dir()))
+            )
+
+
+class LedgerTest(BaseSwallowTests):
+    """Check that files already imported are not processed again"""
+
+    class LedgerConfig(BaseConfig):
+
+        LEDGER = True
+
+        def load_builder(self, partial_file_path):
+            config = self
+
+            class LedgerBuilder(object):
+
+                def process_and_save(self):
+                    config.open(partial_file_path)
+                    config.processed.append(partial_file_path)
+                    return [], partial_file_path == 'error'
+
+            return LedgerBuilder()
+
+    def _drop(self, config, content):
+        path = config.input_dir()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for name, data in content.items():
+            f = open(os.path.join(path, name), 'w')
+            f.write(data)
+            f.close()
+
+    def test_ledger(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = self.LedgerConfig()
+            config.processed = []
+            self._drop(config, {'a': 'spam', 'error': 'egg'})
+            config.run()
+
+            self.assertEqual(['a', 'error'], sorted(config.processed))
+            self.assertEqual(1, ImportedFile.objects.filter(
+                status=ImportedFile.DONE).count())
+            self.assertEqual(1, ImportedFile.objects.filter(
+                status=ImportedFile.ERROR).count())
+
+            # same content with another name, new content and a file
+            # that failed previously
+            config.processed = []
+            self._drop(config, {'b': 'spam', 'c': 'ham', 'error': 'egg'})
+            config.run()
+
+            self.assertEqual(['c', 'error'], sorted(config.processed))
+            self.assertEqual([], os.listdir(config.input_dir()))
+            self.assertEqual(
+                ['a', 'b', 'c'],
+                sorted(os.listdir(config.done_dir()))
+            )
+            imported = ImportedFile.objects.get(digest=file_digest(
+                os.path.join(config.done_dir(), 'b')))
+            self.assertEqual('a', imported.path)
+            self.assertEqual('LedgerConfig', imported.configuration)
+
+    def test_removed_file(self):
+        """A file removed after the directory is listed is skipped"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = self.LedgerConfig()
+            config.processed = []
+            self._drop(config, {'a': 'spam', 'b': 'egg'})
+            process_file = config.process_file
+
+            def remove_others(partial_file_path):
+                # another process takes the other files
+                for name in os.listdir(config.input_dir()):
+                    if name != partial_file_path:
+                        os.remove(os.path.join(config.input_dir(), name))
+                return process_file(partial_file_path)
+
+            config.process_file = remove_others
+            config.run()
+
+            self.assertEqual(1, len(config.processed))
+            self.assertEqual([], os.listdir(config.input_dir()))
+            self.assertEqual(
+                (False, None),
+                process_file('missing'),
+            )
+
+
+class LayoutConfig(BaseConfig):
+
+    LAYOUT = 'date'
+
+    def load_builder(self, partial_file_path):
+        config = self
+
+        class LayoutBuilder(object):
+
+            def process_and_save(self):
+                config.open(partial_file_path)
+                return [], partial_file_path.endswith('error')
+
+        return LayoutBuilder()
+
+
+class LayoutTest(BaseSwallowTests):
+    """Check the layouts of done and error directories"""
+
+    def _drop(self, config, names):
+        for name in names:
+            path = os.path.join(config.input_dir(), name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def test_date_layout(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = LayoutConfig()
+            self._drop(config, ['a', 'sub/b', 'error'])
+            config.run()
+
+            day = datetime.now().strftime('%Y/%m/%d')
+            self.assertTrue(os.path.exists(
+                os.path.join(config.done_dir(), day, 'a')))
+            self.assertTrue(os.path.exists(
+                os.path.join(config.done_dir(), day, 'sub', 'b')))
+            self.assertTrue(os.path.exists(
+                os.path.join(config.error_dir(), day, 'error')))
+            self.assertEqual(
+                'sub/b',
+                config.input_path(os.path.join(day, 'sub', 'b'))
+            )
+            self.assertEqual(None, config.input_path(day))
+            # the input tree is not mirrored
+            self.assertFalse(os.path.exists(
+                os.path.join(config.done_dir(), 'sub')))
+            self.assertFalse(os.path.exists(
+                os.path.join(config.error_dir(), 'sub')))
+
+    def test_hash_layout(self):
+        class HashConfig(LayoutConfig):
+            LAYOUT = 'hash'
+            HASH_BUCKETS = 16
+
+        path = HashConfig.layout_path('sub/b')
+        bucket, partial_file_path = path.split('/', 1)
+        self.assertEqual('sub/b', partial_file_path)
+        self.assertEqual(1, len(bucket))
+        self.assertEqual(path, HashConfig.layout_path('sub/b'))
+        self.assertEqual('sub/b', HashConfig.input_path(path))
+        self.assertEqual(None, HashConfig.input_path(bucket))
+        # unicode paths are hashed as their utf-8 bytes
+        self.assertEqual(
+            HashConfig.layout_path('caf\xc3\xa9').split('/')[0],
+            HashConfig.layout_path(u'caf\xe9').split('/')[0],
+        )
+
+    def test_no_layout(self):
+        self.assertEqual('sub/b', BaseConfig.layout_path('sub/b'))
+        self.assertEqual('sub/b', BaseConfig.input_path('sub/b'))
+        self.assertEqual(None, BaseConfig.layout_date('2012/01/01'))
+
+    def test_clean_expired_days(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = LayoutConfig()
+            old = os.path.join(config.done_dir(), '2001', '01', '01')
+            today = os.path.join(
+                config.done_dir(),
+                datetime.now().strftime('%Y/%m/%d'),
+            )
+            for path in (old, today):
+                os.makedirs(path)
+                open(os.path.join(path, 'f'), 'w').close()
+
+            call_command(
+                'swallow_clean',
+                'swallow.tests.config.LayoutConfig',
+                dirs='done',
+                age='3600',
+                verbosity=0,
+            )
+
+            self.assertFalse(os.path.exists(os.path.join(old, 'f')))
+            self.assertTrue(os.path.exists(os.path.join(today, 'f')))
+
+
+class CompressedConfig(BaseConfig):
+
+    EXPAND_ZIP = True
+
+    def load_builder(self, partial_file_path):
+        if not uncompressed_name(partial_file_path).endswith('.xml'):
+            return None
+        config = self
+
+        class CompressedBuilder(object):
+
+            def process_and_save(self):
+                f = config.open(partial_file_path)
+                content = f.read()
+                f.close()
+                config.contents[partial_file_path] = content
+                return [partial_file_path], content == 'error'
+
+        return CompressedBuilder()
+
+
+class CompressedTest(BaseSwallowTests):
+    """Check that compressed files and zip archives are read transparently"""
+
+    def test_compressed_files(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = CompressedConfig()
+            config.contents = {}
+            path = config.input_dir()
+            os.makedirs(path)
+            f = gzip.open(os.path.join(path, 'a.xml.gz'), 'wb')
+            f.write('spam')
+            f.close()
+            f = bz2.BZ2File(os.path.join(path, 'b.xml.bz2'), 'w')
+            f.write('egg')
+            f.close()
+            open(os.path.join(path, 'c.xml'), 'w').write('ham')
+            config.run()
+
+            self.assertEqual(
+                {'a.xml.gz': 'spam', 'b.xml.bz2': 'egg', 'c.xml': 'ham'},
+                config.contents,
+            )
+            self.assertEqual(
+                ['a.xml.gz', 'b.xml.bz2', 'c.xml'],
+                sorted(os.listdir(config.done_dir())),
+            )
+
+    def test_zip_members(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = CompressedConfig()
+            config.contents = {}
+            path = config.input_dir()
+            os.makedirs(path)
+            archive = zipfile.ZipFile(os.path.join(path, 'ok.zip'), 'w')
+            archive.writestr('a.xml', 'spam')
+            archive.writestr('sub/b.xml', 'egg')
+            archive.writestr('readme.txt', 'ham')
+            archive.close()
+            archive = zipfile.ZipFile(os.path.join(path, 'ko.zip'), 'w')
+            archive.writestr('c.xml', 'error')
+            archive.close()
+            config.run()
+
+            self.assertEqual(
+                {
+                    'ok.zip/a.xml': 'spam',
+                    'ok.zip/sub/b.xml': 'egg',
+                    'ko.zip/c.xml': 'error',
+                },
+                config.contents,
+            )
+            self.assertEqual(['ok.zip'], os.listdir(config.done_dir()))
+            self.assertEqual(['ko.zip'], os.listdir(config.error_dir()))
+            self.assertEqual([], os.listdir(config.work_dir()))
+
+    def test_bad_zip(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = CompressedConfig()
+            config.contents = {}
+            path = config.input_dir()
+            os.makedirs(path)
+            open(os.path.join(path, 'bad.zip'), 'w').write('not a zip')
+            config.run()
+
+            self.assertEqual({}, config.contents)
+            self.assertEqual(['bad.zip'], os.listdir(config.error_dir()))
+            self.assertEqual([], os.listdir(config.work_dir()))
+            self.assertEqual([], os.listdir(config.input_dir()))
+
+    def test_zip_without_builder(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = CompressedConfig()
+            config.contents = {}
+            path = config.input_dir()
+            os.makedirs(path)
+            archive = zipfile.ZipFile(os.path.join(path, 'other.zip'), 'w')
+            archive.writestr('readme.txt', 'ham')
+            archive.close()
+            mtime = os.stat(os.path.join(path, 'other.zip')).st_mtime
+            config.run()
+
+            self.assertEqual({}, config.contents)
+            self.assertEqual(['other.zip'], os.listdir(config.input_dir()))
+            self.assertEqual(
+                mtime,
+                os.stat(os.path.join(path, 'other.zip')).st_mtime,
+            )
+            self.assertEqual([], os.listdir(config.done_dir()))
+            self.assertEqual([], os.listdir(config.error_dir()))
+
+    def test_uncompressed_name(self):
+        self.assertEqual('a.xml', uncompressed_name('a.xml.gz'))
+        self.assertEqual('a.xml', uncompressed_name('a.xml.xz'))
+        self.assertEqual('a.xml', uncompressed_name('a.xml'))
+
+
+class ConfigurationRegistryTests(BaseSwallowTests):
+
+    MODULES = (
+        'swallow.tests.integration.ArticleConfig',
+        'swallow.tests.watch.WatchConfig',
+    )
+
+    def test_lookups(self):
+        registry = ConfigurationRegistry()
+        with override_settings(SWALLOW_CONFIGURATION_MODULES=self.MODULES):
+            configurations = registry.all()
+            self.assertEqual(
+                ['ArticleConfig', 'WatchConfig'],
+                sorted(configurations.keys()),
+            )
+            self.assertTrue(registry.get('ArticleConfig') is ArticleConfig)
+            # by directory name
+            self.assertTrue(registry.get('articleconfig') is ArticleConfig)
+            self.assertRaises(KeyError, registry.get, 'unknown')
+            self.assertTrue(registry.resolve('articleconfig') is ArticleConfig)
+            path = 'swallow.tests.integration.ArticleConfig'
+            self.assertTrue(registry.resolve(path) is ArticleConfig)
+
+    def test_reload(self):
+        registry = ConfigurationRegistry()
+        with override_settings(SWALLOW_CONFIGURATION_MODULES=self.MODULES):
+            self.assertEqual(2, len(registry.all()))
+        # the registry is built again when the setting changes
+        with override_settings(SWALLOW_CONFIGURATION_MODULES=self.MODULES[:1]):
+            self.assertEqual(['ArticleConfig'], registry.all().keys())
+            registry._by_name['Other'] = None
+            registry.reload()
+            self.assertEqual(['ArticleConfig'], registry.all().keys())
@@ -1,4 +1,6 @@
-import os, shutil, copy, re
+import os, shutil, copy, re, json
+
+from StringIO import StringIO
 
 from django.test import TransactionTestCase
 from django.core.files.base import ContentFile
@@ -10,12 +12,14 @@ except ImportError:
     from override_settings import override_settings
 
 from swallow.config import BaseConfig
-from swallow.mappers import XmlMapper
+from swallow.mappers import XmlMapper, memoized_property
 from swallow.populator import BasePopulator
-from swallow.models import Matching
+from swallow.models import Matching, FileCount, SwallowConfiguration
 from swallow.tests import Section, Article, ArticleToSection
 from swallow.builder import BaseBuilder
 
+from base import QueryBudgetMixin
+
 
 CURRENT_PATH = os.path.dirname(__file__)
 
@@ -26,28 +30,28 @@ class ArticleMapper(XmlMapper):
     def _instance_filters(self):
         return {'title': self.title}
 
-    @property
+    @memoized_property
     def title(self):
         title = self._item.find('title').text
         return title
 
-    @property
+    @memoized_property
     def author(self):
         return self._item.find('author').text
 
-    @property
+    @memoized_property
     def source(self):
         return self._item.find('source').text
 
-    @property
+    @memoized_property
     def section(self):
         return self._item.find('section').text
 
-    @property
+    @memoized_property
     def weight(self):
         return self._item.find('weight').text
 
-    @property
+    @memoized_property
     def modified_by(self):
         return 'swallow'
 
@@ -123,12 +127,36 @@ class ArticleBuilder(BaseBuilder):
         return instance.modified_by != 'swallow'
 
 
+class TrackedArticlePopulator(ArticlePopulator):
+    """Primary sections are diffed instead of being cleared and added
+    again"""
+
+    _m2m_targets = ('primary_sections',)
+
+    @Matching.from_matching(
+        'SECTIONS',
+        first_match=True,
+        post_process_match=_fetch_section_from_constant,
+        )
+    def primary_sections(self, section):
+        return [section]
+
+
+class TrackedArticleBuilder(ArticleBuilder):
+    """Builder saving only the articles that changed"""
+
+    Populator = TrackedArticlePopulator
+    TRACK_CHANGES = True
+
+
 class ArticleConfig(BaseConfig):
 
+    Builder = ArticleBuilder
+
     def load_builder(self, partial_file_path):
         filename = os.path.basename(partial_file_path)
         if re.match(r'^\w+\.xml$', filename) is not None:
-            return ArticleBuilder(partial_file_path, self)
+            return self.Builder(partial_file_path, self)
         return None
 
     def instance_is_locally_modified(self, instance):
@@ -207,7 +235,7 @@ def setup_matchings_and_sections():
     Section(name='SPORT INDIVIDUEL').save()
 
 
-class IntegrationTests(TransactionTestCase):
+class IntegrationTests(QueryBudgetMixin, TransactionTestCase):
 
     def setUp(self):
         import_dir = os.path.join(CURRENT_PATH, 'import')
@@ -293,6 +321,18 @@ class IntegrationTests(TransactionTestCase):
             self._test_input_is_empty()
             self._test_done_has_files()
 
+    def test_matchings_are_fetched_once(self):
+        """Matchings are fetched once per run whatever the number
+        of mappers"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            config.run()
+
+            # SOURCES and SECTIONS
+            self.assertEqual(2, config.matchings.misses)
+            # 3 articles use SECTIONS twice and SOURCES once
+            self.assertEqual(7, config.matchings.hits)
+
     def test_run_with_update(self):
         """Check that update of instances is properly done"""
 
@@ -344,6 +384,174 @@ class IntegrationTests(TransactionTestCase):
             self._test_input_is_empty()
             self._test_done_has_files()
 
+    def test_timings(self):
+        """Phases of the import are measured and dumped by the command"""
+        dump = os.path.join(self.SWALLOW_DIRECTORY, 'timings.json')
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            call_command(
+                'swallow_run',
+                'swallow.tests.integration.ArticleConfig',
+                verbosity=0,
+                timings=dump,
+            )
+        with open(dump) as f:
+            measures = json.load(f)
+        counts = dict(
+            ((m['group'], m['name'], m['phase']), m['count'])
+            for m in measures
+        )
+        self.assertEqual(3, counts['config', 'ArticleConfig', 'process_file'])
+        self.assertEqual(3, counts['builder', 'ArticleBuilder', 'save'])
+        self.assertEqual(3, counts['builder', 'ArticleBuilder', 'process_mapper'])
+        populator = 'ArticleBuilder.ArticlePopulator'
+        self.assertEqual(3, counts['populator', populator, 'sections'])
+
+    def test_timings_summary(self):
+        """The table of the phases is printed from verbosity 1"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            stdout = StringIO()
+            call_command(
+                'swallow_run',
+                'swallow.tests.integration.ArticleConfig',
+                verbosity=0,
+                stdout=stdout,
+            )
+            self.assertEqual('', stdout.getvalue())
+
+            self._reset_imports()
+            stdout = StringIO()
+            call_command(
+                'swallow_run',
+                'swallow.tests.integration.ArticleConfig',
+                verbosity=1,
+                stdout=stdout,
+            )
+            self.assertIn('process_file', stdout.getvalue())
+
+    def test_file_counts(self):
+        """File counts are set by ``swallow_count`` and updated by runs"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            call_command(
+                'swallow_count',
+                'swallow.tests.integration.ArticleConfig',
+                verbosity=0,
+            )
+            counts = FileCount.get_counts()['ArticleConfig']
+            self.assertEqual({'input': 3, 'done': 0, 'error': 0}, counts)
+
+            config = ArticleConfig()
+            config.run()
+            counts = FileCount.get_counts()['ArticleConfig']
+            self.assertEqual({'input': 0, 'done': 3, 'error': 0}, counts)
+
+            configuration = SwallowConfiguration(ArticleConfig)
+            self.assertEqual(3, configuration.done())
+            self.assertTrue(configuration.status())
+
+            # a file arrives between two runs
+            self._update_imports()
+            config.process_endpoints(['ski.xml'])
+            counts = FileCount.get_counts()['ArticleConfig']
+            self.assertEqual({'input': 0, 'done': 4, 'error': 0}, counts)
+
+    def test_file_counts_quarantine(self):
+        """Files counted by the last run are not counted again when they
+        are processed on their own"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            config.QUARANTINE = 3600
+            for name in os.listdir(config.input_dir()):
+                os.utime(os.path.join(config.input_dir(), name), None)
+            config.run()
+            counts = FileCount.get_counts()['ArticleConfig']
+            self.assertEqual(3, counts['input'])
+
+            config.QUARANTINE = 0
+            call_command(
+                'swallow_count',
+                'swallow.tests.integration.ArticleConfig',
+                verbosity=0,
+            )
+            config.process_endpoints(['ski.xml'])
+            counts = FileCount.get_counts()['ArticleConfig']
+            self.assertEqual({'input': 2, 'done': 1, 'error': 0}, counts)
+
+    def _reset_imports(self):
+        # simulate the import of the same files
+        import_dir = os.path.join(CURRENT_PATH, 'import')
+        shutil.rmtree(import_dir)
+        import_initial = os.path.join(CURRENT_PATH, 'import.initial')
+        shutil.copytree(import_initial, import_dir)
+
+    # Statements per mapper of the import of the 3 articles, most of them
+    # are done by populator methods that add sections one by one. File
+    # counts are updated once per directory and per run, they are not
+    # part of the budget per mapper
+
+    def test_query_budget_create(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            recorder = self.assertQueryBudget(12, config.run)
+            self.assertEqual(3, recorder.mappers)
+            self.assertPhaseBudget(
+                3, recorder, u'config ArticleConfig file_counts')
+            self.assertPhaseBudget(
+                3, recorder, u'builder ArticleBuilder get_or_create')
+            self.assertPhaseBudget(3, recorder, u'builder ArticleBuilder save')
+
+    def test_query_budget_update(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            config.run()
+            self._update_imports()
+            recorder = self.assertQueryBudget(15, config.run)
+            self.assertPhaseBudget(
+                3, recorder, u'config ArticleConfig file_counts')
+            # existence check and update of each article
+            self.assertPhaseBudget(6, recorder, u'builder ArticleBuilder save')
+
+    # With TRACK_CHANGES and primary sections diffed, an update saves the
+    # changed fields only and an unchanged import doesn't write articles
+    # nor primary sections
+
+    def test_query_budget_update_tracked(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            config.Builder = TrackedArticleBuilder
+            config.run()
+            self._update_imports()
+            recorder = self.assertQueryBudget(13, config.run)
+            self.assertEqual({'updated': 3}, dict(config.counts))
+            self.assertPhaseBudget(
+                3, recorder, u'builder TrackedArticleBuilder save')
+            self.assertPhaseBudget(
+                6, recorder, u'builder TrackedArticleBuilder flush_m2m')
+
+    def test_query_budget_unchanged(self):
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            config.Builder = TrackedArticleBuilder
+            config.run()
+            self._reset_imports()
+            recorder = self.assertQueryBudget(10, config.run)
+            self.assertEqual({'unchanged': 3}, dict(config.counts))
+            self.assertPhaseBudget(
+                0, recorder, u'builder TrackedArticleBuilder save')
+            # current primary sections are read, none is written
+            self.assertPhaseBudget(
+                3, recorder, u'builder TrackedArticleBuilder flush_m2m')
+
+    def test_query_budget_exceeded(self):
+        """The failure message points to the phases"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = ArticleConfig()
+            try:
+                self.assertQueryBudget(1, config.run)
+            except AssertionError, e:
+                self.assertIn(u'builder ArticleBuilder get_or_create', unicode(e))
+            else:
+                self.fail('the budget is not exceeded')
+
     def tearDown(self):
         import_dir = os.path.join(CURRENT_PATH, 'import')
         shutil.rmtree(import_dir)
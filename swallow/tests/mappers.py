@@ -0,0 +1,300 @@
+import os
+import gzip
+import tempfile
+
+from StringIO import StringIO
+from datetime import datetime
+from itertools import islice
+from collections import namedtuple
+
+from lxml import etree
+from django.test import TestCase
+
+from swallow.mappers import XmlMapper, IterXmlMapper, SlicedXmlMapper
+from swallow.mappers import memoized_property, xpaths
+from swallow.mappers import DeclarativeMapper, Field
+from swallow.mapped import MappedFile, open_mapped
+
+
+MockBuilder = namedtuple('Builder', ('fd', 'content'))
+SlicedBuilder = namedtuple('Builder', ('fd', 'content', 'byte_range'))
+
+
+feed = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>Feed</title>
+  %s
+</feed>"""
+
+entry = """<entry><title>Entry %s</title></entry>"""
+
+
+class IterXmlMapperTests(TestCase):
+
+    class Mapper(IterXmlMapper):
+
+        tag = 'atom:entry'
+        namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+
+        @property
+        def title(self):
+            return self._item.find('atom:title', namespaces=self.namespaces).text
+
+    def _builder(self, count):
+        entries = ''.join([entry % i for i in range(count)])
+        return MockBuilder(StringIO(feed % entries), 'feed.xml')
+
+    def test_iter_mappers(self):
+        builder = self._builder(3)
+        titles = [m.title for m in self.Mapper._iter_mappers(builder)]
+        self.assertEqual(['Entry 0', 'Entry 1', 'Entry 2'], titles)
+
+    def test_clark_notation(self):
+
+        class Mapper(self.Mapper):
+            tag = '{http://www.w3.org/2005/Atom}entry'
+
+        builder = self._builder(2)
+        self.assertEqual(2, len(list(Mapper._iter_mappers(builder))))
+
+    def test_processed_records_are_freed(self):
+        builder = self._builder(100)
+        for mapper in self.Mapper._iter_mappers(builder):
+            item = mapper._item
+            # at most one previous element, already cleared, is left
+            # before the current record
+            previous = item.getprevious()
+            if previous is not None:
+                self.assertIsNone(previous.getprevious())
+                self.assertEqual(0, len(previous))
+
+    def test_chunks(self):
+        """Records of a chunk are not freed before the chunk is processed"""
+
+        class Builder(object):
+            CHUNK_SIZE = 4
+            content = 'feed.xml'
+            fd = self._builder(10).fd
+
+        mappers = self.Mapper._iter_mappers(Builder())
+        titles = []
+        while True:
+            chunk = list(islice(mappers, Builder.CHUNK_SIZE))
+            if not chunk:
+                break
+            titles.extend([m.title for m in chunk])
+        self.assertEqual(['Entry %s' % i for i in range(10)], titles)
+
+
+class SlicedXmlMapperTests(TestCase):
+
+    class Mapper(SlicedXmlMapper):
+
+        tag = 'atom:entry'
+        raw_tag = 'entry'
+        namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+
+        @property
+        def title(self):
+            return self._item.find('atom:title', namespaces=self.namespaces).text
+
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile(delete=False)
+        entries = ''.join([entry % i for i in range(5)])
+        f.write(feed % entries)
+        f.close()
+        self.path = f.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_mapped_file(self):
+        fd = open_mapped(self.path)
+        self.assertTrue(isinstance(fd, MappedFile))
+        builder = MockBuilder(fd, 'feed.xml')
+        titles = [m.title for m in self.Mapper._iter_mappers(builder)]
+        self.assertEqual(['Entry %s' % i for i in range(5)], titles)
+        fd.close()
+
+    def test_byte_range(self):
+        fd = open_mapped(self.path)
+        ranges = list(fd.ranges('entry'))
+        self.assertEqual(5, len(ranges))
+        self.assertEqual(entry % 1, fd[ranges[1][0]:ranges[1][1]])
+
+        # two workers share the records
+        builders = [
+            SlicedBuilder(fd, 'feed.xml', (0, ranges[2][0])),
+            SlicedBuilder(fd, 'feed.xml', (ranges[2][0], len(fd))),
+        ]
+        titles = [
+            [m.title for m in self.Mapper._iter_mappers(builder)]
+            for builder in builders
+        ]
+        self.assertEqual(
+            [['Entry 0', 'Entry 1'], ['Entry 2', 'Entry 3', 'Entry 4']],
+            titles,
+        )
+        fd.close()
+
+    def test_encoding(self):
+        f = open(self.path, 'wb')
+        f.write(
+            '<?xml version="1.0" encoding="iso-8859-1"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom">'
+            '<entry><title>caf\xe9</title></entry>'
+            '</feed>'
+        )
+        f.close()
+        fd = open_mapped(self.path)
+        builder = MockBuilder(fd, 'feed.xml')
+        titles = [m.title for m in self.Mapper._iter_mappers(builder)]
+        self.assertEqual([u'caf\xe9'], titles)
+        fd.close()
+
+    def test_clark_tag(self):
+
+        class Mapper(SlicedXmlMapper):
+            tag = '{http://www.w3.org/2005/Atom}entry'
+
+        fd = open_mapped(self.path)
+        builder = MockBuilder(fd, 'feed.xml')
+        self.assertRaises(ValueError, list, Mapper._iter_mappers(builder))
+        fd.close()
+
+    def test_fallback(self):
+        f = open(self.path, 'rb')
+        content = f.read()
+        f.close()
+        f = gzip.open(self.path, 'wb')
+        f.write(content)
+        f.close()
+        fd = open_mapped(self.path)
+        self.assertFalse(isinstance(fd, MappedFile))
+        builder = MockBuilder(fd, 'feed.xml')
+        self.assertEqual(5, len(list(self.Mapper._iter_mappers(builder))))
+        fd.close()
+
+
+class MemoizedPropertyTests(TestCase):
+
+    class Mapper(XmlMapper):
+
+        namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+
+        @memoized_property
+        def title(self):
+            self.calls += 1
+            return self.xpath_text('atom:title')
+
+    def _mapper(self):
+        root = etree.fromstring(feed % '')
+        mapper = self.Mapper(root, 'feed.xml')
+        mapper.calls = 0
+        return mapper
+
+    def test_memoized(self):
+        mapper = self._mapper()
+        self.assertEqual('Feed', mapper.title)
+        self.assertEqual('Feed', mapper.title)
+        self.assertEqual(1, mapper.calls)
+        del mapper.title
+        self.assertEqual('Feed', mapper.title)
+        self.assertEqual(2, mapper.calls)
+        self.assertTrue(isinstance(self.Mapper.title, memoized_property))
+
+    def test_xpath_registry(self):
+        mapper = self._mapper()
+        self.assertEqual(None, mapper.xpath_text('atom:subtitle'))
+        self.assertEqual('x', mapper.xpath_text('atom:subtitle', 'x'))
+        self.assertEqual(1.0, mapper.xpath_text('count(atom:title)'))
+        self.assertTrue(
+            xpaths.get('atom:title', self.Mapper.namespaces)
+            is self.Mapper._xpath('atom:title')
+        )
+        self.assertFalse(xpaths.get('atom:title', {'atom': 'x'})
+                         is self.Mapper._xpath('atom:title'))
+
+
+product = """<product xmlns:p="urn:price" id="42">
+  <name>Spam</name>
+  <p:price cents="250"/>
+  <released>2012-03-04T05:06:07</released>
+  <tags><tag>a</tag><tag>b</tag></tags>
+  <tags><tag>c</tag></tags>
+</product>"""
+
+
+class DeclarativeMapperTests(TestCase):
+
+    class Mapper(DeclarativeMapper):
+
+        namespaces = {'p': 'urn:price'}
+
+        name = Field('name')
+        price = Field('p:price/@cents', 'int')
+        released = Field('released', 'datetime')
+        tags = Field('tags/tag', 'list')
+        missing = Field('missing', 'int', default=0)
+        identifier = Field('string(@id)', int)
+
+    def _mapper(self, Mapper=None):
+        Mapper = Mapper or self.Mapper
+        return Mapper(etree.fromstring(product), 'product.xml')
+
+    def test_fields(self):
+        mapper = self._mapper()
+        self.assertEqual('Spam', mapper.name)
+        self.assertEqual(250, mapper.price)
+        self.assertEqual(datetime(2012, 3, 4, 5, 6, 7), mapper.released)
+        self.assertEqual(['a', 'b', 'c'], mapper.tags)
+        self.assertEqual(0, mapper.missing)
+        self.assertEqual(42, mapper.identifier)
+
+    def test_plan(self):
+        # only the XPath function is not extracted by the walk
+        self.assertEqual(
+            ['identifier'],
+            [name for name, field in self.Mapper._xpath_fields],
+        )
+        self.assertEqual(
+            ('name', 'price', 'released', 'tags', 'missing', 'identifier'),
+            self.Mapper.Record.__slots__,
+        )
+        record = self._mapper()._record
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual('Spam', record.name)
+
+    def test_inheritance(self):
+
+        class Mapper(self.Mapper):
+
+            name = Field('name', lambda value: value.upper())
+            summary = Field('summary', default='')
+
+            @property
+            def tags(self):
+                return 'overriden'
+
+        mapper = self._mapper(Mapper)
+        self.assertEqual('SPAM', mapper.name)
+        self.assertEqual(250, mapper.price)
+        self.assertEqual('', mapper.summary)
+        self.assertEqual('overriden', mapper.tags)
+        self.assertFalse('tags' in Mapper.Record._names)
+
+    def test_iter_mappers(self):
+
+        class Mapper(DeclarativeMapper, IterXmlMapper):
+
+            tag = 'atom:entry'
+            namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+
+            title = Field('atom:title')
+
+        entries = ''.join([entry % i for i in range(3)])
+        builder = MockBuilder(StringIO(feed % entries), 'feed.xml')
+        self.assertEqual(
+            ['Entry 0', 'Entry 1', 'Entry 2'],
+            [m._record.title for m in Mapper._iter_mappers(builder)],
+        )
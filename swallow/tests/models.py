@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
+import os
+import time
 from collections import namedtuple
 
 from django.core.files.base import ContentFile
 from django.test import TestCase
 from django.conf import settings
 
-from swallow.models import Matching
+from swallow.models import Matching, CompiledMatching
+from swallow.models import MatchingRegistry, matchings
 
 
 xml = """
@@ -95,3 +98,57 @@ class MatchingTests(TestCase):
         mapper = DummyMapper('random', u'thing')
         value = self.matching.match(mapper, first_match=True)
         self.assertEqual('DEFAULT', value)
+
+    def test_compiled_is_cached(self):
+        matching = Matching.objects.get(name='TEST')
+        compiled = matching.compiled()
+        self.assertTrue(compiled is Matching.objects.get(name='TEST').compiled())
+
+    def test_compiled_is_invalidated(self):
+        """Compiled matching is built again when the matching
+        or its file changes"""
+        matching = Matching.objects.get(name='TEST')
+        compiled = matching.compiled()
+        matching.save()
+        self.assertFalse(compiled is matching.compiled())
+
+        compiled = matching.compiled()
+        f = open(matching.file.path, 'a')
+        f.write('<!-- changed -->')
+        f.close()
+        modified = time.time() + 10
+        os.utime(matching.file.path, (modified, modified))
+        CompiledMatching.CHECK_INTERVAL = 0
+        try:
+            self.assertFalse(compiled is matching.compiled())
+        finally:
+            CompiledMatching.CHECK_INTERVAL = 1
+        mapper = DummyMapper('foo', 'nothing')
+        self.assertEqual(['FOO'], matching.match(mapper))
+
+
+class MatchingRegistryTests(TestCase):
+
+    def setUp(self):
+        settings.MEDIA_ROOT = '/tmp'
+        matching = Matching(name='REGISTRY')
+        matching.file.save(
+            'swallow_matchings/registry.xml',
+            ContentFile(xml),
+            save=True
+        )
+
+    def test_get(self):
+        registry = MatchingRegistry()
+        matching = registry.get('REGISTRY')
+        self.assertTrue(matching is registry.get('REGISTRY'))
+        self.assertEqual(1, registry.misses)
+        self.assertEqual(1, registry.hits)
+        self.assertRaises(Matching.DoesNotExist, registry.get, 'UNKNOWN')
+
+    def test_discard_on_save(self):
+        """The process wide registry forget matchings that change"""
+        matching = matchings.get('REGISTRY')
+        matching.name = 'RENAMED'
+        matching.save()
+        self.assertRaises(Matching.DoesNotExist, matchings.get, 'REGISTRY')
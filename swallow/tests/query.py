@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.core.paginator import Paginator
+
+from swallow import query
+from swallow.query import DirectoryQueryResult
+
+
+class DirectoryQueryResultTests(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for i in range(25):
+            open(os.path.join(self.path, 'file%02d' % i), 'w').close()
+        os.mkdir(os.path.join(self.path, 'subdir'))
+
+    def tearDown(self):
+        DirectoryQueryResult.invalidate(self.path)
+        shutil.rmtree(self.path)
+
+    def test_pages(self):
+        result = DirectoryQueryResult(self.path, 'Config/done')
+        paginator = Paginator(result, 10)
+        self.assertEqual(26, paginator.count)
+        page = paginator.page(3).object_list
+        self.assertEqual(
+            ['Config/done/file20', 'Config/done/file21', 'Config/done/file22',
+             'Config/done/file23', 'Config/done/file24', 'Config/done/subdir'],
+            [element.pk for element in page],
+        )
+        self.assertTrue(page[-1].is_dir())
+        self.assertFalse(page[0].is_dir())
+        self.assertEqual('Config/done/file05', result[5].pk)
+
+    def test_count_is_cached(self):
+        result = DirectoryQueryResult(self.path, 'Config/done')
+        self.assertEqual(26, result.count())
+        os.remove(os.path.join(self.path, 'file00'))
+        self.assertEqual(26, result.count())
+        DirectoryQueryResult.invalidate(self.path)
+        self.assertEqual(25, result.count())
+
+    def test_unicode_cache_key(self):
+        self.assertEqual(
+            DirectoryQueryResult.cache_key('/tmp/caf\xc3\xa9'),
+            DirectoryQueryResult.cache_key(u'/tmp/caf\xe9'),
+        )
+
+    def test_index(self):
+        result = DirectoryQueryResult(self.path, 'Config/done')
+        self.assertEqual('Config/done/subdir', result[-1].pk)
+        self.assertEqual('Config/done/file24', result[-2].pk)
+        self.assertEqual('Config/done/file00', result[-26].pk)
+        self.assertRaises(IndexError, lambda: result[-27])
+        self.assertRaises(IndexError, lambda: result[26])
+
+    def test_iteration_lists_once(self):
+        result = DirectoryQueryResult(self.path, 'Config/done')
+        calls = []
+        original = query.iterdir
+
+        def iterdir(path):
+            calls.append(path)
+            return original(path)
+
+        query.iterdir = iterdir
+        try:
+            names = [element.pk for element in result]
+        finally:
+            query.iterdir = original
+        self.assertEqual(26, len(names))
+        self.assertEqual('Config/done/file00', names[0])
+        self.assertEqual(1, len(calls))
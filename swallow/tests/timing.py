@@ -0,0 +1,54 @@
+from django.utils import unittest
+
+from swallow.timing import Timings, PhaseStats
+
+
+class TimingsTests(unittest.TestCase):
+
+    def test_histogram(self):
+        stats = PhaseStats()
+        for seconds in (0.0005, 0.003, 0.003, 0.04, 100):
+            stats.add(seconds)
+        self.assertEqual(5, stats.count)
+        self.assertEqual(100, stats.max)
+        self.assertEqual(1, stats.buckets[0])  # <= 1ms
+        self.assertEqual(2, stats.buckets[2])  # <= 5ms
+        self.assertEqual(1, stats.buckets[-1])  # unbound
+        self.assertEqual(0.005, stats.percentile(50))
+        self.assertEqual(100, stats.percentile(100))
+
+    def test_measure_and_hooks(self):
+        timings = Timings()
+        measures = []
+        timings.hooks.append(lambda *args: measures.append(args))
+        with timings.measure('builder', 'Builder', 'save'):
+            pass
+        try:
+            with timings.measure('builder', 'Builder', 'save'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(2, timings.stats['builder', 'Builder', 'save'].count)
+        self.assertEqual(2, len(measures))
+        self.assertEqual(('builder', 'Builder', 'save'), measures[0][:3])
+
+    def test_dump_and_merge(self):
+        timings = Timings()
+        timings.add('config', 'Config', 'move', 0.01)
+        timings.add('config', 'Config', 'move', 0.2)
+        other = Timings()
+        other.add('config', 'Config', 'move', 1)
+        other.merge(timings.dump())
+        stats = other.stats['config', 'Config', 'move']
+        self.assertEqual(3, stats.count)
+        self.assertAlmostEqual(1.21, stats.total)
+        self.assertEqual(1, stats.max)
+        self.assertEqual(3, sum(stats.buckets))
+
+    def test_summary(self):
+        timings = Timings()
+        timings.add('config', 'Config', 'move', 0.01)
+        lines = timings.summary().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('phase'))
+        self.assertTrue(lines[1].startswith('config Config move'))
@@ -1,6 +1,9 @@
 import os
 import re
 
+from django.db import transaction
+from django.test import TransactionTestCase
+
 from base import BaseSwallowTests
 
 try:
@@ -15,6 +18,11 @@ from integration import ArticleBuilder
 from integration import ArticleConfig
 from integration import setup_matchings_and_sections
 
+from swallow.builder import BaseBuilder
+from swallow.mappers import BaseMapper
+from swallow.populator import BasePopulator
+from swallow.tests import ModelForBuilderTests
+
 class TransactionsTests(BaseSwallowTests):
 
     def test_rollback_one_to_one(self):
@@ -63,3 +71,88 @@ class TransactionsTests(BaseSwallowTests):
             d = os.listdir(error)
             self.assertEqual(1, len(d))
             self.assertEqual('ski.xml', d[0])
+
+
+class CountingBuilder(BaseBuilder):
+    """Builder that counts its commits"""
+
+    Model = ModelForBuilderTests
+    COMMIT_EVERY = 3
+
+    class Mapper(BaseMapper):
+
+        @classmethod
+        def _iter_mappers(cls, builder):
+            for i in [1, 2, 3, 4, 5, 6, 7]:
+                yield cls(i)
+
+        @property
+        def _instance_filters(self):
+            return {'simple_field': self._content}
+
+        @property
+        def second_field(self):
+            if self._content == 5:
+                raise Exception('custom exception')
+            return self._content
+
+    class Populator(BasePopulator):
+
+        _fields_one_to_one = ('second_field',)
+        _fields_if_instance_already_exists = None
+        _fields_if_instance_modified_from_last_import = None
+
+    def __init__(self, *args, **kwargs):
+        super(CountingBuilder, self).__init__(*args, **kwargs)
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        super(CountingBuilder, self).commit()
+
+    def skip(self, mapper):
+        return False
+
+    def instance_is_locally_modified(self, instance):
+        return False
+
+
+class ChunkedTransactionsTests(TransactionTestCase):
+
+    def test_commit_every(self):
+        """Mappers are committed by chunks and a failing mapper
+        does not prevent others to be saved"""
+        builder = CountingBuilder(None, None)
+        instances, unhandled_errors = builder.process_and_save()
+
+        self.assertTrue(unhandled_errors)
+        self.assertEqual(6, len(instances))
+        # after the 3rd and 6th mappers then at the end
+        self.assertEqual(3, builder.commits)
+        self.assertFalse(transaction.is_managed())
+        values = ModelForBuilderTests.objects.values_list(
+            'simple_field',
+            flat=True
+        )
+        self.assertEqual([1, 2, 3, 4, 6, 7], sorted(values))
+
+    def test_commit_once(self):
+        builder = CountingBuilder(None, None)
+        builder.COMMIT_EVERY = 0
+        builder.process_and_save()
+        self.assertEqual(1, builder.commits)
+
+    def test_managed_builder_joins_transaction(self):
+        """A managed builder, like nested builders, does not commit
+        the transaction it runs in"""
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            builder = CountingBuilder(None, None, managed=True)
+            builder.process_and_save()
+            self.assertEqual(0, builder.commits)
+            self.assertTrue(builder._in_transaction)
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+        self.assertEqual(0, ModelForBuilderTests.objects.count())
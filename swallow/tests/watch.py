@@ -0,0 +1,223 @@
+import os
+import time
+import unittest
+
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from django.db import DatabaseError
+
+from base import BaseSwallowTests
+
+from swallow.config import BaseConfig
+from swallow.exception import PostponeBuilder
+from swallow.watch import Watcher, pyinotify
+
+
+class WatchConfig(BaseConfig):
+
+    QUARANTINE = 60
+
+    def __init__(self, *args, **kwargs):
+        super(WatchConfig, self).__init__(*args, **kwargs)
+        self.processed = []
+
+    def load_builder(self, partial_file_path):
+        config = self
+
+        class WatchBuilder(object):
+
+            def process_and_save(self):
+                config.open(partial_file_path)
+                config.processed.append(partial_file_path)
+                if partial_file_path == 'postponed':
+                    raise PostponeBuilder()
+                return [], False
+
+        return WatchBuilder()
+
+
+class WatcherTests(BaseSwallowTests):
+
+    def _drop(self, config, name):
+        path = config.input_dir()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        open(os.path.join(path, name), 'w').close()
+
+    def test_quarantine_timer(self):
+        """Files are processed when their quarantine is over without
+        running the configuration"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            self._drop(config, 'foo')
+            watcher = Watcher([config])
+            now = time.time()
+            # first full run
+            timeout = watcher.process_due(now)
+            self.assertEqual([], config.processed)
+            self.assertEqual(watcher.rescan, timeout)
+
+            watcher.schedule(0, 'foo', now)
+            timeout = watcher.process_due(now)
+            self.assertEqual([], config.processed)
+            self.assertTrue(0 < timeout <= config.QUARANTINE)
+
+            watcher.process_due(now + config.QUARANTINE + 1)
+            self.assertEqual(['foo'], config.processed)
+            self.assertEqual(['foo'], os.listdir(config.done_dir()))
+
+    def test_postponed(self):
+        """Postponed files are not processed on their own event"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            self._drop(config, 'postponed')
+            watcher = Watcher([config])
+            now = time.time()
+            watcher.process_due(now)
+            self.assertEqual(['postponed'], config.processed)
+            self.assertEqual(['postponed'], os.listdir(config.input_dir()))
+
+            # event of the file moved back to input dir
+            watcher.schedule(0, 'postponed', now)
+            watcher.process_due(now)
+            self.assertEqual(['postponed'], config.processed)
+
+            # next full run
+            watcher.process_due(now + watcher.rescan)
+            self.assertEqual(['postponed', 'postponed'], config.processed)
+
+    def test_quarantine_restarted(self):
+        """A file written again during its quarantine is processed after
+        the quarantine of its last modification"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            self._drop(config, 'foo')
+            watcher = Watcher([config])
+            now = time.time()
+            watcher.process_due(now)
+            watcher.schedule(0, 'foo', now)
+
+            path = os.path.join(config.input_dir(), 'foo')
+            os.utime(path, (now + 30, now + 30))
+            timeout = watcher.process_due(now + config.QUARANTINE + 1)
+            self.assertEqual([], config.processed)
+            self.assertTrue(0 < timeout <= 30)
+
+            watcher.process_due(now + 30 + config.QUARANTINE + 1)
+            self.assertEqual(['foo'], config.processed)
+
+    def test_postponed_written_again(self):
+        """A postponed file written again is processed on its event"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            self._drop(config, 'postponed')
+            watcher = Watcher([config])
+            now = time.time()
+            watcher.process_due(now)
+            self.assertEqual(['postponed'], config.processed)
+
+            path = os.path.join(config.input_dir(), 'postponed')
+            os.utime(path, (now + 10, now + 10))
+            watcher.schedule(0, 'postponed', now)
+            watcher.process_due(now)
+            self.assertEqual(['postponed', 'postponed'], config.processed)
+
+    def test_ignored_polling(self):
+        """Files moved back to input directory are forgotten by the next
+        full run when there are no events"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            self._drop(config, 'postponed')
+            watcher = Watcher([config])
+            watcher.polled = set([0])
+            now = time.time()
+            for i in range(3):
+                watcher.process_due(now + i * watcher.interval)
+                self.assertEqual([(0, 'postponed')], watcher.ignored.keys())
+            os.remove(os.path.join(config.input_dir(), 'postponed'))
+            watcher.process_due(now + 3 * watcher.interval)
+            self.assertEqual({}, watcher.ignored)
+
+    def test_failed_run(self):
+        """An exception of a run is logged and the run is retried"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            self._drop(config, 'foo')
+            runs = []
+
+            def run():
+                runs.append(len(runs))
+                if len(runs) == 1:
+                    raise DatabaseError('connection lost')
+                BaseConfig.run(config)
+
+            config.run = run
+            watcher = Watcher([config])
+            now = time.time()
+            watcher.process_due(now)
+            self.assertEqual([], config.processed)
+
+            watcher.process_due(now + watcher.rescan)
+            self.assertEqual([0, 1], runs)
+            self.assertEqual(['foo'], config.processed)
+
+    def test_failed_endpoints(self):
+        """An exception while processing files is logged"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            os.makedirs(config.input_dir())
+            watcher = Watcher([config])
+            now = time.time()
+            watcher.process_due(now)
+
+            def process_endpoints(partial_file_paths):
+                raise DatabaseError('connection lost')
+
+            config.process_endpoints = process_endpoints
+            self._drop(config, 'foo')
+            watcher.schedule(0, 'foo', now)
+            watcher.process_due(now)
+            self.assertEqual([], watcher.timers)
+
+    @unittest.skipIf(pyinotify is None, 'pyinotify is not installed')
+    def test_events(self):
+        """Files written in input directory are scheduled"""
+        with override_settings(SWALLOW_DIRECTORY=self.SWALLOW_DIRECTORY):
+            config = WatchConfig()
+            config.QUARANTINE = 0
+            os.makedirs(config.input_dir())
+            watcher = Watcher([config])
+            watcher.runs = [time.time() + watcher.rescan]
+            manager = pyinotify.WatchManager()
+            # same arguments as Watcher.watch, auto_add adds IN_CREATE
+            manager.add_watch(
+                config.input_dir(),
+                pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO,
+                proc_fun=watcher.handler(0),
+                rec=True,
+                auto_add=True,
+            )
+            notifier = pyinotify.Notifier(manager)
+            f = open(os.path.join(config.input_dir(), 'foo'), 'w')
+            f.write('spam')
+            f.flush()
+            self.assertTrue(notifier.check_events(1000))
+            notifier.read_events()
+            notifier.process_events()
+            # the file is still being written
+            self.assertEqual([], watcher.timers)
+
+            f.close()
+            self.assertTrue(notifier.check_events(1000))
+            notifier.read_events()
+            notifier.process_events()
+            watcher.process_due()
+            self.assertEqual(['foo'], config.processed)
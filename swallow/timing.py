@@ -0,0 +1,172 @@
+"""Timing of the phases of an import.
+
+Phases are measured with :meth:`Timings.measure` and aggregated in the
+process-wide :data:`timings` registry by ``(group, name, phase)`` where
+``group`` is one of ``config``, ``builder`` or ``populator`` and ``name``
+the name of the configuration class, builder class or populator.
+
+Hooks can be added to receive every measure, for instance to send them
+to a monitoring service:
+
+  .. code-block:: python
+
+    from swallow.timing import timings
+
+    def hook(group, name, phase, seconds):
+        statsd.timing('swallow.%s.%s' % (name, phase), seconds * 1000)
+
+    timings.hooks.append(hook)
+"""
+from time import time
+from contextlib import contextmanager
+
+
+class PhaseStats(object):
+    """Count, total, maximum and latency histogram of a phase"""
+
+    BUCKETS = (
+        0.001, 0.002, 0.005,
+        0.01, 0.02, 0.05,
+        0.1, 0.2, 0.5,
+        1, 2, 5,
+        10, 30, 60,
+    )  # upper bounds in seconds, the last bucket has no bound
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for index, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            index = len(self.BUCKETS)
+        self.buckets[index] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket of the ``percent``
+        percentile, or the maximum if it's in the last bucket"""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.BUCKETS):
+                    return self.max
+                return min(self.BUCKETS[index], self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'buckets': list(self.buckets),
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        stats = cls()
+        stats.count = values['count']
+        stats.total = values['total']
+        stats.max = values['max']
+        stats.buckets = list(values['buckets'])
+        return stats
+
+
+class Timings(object):
+    """Registry of :class:`PhaseStats` by ``(group, name, phase)``"""
+
+    def __init__(self):
+        self.stats = {}
+        self.hooks = []  # callables called with ``group, name, phase,
+                         # seconds`` for each measure
+        self.stack = []  # ``(group, name, phase)`` of the phases being
+                         # measured, the innermost is the last
+
+    def reset(self):
+        self.stats = {}
+
+    @contextmanager
+    def measure(self, group, name, phase):
+        """Context manager measuring the time spent in its block"""
+        self.stack.append((group, name, phase))
+        start = time()
+        try:
+            yield
+        finally:
+            seconds = time() - start
+            self.stack.pop()
+            self.add(group, name, phase, seconds)
+
+    def add(self, group, name, phase, seconds):
+        key = (group, name, phase)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = PhaseStats()
+        stats.add(seconds)
+        for hook in self.hooks:
+            hook(group, name, phase, seconds)
+
+    def dump(self):
+        """Returns the measures as a list of dictionaries that can be
+        serialized to JSON and loaded with :meth:`merge`"""
+        dump = []
+        for (group, name, phase), stats in sorted(self.stats.items()):
+            values = stats.as_dict()
+            values.update(group=group, name=name, phase=phase)
+            dump.append(values)
+        return dump
+
+    def merge(self, dump):
+        """Add the measures of ``dump``, for instance the measures
+        of a worker process"""
+        for values in dump:
+            key = (values['group'], values['name'], values['phase'])
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = PhaseStats()
+            stats.merge(PhaseStats.from_dict(values))
+
+    def summary(self):
+        """Returns a table of the measures"""
+        header = ('phase', 'count', 'total s', 'mean ms', 'p95 ms', 'max ms')
+        rows = []
+        for (group, name, phase), stats in sorted(self.stats.items()):
+            rows.append((
+                u'%s %s %s' % (group, name, phase),
+                u'%d' % stats.count,
+                u'%.3f' % stats.total,
+                u'%.3f' % (stats.mean() * 1000),
+                u'%.3f' % (stats.percentile(95) * 1000),
+                u'%.3f' % (stats.max * 1000),
+            ))
+        width = max([len(row[0]) for row in rows] + [len(header[0])])
+        lines = []
+        for row in [header] + rows:
+            line = row[0].ljust(width)
+            line += u''.join([column.rjust(12) for column in row[1:]])
+            lines.append(line)
+        return u'\n'.join(lines)
+
+
+timings = Timings()  # measures of the current process
@@ -1,12 +1,26 @@
 import os
+import stat
+import hashlib
 import logging
 import shutil
 import traceback
 
 from django.conf import settings
+from django.db import connections, router, transaction, DatabaseError
+from django.db.models.fields import AutoField
 from django.utils.importlib import import_module
 
 
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # backport of os.scandir for Python < 3.5
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
 log = logging.getLogger('swallow.util')
 
 
@@ -36,6 +50,91 @@ def is_utf8(s):
         return False
 
 
+class DirEntry(object):
+    """Minimal replacement of :class:`os.DirEntry` used when ``scandir``
+    is not available, the result of ``stat`` is cached so that an entry
+    costs at most one system call."""
+
+    def __init__(self, dir, name):
+        self.name = name
+        self.path = os.path.join(dir, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def __repr__(self):
+        return '<DirEntry %r>' % self.name
+
+
+def scandir(path, names=None):
+    """Return the entries of directory ``path`` as :class:`os.DirEntry`
+    like objects, file type and ``stat`` results are cached by the entries.
+
+    If ``names`` is provided it's used as the content of the directory
+    instead of listing it.
+    """
+    if names is None:
+        if _scandir is not None:
+            return list(_scandir(path))
+        names = os.listdir(path)
+    return [DirEntry(path, name) for name in names]
+
+
+def iterdir(path):
+    """Yield the names of the entries of directory ``path`` without
+    building the whole list when ``scandir`` is available."""
+    if _scandir is not None:
+        for entry in _scandir(path):
+            yield entry.name
+    else:
+        for name in os.listdir(path):
+            yield name
+
+
+def count_files(path):
+    """Returns the number of files in directory ``path`` and its
+    subdirectories, ``0`` if it doesn't exist."""
+    count = 0
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = scandir(directory)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                directories.append(entry.path)
+            else:
+                count += 1
+    return count
+
+
+def file_digest(path, chunk_size=64 * 1024):
+    """Return the hexadecimal sha256 digest of the content of the file
+    found at ``path``, the file is read by chunks."""
+    digest = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
 def smart_decode(s):
     """Convert a str to unicode when you cannot be sure of its encoding."""
     if isinstance(s, unicode):
@@ -67,20 +166,122 @@ def move_file(src, dst):
             log.error(log_msg)
 
 
+def insert_many(model, instances, batch_size=100):
+    """Insert new ``instances`` of ``model`` with multi-rows INSERT
+    statements of ``batch_size`` rows, this is a simple replacement of
+    ``bulk_create`` which is not available before Django 1.4.
+
+    Like ``bulk_create``, ``save`` is not called, signals are not sent
+    and primary keys of ``instances`` are not set.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    opts = model._meta
+    fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES ' % (
+        qn(opts.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+    )
+    placeholder = '(%s)' % ', '.join(['%s'] * len(fields))
+    rows = []
+    for instance in instances:
+        rows.append([
+            f.get_db_prep_save(f.pre_save(instance, True), connection=connection)
+            for f in fields
+        ])
+    cursor = connection.cursor()
+    try:
+        if connection.vendor in ('postgresql', 'mysql'):
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                params = []
+                for row in batch:
+                    params.extend(row)
+                cursor.execute(sql + ', '.join([placeholder] * len(batch)), params)
+        else:
+            # sqlite and oracle do not support multi-rows VALUES in all versions
+            cursor.executemany(sql + placeholder, rows)
+    except DatabaseError:
+        # do not keep the rows inserted before the error
+        transaction.rollback_unless_managed(using=using)
+        raise
+    transaction.commit_unless_managed(using=using)
+
+
+class ConfigurationRegistry(object):
+    """Process-wide registry of the configuration classes listed in
+    ``SWALLOW_CONFIGURATION_MODULES``.
+
+    Modules are imported once, the registry is built again when the
+    setting changes or when :meth:`reload` is called. Configurations can
+    be looked up by class name or by the lowercase name used for their
+    directories."""
+
+    def __init__(self):
+        self.reload()
+
+    def reload(self):
+        """Forget imported configurations"""
+        self._classes = {}  # configuration class by module path
+        self._modules = None  # value of the setting the registry is built for
+        self._by_name = {}
+        self._by_directory = {}
+
+    def get_config(self, path):
+        """Return a config class from its module path"""
+        config_class = self._classes.get(path)
+        if config_class is None:
+            import_config_module = path.split('.')
+            class_name = import_config_module[-1]
+            import_config_module = '.'.join(import_config_module[:-1])
+            config_module = import_module(import_config_module)
+            config_class = getattr(config_module, class_name)
+            self._classes[path] = config_class
+        return config_class
+
+    def _build(self):
+        modules = tuple(getattr(settings, "SWALLOW_CONFIGURATION_MODULES", []))
+        if modules != self._modules:
+            self._by_name = {}
+            self._by_directory = {}
+            for path in modules:
+                config_class = self.get_config(path)
+                self._by_name[config_class.__name__] = config_class
+                self._by_directory[config_class.__name__.lower()] = config_class
+            self._modules = modules
+
+    def all(self):
+        """Returns the configurations by class name"""
+        self._build()
+        return dict(self._by_name)
+
+    def get(self, name):
+        """Returns the configuration named ``name`` or whose directory
+        is ``name``, raises ``KeyError`` if there is none"""
+        self._build()
+        config_class = self._by_name.get(name)
+        if config_class is None:
+            config_class = self._by_directory[name.lower()]
+        return config_class
+
+    def resolve(self, name):
+        """Returns the configuration of module path ``name``, or named
+        ``name`` in the registry"""
+        if '.' in name:
+            return self.get_config(name)
+        return self.get(name)
+
+
+configurations = ConfigurationRegistry()
+
+
 def get_config(path):
     """
     Return a config class from its module path.
     """
-    import_config_module = path.split('.')
-    class_name = import_config_module[-1]
-    import_config_module = '.'.join(import_config_module[:-1])
-    config_module = import_module(import_config_module)
-    return getattr(config_module, class_name)
+    return configurations.get_config(path)
 
 # list configurations classes
 def get_configurations():
-    CONFIGURATIONS = {}
-    for path in getattr(settings, "SWALLOW_CONFIGURATION_MODULES", []):
-        config_class = get_config(path)
-        CONFIGURATIONS[config_class.__name__] = config_class
-    return CONFIGURATIONS
+    return configurations.all()
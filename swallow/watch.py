@@ -0,0 +1,229 @@
+import os
+import heapq
+import logging
+
+from time import time, sleep
+
+from django.db import reset_queries, close_connection
+from django.utils.text import force_unicode
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+log = logging.getLogger('swallow.watch')
+
+
+class Watcher(object):
+    """Long running process that runs configurations as soon as files
+    are written or moved in their input directory.
+
+    Filesystem events are received through inotify with `pyinotify
+    <https://github.com/seb-m/pyinotify>`_. If it's not installed or
+    if the input directory of a configuration doesn't support events
+    the configuration is run every ``interval`` seconds.
+
+    Files are processed after ``QUARANTINE`` seconds thanks to timers
+    and each configuration is fully run every ``rescan`` seconds to
+    clean old secondary files.
+    """
+
+    def __init__(self, configs, interval=60, rescan=60 * 60):
+        self.configs = configs
+        self.interval = interval
+        self.rescan = rescan
+
+        self.timers = []  # heap of ``(due, index, partial_file_path)``
+                          # where ``index`` is the configuration index
+        self.scheduled = set()  # ``(index, partial_file_path)`` in timers
+        self.ignored = {}  # modification time of the files moved back to
+                           # input dir by swallow itself by
+                           # ``(index, partial_file_path)``
+        self.runs = [0] * len(configs)  # due time of next full run
+        self.polled = set()  # index of configurations without events
+
+    def due(self, index, partial_file_path, now):
+        """Returns the time when ``partial_file_path`` is processed by the
+        configuration at ``index`` according to its ``QUARANTINE`` and
+        the last modification of the file, ``None`` if it doesn't exist
+        anymore"""
+        config = self.configs[index]
+        if config.QUARANTINE <= 0:
+            return now
+        path = os.path.join(config.input_dir(), partial_file_path)
+        try:
+            return os.stat(path).st_mtime + config.QUARANTINE
+        except OSError:
+            return None  # the file was already moved
+
+    def schedule(self, index, partial_file_path, now=None):
+        """Schedule processing of ``partial_file_path`` by the configuration
+        at ``index`` according to its ``QUARANTINE``"""
+        key = (index, partial_file_path)
+        if key in self.ignored:
+            mtime = self.ignored.pop(key)
+            path = os.path.join(self.configs[index].input_dir(), partial_file_path)
+            try:
+                if os.stat(path).st_mtime == mtime:
+                    return
+            except OSError:
+                return
+            # the file was written again since it was moved back
+        if key in self.scheduled:
+            return
+        if now is None:
+            now = time()
+        due = self.due(index, partial_file_path, now)
+        if due is None:
+            return
+        self.scheduled.add(key)
+        heapq.heappush(self.timers, (due, index, partial_file_path))
+
+    def ignore(self, index, partial_file_paths):
+        """Ignore the next event of files moved back to input directory,
+        they will be processed by the next full run"""
+        input_dir = self.configs[index].input_dir()
+        for partial_file_path in partial_file_paths:
+            try:
+                mtime = os.stat(os.path.join(input_dir, partial_file_path)).st_mtime
+            except OSError:
+                continue
+            self.ignored[(index, partial_file_path)] = mtime
+
+    def process_due(self, now=None):
+        """Process files and full runs which are due, returns the number
+        of seconds until the next timer"""
+        if now is None:
+            now = time()
+
+        # --- Full runs
+        for index, config in enumerate(self.configs):
+            if self.runs[index] <= now:
+                period = index in self.polled and self.interval or self.rescan
+                self.runs[index] = now + period
+                try:
+                    config.run()
+                except Exception:
+                    # the next run will retry, for instance after
+                    # a database error
+                    self.failed(config, u'run')
+                    continue
+                reset_queries()
+                # events of files restored before are processed by this run
+                # or never received when polling
+                for key in [key for key in self.ignored if key[0] == index]:
+                    del self.ignored[key]
+                self.ignore(index, config.restored)
+
+        # --- Files
+        due = {}
+        while self.timers and self.timers[0][0] <= now:
+            _, index, partial_file_path = heapq.heappop(self.timers)
+            # the file may have been written again during its quarantine
+            next_due = self.due(index, partial_file_path, now)
+            if next_due is None:
+                self.scheduled.discard((index, partial_file_path))
+                continue
+            if next_due > now:
+                heapq.heappush(self.timers, (next_due, index, partial_file_path))
+                continue
+            self.scheduled.discard((index, partial_file_path))
+            due.setdefault(index, []).append(partial_file_path)
+        for index, partial_file_paths in sorted(due.items()):
+            config = self.configs[index]
+            try:
+                restored = config.process_endpoints(partial_file_paths)
+            except Exception:
+                # files left in input directory are processed by the
+                # next full run
+                self.failed(config, u'processing of %s' % u', '.join(
+                    force_unicode(p) for p in partial_file_paths))
+                continue
+            reset_queries()
+            self.ignore(index, restored)
+
+        timeout = min(self.runs) - now
+        if self.timers:
+            timeout = min(timeout, self.timers[0][0] - now)
+        return max(timeout, 0)
+
+    def failed(self, config, what):
+        """Log the exception raised by ``what`` of ``config``, the
+        connection is closed so that the next run opens a new one"""
+        log.error(
+            u'%s of %s failed' % (what, type(config).__name__),
+            exc_info=True,
+        )
+        reset_queries()
+        close_connection()
+
+    def handler(self, index):
+        """Returns the inotify events handler of the configuration
+        at ``index``"""
+        return _EventHandler(
+            watcher=self,
+            index=index,
+            input_dir=self.configs[index].input_dir(),
+        )
+
+    def watch(self):
+        """Watch input directories with inotify forever"""
+        manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+        for index, config in enumerate(self.configs):
+            input_dir = config.input_dir()
+            wdd = manager.add_watch(
+                input_dir,
+                mask,
+                proc_fun=self.handler(index),
+                rec=True,
+                auto_add=True,
+            )
+            if [wd for wd in wdd.values() if wd < 0]:
+                log.warning(u'no events for %s, fall back to polling' % input_dir)
+                self.polled.add(index)
+        notifier = pyinotify.Notifier(manager)
+        while True:
+            timeout = self.process_due()
+            if notifier.check_events(timeout * 1000):
+                notifier.read_events()
+                notifier.process_events()
+
+    def poll(self):
+        """Run configurations every ``interval`` seconds forever"""
+        self.polled = set(range(len(self.configs)))
+        while True:
+            timeout = self.process_due()
+            sleep(timeout)
+
+    def run(self):
+        if pyinotify is None:
+            log.warning(u'pyinotify is not installed, fall back to polling')
+            self.poll()
+        else:
+            self.watch()
+
+
+if pyinotify is not None:
+
+    class _EventHandler(pyinotify.ProcessEvent):
+        """Schedule files written or moved in a configuration input
+        directory"""
+
+        def my_init(self, watcher, index, input_dir):
+            self.watcher = watcher
+            self.index = index
+            self.input_dir = input_dir
+
+        def process_default(self, event):
+            if event.dir:
+                return
+            if not event.mask & (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO):
+                # IN_CREATE is added by auto_add, the file is still
+                # being written
+                return
+            partial_file_path = os.path.relpath(event.pathname, self.input_dir)
+            log.info(u'event %s on %s' % (event.maskname, partial_file_path))
+            self.watcher.schedule(self.index, partial_file_path)